@@ -0,0 +1,122 @@
+#! /usr/bin/env python3
+
+""" Aligns several runs of a map note by note & computes statistics across runs.
+
+    Runs are put in a 2-D array (runs x notes) indexed by note `id`, a note missing
+    from a run (fail, missed note, broken record) being NaN. Statistics are then
+    computed column-wise with numpy, ignoring the missing notes, instead of
+    averaging lists by position.
+"""
+
+import numpy as np
+
+
+SERIES = {
+    "Acc": lambda column: column("score0") + column("score1") + column("score2"),
+    "Preswing": lambda column: column("score0"),
+    "Hit timing": lambda column: column("timeDeviation") * 1000,  # in milliseconds
+    "Precision": lambda column: column("score1"),
+    "Postswing": lambda column: column("score2"),
+}
+HANDS = {"left": 0, "right": 1}
+ALIGNED_COLUMNS = ("noteType", "time", "score0", "score1", "score2", "timeDeviation")
+
+
+def as_arrays(columns, names=None):
+    """ NoteStore columns (array("d")) to numpy arrays, without copy """
+    return {
+        name: np.frombuffer(column, dtype=np.float64)
+        for name, column in columns.items()
+        if names is None or name in names
+    }
+
+
+def align_runs(runs_columns, columns=ALIGNED_COLUMNS):
+    """ Returns (ids, {column: runs x notes array}) of runs_columns aligned by note id """
+    runs = []
+    for run_columns in runs_columns:
+        run = as_arrays(run_columns, ("id",) + tuple(columns))
+        valid = ~np.isnan(run["id"]) & (run["id"] >= 0)
+        if not valid.all():
+            run = {name: values[valid] for name, values in run.items()}
+        if run["id"].size:
+            runs.append(run)
+    if not runs:
+        return np.empty(0), {}
+
+    # Note ids are small non negative integers : a presence table gives the sorted
+    # ids & the column of each note in O(n), where np.unique would sort everything
+    all_ids = np.concatenate([run["id"] for run in runs]).astype(np.intp)
+    present = np.zeros(all_ids.max() + 1, dtype=bool)
+    present[all_ids] = True
+    ids = np.flatnonzero(present)
+    notes = (np.cumsum(present) - 1)[all_ids]
+    # Row (run) of every note of every run, so that each column is filled with one
+    # assignment instead of one per run
+    rows = np.repeat(np.arange(len(runs)), [run["id"].size for run in runs])
+    flat_positions = rows * ids.size + notes
+    aligned = {}
+    for name in columns:
+        aligned[name] = np.full((len(runs), ids.size), np.nan)
+        # A note id appearing twice in a run keeps its last occurence
+        aligned[name].ravel()[flat_positions] = np.concatenate([run[name] for run in runs])
+    return ids, aligned
+
+
+def nan_percentiles(values, percentiles):
+    """ Column-wise percentiles ignoring NaN (much faster than np.nanpercentile on 2-D arrays) """
+    sorted_values = np.sort(values, axis=0)  # NaN are sorted last
+    count = np.count_nonzero(~np.isnan(values), axis=0)
+    results = []
+    for percentile in percentiles:
+        position = np.maximum(count - 1, 0) * percentile / 100
+        below = np.floor(position).astype(np.intp)
+        above = np.ceil(position).astype(np.intp)
+        low_values = np.take_along_axis(sorted_values, below[np.newaxis, :], axis=0)[0]
+        high_values = np.take_along_axis(sorted_values, above[np.newaxis, :], axis=0)[0]
+        result = low_values + (high_values - low_values) * (position - below)
+        result[count == 0] = np.nan
+        results.append(result)
+    return count, results
+
+
+def runs_statistics(aligned, low=10, high=90, series_names=None):
+    """ Mean, median & [low, high] percentile band of each series, per hand.
+        series_names restricts the computation to some series (like "Acc (left)").
+
+        Returns ({"Left notes timing": times, ...}, {"Acc (left)": stats, ...}) where
+        stats is a dict of "mean", "median", "low", "high" & "count" arrays.
+    """
+    all_x = {}
+    all_stats = {}
+    if not aligned:
+        return all_x, all_stats
+
+    for hand, note_type in HANDS.items():
+        # noteType of a note is the same in every run, NaN where the note is missing
+        hand_notes = np.any(aligned["noteType"] == note_type, axis=0)
+        hand_columns = {}
+
+        def column(name, hand_notes=hand_notes, hand_columns=hand_columns):
+            # Only the columns needed by the requested series are sliced
+            if name not in hand_columns:
+                hand_columns[name] = aligned[name][:, hand_notes]
+            return hand_columns[name]
+
+        _, (median_time,) = nan_percentiles(column("time"), (50,))
+        all_x[f"{hand.capitalize()} notes timing"] = median_time
+
+        for series, compute in SERIES.items():
+            if series_names is not None and f"{series} ({hand})" not in series_names:
+                continue
+            values = compute(column)
+            count, (low_band, median, high_band) = nan_percentiles(values, (low, 50, high))
+            with np.errstate(all="ignore"):
+                all_stats[f"{series} ({hand})"] = {
+                    "mean": np.nansum(values, axis=0) / count,
+                    "median": median,
+                    "low": low_band,
+                    "high": high_band,
+                    "count": count,
+                }
+    return all_x, all_stats
@@ -0,0 +1,137 @@
+#! /usr/bin/env python3
+
+""" Per grid cell & per cut direction statistics of every note of every run.
+
+    Notes of all runs are concatenated into flat arrays, each note gets a group key
+    (player, hand, grid cell, direction) & sums are computed for all the groups at
+    once with np.bincount, so millions of notes take seconds.
+"""
+
+import json
+
+import numpy as np
+
+from analysis.alignment import as_arrays
+
+
+HANDS = ("left", "right")
+NB_CELLS = 12  # index goes from 0 (bottom left) to 11 (top right)
+DIRECTIONS = ("up", "down", "left", "right", "upleft", "upright", "downleft", "downright", "any", "none", "unknown")
+UNKNOWN_DIRECTION = DIRECTIONS.index("unknown")  # v1 notes have no direction
+METRICS = {
+    "preswing": lambda run: run["score0"],
+    "precision": lambda run: run["score1"],
+    "postswing": lambda run: run["score2"],
+    "timeDeviation": lambda run: run["timeDeviation"] * 1000,  # in milliseconds
+}
+HEATMAP_COLUMNS = ("noteType", "index", "noteDirection", "cutType", "score0", "score1", "score2", "timeDeviation")
+
+
+def notes_by_group(note_store):
+    """ Concatenates the notes of every run & returns (players, group keys, miss flags, metrics) """
+    players = []
+    players_idx = {}
+    keys = []
+    misses = []
+    metrics = {metric: [] for metric in METRICS}
+
+    for map_name in note_store.map_names():
+        for player_name, runs in note_store.columns_of_map(map_name).items():
+            player_idx = players_idx.setdefault(player_name, len(players))
+            if player_idx == len(players):
+                players.append(player_name)
+            for columns in runs:
+                run = as_arrays(columns, HEATMAP_COLUMNS)
+                valid = (
+                    ~np.isnan(run["noteType"])
+                    & np.isin(run["noteType"], (0, 1))
+                    & ~np.isnan(run["index"])
+                    & (run["index"] >= 0)
+                    & (run["index"] < NB_CELLS)
+                )
+                run = {name: values[valid] for name, values in run.items()}
+                direction = np.where(np.isnan(run["noteDirection"]), UNKNOWN_DIRECTION, run["noteDirection"])
+                direction = np.clip(direction, 0, UNKNOWN_DIRECTION)
+                keys.append(
+                    ((player_idx * len(HANDS) + run["noteType"]) * NB_CELLS + run["index"]) * len(DIRECTIONS)
+                    + direction
+                )
+                # cutType : 0 = cut, 1 = miss, 2 = badcut (v1/v2 notes only log cut notes)
+                misses.append(np.nan_to_num(run["cutType"]) != 0)
+                for metric, compute in METRICS.items():
+                    metrics[metric].append(compute(run))
+
+    if not keys:
+        return players, np.empty(0, dtype=np.intp), np.empty(0, dtype=bool), {}
+    return (
+        players,
+        np.concatenate(keys).astype(np.intp),
+        np.concatenate(misses),
+        {metric: np.concatenate(values) for metric, values in metrics.items()},
+    )
+
+
+def heatmap_statistics(note_store):
+    """ Returns (players, stats) where stats arrays are shaped (players, hands, cells, directions) """
+    players, keys, misses, metrics = notes_by_group(note_store)
+    shape = (len(players), len(HANDS), NB_CELLS, len(DIRECTIONS))
+    nb_groups = int(np.prod(shape))
+
+    stats = {
+        "notes": np.bincount(keys, minlength=nb_groups),
+        "misses": np.bincount(keys, weights=misses, minlength=nb_groups),
+    }
+    cut = ~misses
+    for metric, values in metrics.items():
+        has_value = cut & ~np.isnan(values)
+        count = np.bincount(keys[has_value], minlength=nb_groups)
+        total = np.bincount(keys[has_value], weights=values[has_value], minlength=nb_groups)
+        squares = np.bincount(keys[has_value], weights=values[has_value] ** 2, minlength=nb_groups)
+        with np.errstate(all="ignore"):
+            mean = total / count
+            stats[f"{metric}_mean"] = mean
+            stats[f"{metric}_std"] = np.sqrt(np.maximum(squares / count - mean ** 2, 0))
+
+    return players, {name: values.reshape(shape) for name, values in stats.items()}
+
+
+def write_heatmaps(note_store, name_prefix, name_of_player=None):
+    """ Writes {name_prefix}.csv (one line per non empty group) & {name_prefix}.json (grids per player/hand/direction)
+        name_of_player resolves the player keys of note_store (ids) into names
+    """
+    players, stats = heatmap_statistics(note_store)
+    if name_of_player:
+        players = [name_of_player(player) for player in players]
+    metric_names = [name for name in stats if name not in ("notes", "misses")]
+
+    with open(f"{name_prefix}.csv", "w") as csvf:
+        csvf.write(f"Player,Hand,Cell,Direction,Notes,Misses,{','.join(metric_names)}\n")
+        for player_idx, hand_idx, cell, direction in zip(*np.nonzero(stats["notes"])):
+            group = (player_idx, hand_idx, cell, direction)
+            values = ",".join(
+                "" if np.isnan(stats[name][group]) else f"{stats[name][group]:.2f}" for name in metric_names
+            )
+            csvf.write(
+                f"{players[player_idx]},{HANDS[hand_idx]},{cell},{DIRECTIONS[direction]},{stats['notes'][group]},{int(stats['misses'][group])},{values}\n"
+            )
+
+    heatmaps = {}
+    for player_idx, player_name in enumerate(players):
+        heatmaps[player_name] = {}
+        for hand_idx, hand in enumerate(HANDS):
+            heatmaps[player_name][hand] = {}
+            for direction_idx, direction in enumerate(DIRECTIONS):
+                if not stats["notes"][player_idx, hand_idx, :, direction_idx].any():
+                    continue
+                heatmaps[player_name][hand][direction] = {
+                    # Grids are 3 rows (bottom to top) of 4 cells (left to right) : cell index = row * 4 + column
+                    name: [
+                        [None if np.isnan(value) else round(float(value), 2) for value in row]
+                        for row in values[player_idx, hand_idx, :, direction_idx].reshape(3, 4)
+                    ]
+                    for name, values in stats.items()
+                }
+    with open(f"{name_prefix}.json", "w") as jsonf:
+        json.dump(heatmaps, jsonf)
+
+    return f"{name_prefix}.csv", f"{name_prefix}.json"
@@ -0,0 +1,180 @@
+#! /usr/bin/env python3
+
+""" Time-windowed (or per-N-notes) analysis of runs, to see where accuracy is lost.
+
+    A window spec is either "5s" (5 seconds windows, using the note `time`) or
+    "20n" (windows of 20 notes, using the note `id` so that windows of different
+    runs of a map hold the same notes). Several comma-separated specs ("5s,20n")
+    are computed from the same reads of the runs.
+"""
+
+from contextlib import ExitStack
+
+import numpy as np
+
+from analysis.alignment import as_arrays
+
+
+SECTION_COLUMNS = ("id", "time", "cutType", "score0", "score1", "score2", "timeDeviation")
+
+
+def parse_window_spec(spec):
+    """ "5s" -> ("s", 5.0), "20n" -> ("n", 20.0) """
+    spec = spec.strip().lower()
+    unit = spec[-1:] if spec[-1:] in ("s", "n") else "s"
+    try:
+        size = float(spec.rstrip("sn"))
+    except ValueError as err:
+        raise ValueError(f"Window spec must be like '5s' (seconds) or '20n' (notes), not '{spec}'") from err
+    if not size > 0:
+        raise ValueError(f"Window size must be positive : {spec}")
+    return unit, size
+
+
+def parse_window_specs(specs):
+    """ "5s,20n" -> [("s", 5.0), ("n", 20.0)] (each spec once) """
+    parsed = []
+    for spec in specs.split(","):
+        window_spec = parse_window_spec(spec)
+        if window_spec not in parsed:
+            parsed.append(window_spec)
+    return parsed
+
+
+def run_windows(columns, unit, size):
+    """ Windowed statistics of one run : arrays indexed by window number """
+    run = as_arrays(columns, SECTION_COLUMNS)
+    if not run["id"].size:
+        return {"notes": np.zeros(0)}
+    position = run["time"] if unit == "s" else run["id"]
+    valid = ~np.isnan(position) & (position >= 0)
+    run = {name: values[valid] for name, values in run.items()}
+    window = (run["time" if unit == "s" else "id"] // size).astype(np.intp)
+    nb_windows = int(window.max()) + 1 if window.size else 0
+
+    # cutType : 0 = cut, 1 = miss, 2 = badcut (v1/v2 notes only log cut notes)
+    missed = np.nan_to_num(run["cutType"]) != 0
+    acc = run["score0"] + run["score1"] + run["score2"]
+    has_acc = ~missed & ~np.isnan(acc)
+    deviation = run["timeDeviation"] * 1000  # in milliseconds
+    has_deviation = ~missed & ~np.isnan(deviation)
+
+    notes = np.bincount(window, minlength=nb_windows)
+    nb_acc = np.bincount(window[has_acc], minlength=nb_windows)
+    nb_deviation = np.bincount(window[has_deviation], minlength=nb_windows)
+    sum_deviation = np.bincount(window[has_deviation], weights=deviation[has_deviation], minlength=nb_windows)
+    squares_deviation = np.bincount(
+        window[has_deviation], weights=deviation[has_deviation] ** 2, minlength=nb_windows
+    )
+    with np.errstate(all="ignore"):
+        mean_deviation = sum_deviation / nb_deviation
+        return {
+            "notes": notes,
+            "misses": np.bincount(window, weights=missed, minlength=nb_windows),
+            "acc": np.bincount(window[has_acc], weights=acc[has_acc], minlength=nb_windows) / nb_acc,
+            "timing_mean": mean_deviation,
+            "timing_std": np.sqrt(np.maximum(squares_deviation / nb_deviation - mean_deviation ** 2, 0)),
+        }
+
+
+class WindowedRuns:
+    """ Computes windowed statistics of the runs of a NoteStore, caching them per run & window spec.
+        The columns of a map are read once from the store for all the specs & dropped (drop) once
+        they are written, only the windowed arrays (a few values per window) are kept
+    """
+
+    def __init__(self, note_store):
+        self.note_store = note_store
+        self.cache = {}
+        self.columns = {}
+
+    def runs(self, map_name):
+        """ {player_name: [columns of each run]} of map_name, read once """
+        if map_name not in self.columns:
+            self.columns[map_name] = self.note_store.columns_of_map(map_name)
+        return self.columns[map_name]
+
+    def drop(self, map_name):
+        """ Forgets the columns of map_name (spilled runs go back to the scratch file only) """
+        self.columns.pop(map_name, None)
+
+    def windows(self, map_name, player_name, run_idx, unit, size):
+        key = (map_name, player_name, run_idx, unit, size)
+        if key not in self.cache:
+            self.cache[key] = run_windows(self.runs(map_name)[player_name][run_idx], unit, size)
+        return self.cache[key]
+
+    def map_windows(self, map_name, unit, size):
+        """ Windows of every run of map_name & the mean accuracy of each window over all of them """
+        per_run = {}
+        for player_name, runs in self.runs(map_name).items():
+            for run_idx in range(len(runs)):
+                per_run[(player_name, run_idx)] = self.windows(map_name, player_name, run_idx, unit, size)
+
+        nb_windows = max((stats["notes"].size for stats in per_run.values()), default=0)
+        acc_sum = np.zeros(nb_windows)
+        acc_count = np.zeros(nb_windows)
+        for stats in per_run.values():
+            if "acc" not in stats:
+                continue
+            known = ~np.isnan(stats["acc"])
+            acc_sum[: known.size][known] += stats["acc"][known]
+            acc_count[: known.size][known] += 1
+        with np.errstate(all="ignore"):
+            return per_run, acc_sum / acc_count
+
+
+def write_map_sections(csvf, windowed, map_key, window_spec, name_of_map, name_of_player):
+    unit, size = window_spec
+    per_run, map_acc = windowed.map_windows(map_key, unit, size)
+    map_name = name_of_map(map_key)
+    print(f"{map_name} (windows of {size:g}{' seconds' if unit == 's' else ' notes'})")
+    players_delta = {}
+    for (player_key, run_idx), stats in per_run.items():
+        if "acc" not in stats:
+            continue
+        player_name = name_of_player(player_key)
+        delta = stats["acc"] - map_acc[: stats["acc"].size]
+        for window in np.flatnonzero(stats["notes"]):
+            csvf.write(
+                f"{map_name},{player_name},{run_idx + 1},{window},{window * size:g},{(window + 1) * size:g},"
+                f"{stats['notes'][window]},{stats['acc'][window]:.2f},{int(stats['misses'][window])},"
+                f"{stats['timing_mean'][window]:.2f},{stats['timing_std'][window]:.2f},{delta[window]:.2f}\n"
+            )
+        players_delta.setdefault(player_name, []).append(delta)
+
+    # Worst window of each player, all runs of that player averaged
+    for player_name, deltas in players_delta.items():
+        longest = max(delta.size for delta in deltas)
+        padded = np.full((len(deltas), longest), np.nan)
+        for position, delta in enumerate(deltas):
+            padded[position, : delta.size] = delta
+        with np.errstate(all="ignore"):
+            player_delta = np.nanmean(padded, axis=0) if len(deltas) > 1 else padded[0]
+        if np.isnan(player_delta).all():
+            continue
+        worst = int(np.nanargmin(player_delta))
+        print(
+            f"     {player_name:28} loses most in window {worst} ({worst * size:g}-{(worst + 1) * size:g}{unit}) : {player_delta[worst]:+.2f} vs map average"
+        )
+    print()
+
+
+def write_sections(note_store, window_specs, map_keys, csv_files, name_of_map=None, name_of_player=None):
+    """ Writes windowed stats of every run of map_keys, for each window spec (of parse_window_specs)
+        into its csv file (csv_files, in the same order) & prints the worst section of each player
+        name_of_map & name_of_player resolve the keys of note_store (ids) into names
+    """
+    name_of_map = name_of_map or (lambda key: key)
+    name_of_player = name_of_player or (lambda key: key)
+    windowed = WindowedRuns(note_store)
+
+    with ExitStack() as stack:
+        csvfs = [stack.enter_context(open(csv_file, "w")) for csv_file in csv_files]
+        for csvf in csvfs:
+            csvf.write("Map,Player,Run,Window,Start,End,Notes,Acc,Misses,Timing Mean,Timing Std,Acc vs map average\n")
+        # Maps outside, specs inside : only the columns of one map are in memory at a time
+        for map_key in map_keys:
+            for window_spec, csvf in zip(window_specs, csvfs):
+                write_map_sections(csvf, windowed, map_key, window_spec, name_of_map, name_of_player)
+            windowed.drop(map_key)
@@ -0,0 +1,171 @@
+#! /usr/bin/env python3
+
+""" Swing statistics from the cutPoint & saberDir vectors of v2/v3 notes.
+
+    For every cut note :
+      - angle deviation : signed angle (degrees) between the saber direction
+        (projected on the grid plane) & the direction the note asks for
+      - cut offset : distance (cm) between the note center & the line of the cut
+        (the line through cutPoint along the saber direction)
+    Notes of all runs are concatenated into flat arrays & every metric is summed
+    per (player, map, hand) with np.bincount, like heatmaps. Consistency is the
+    mean resultant length of the deviation angles : 1 when a player always
+    deviates the same way, 0 when deviations are spread all around.
+"""
+
+import numpy as np
+
+from analysis.alignment import as_arrays
+
+
+HANDS = ("left", "right")
+SWING_COLUMNS = ("noteType", "noteDirection", "index", "cutType", "cutPointX", "cutPointY", "saberDirX", "saberDirY")
+# Unit vector (x, y) of each cut direction : up, down, left, right, upleft, upright, downleft, downright
+# (any & none have no expected direction)
+DIAGONAL = np.sqrt(0.5)
+DIRECTION_VECTORS = np.array(
+    [
+        (0.0, 1.0),
+        (0.0, -1.0),
+        (-1.0, 0.0),
+        (1.0, 0.0),
+        (-DIAGONAL, DIAGONAL),
+        (DIAGONAL, DIAGONAL),
+        (-DIAGONAL, -DIAGONAL),
+        (DIAGONAL, -DIAGONAL),
+    ]
+)
+# Position (meters) of the center of the notes of each line (left to right) & layer (bottom to top)
+LINES_X = np.array((-0.9, -0.3, 0.3, 0.9))
+LAYERS_Y = np.array((0.85, 1.4, 1.9))
+SUMS = ("notes", "deviation", "deviation_abs", "deviation_abs_sq", "cos", "sin", "offset", "offset_sq")
+
+
+def swing_metrics(run):
+    """ (hand, angle deviation, cut offset) of the notes of run (arrays) that can be measured """
+
+    direction = run["noteDirection"]
+    index = run["index"]
+    valid = (
+        np.isin(run["noteType"], (0, 1))
+        & (direction >= 0)
+        & (direction < len(DIRECTION_VECTORS))
+        & (index >= 0)
+        & (index < len(LINES_X) * len(LAYERS_Y))
+        # cutType : 0 = cut, 1 = miss, 2 = badcut (v1/v2 notes only log cut notes)
+        & (np.nan_to_num(run["cutType"]) == 0)
+        & ~np.isnan(run["cutPointX"])
+        & ((run["saberDirX"] != 0) | (run["saberDirY"] != 0))
+    )
+    run = {name: values[valid] for name, values in run.items()}
+
+    saber = np.stack((run["saberDirX"], run["saberDirY"]), axis=1)
+    saber /= np.linalg.norm(saber, axis=1)[:, None]
+    expected = DIRECTION_VECTORS[run["noteDirection"].astype(np.intp)]
+    cross = expected[:, 0] * saber[:, 1] - expected[:, 1] * saber[:, 0]
+    dot = (expected * saber).sum(axis=1)
+    deviation = np.degrees(np.arctan2(cross, dot))
+
+    index = run["index"].astype(np.intp)
+    to_center_x = LINES_X[index % len(LINES_X)] - run["cutPointX"]
+    to_center_y = LAYERS_Y[index // len(LINES_X)] - run["cutPointY"]
+    # Distance from the note center to the cut line, in centimeters
+    offset = np.abs(saber[:, 0] * to_center_y - saber[:, 1] * to_center_x) * 100
+
+    return run["noteType"].astype(np.intp), deviation, offset
+
+
+def swing_sums(note_store):
+    """ Returns (players, maps, sums) where sums arrays are shaped (players, maps, hands) """
+
+    players = []
+    players_idx = {}
+    maps = list(note_store.map_names())
+    keys = []
+    deviations = []
+    offsets = []
+
+    for map_idx, map_name in enumerate(maps):
+        for player_name, runs in note_store.columns_of_map(map_name).items():
+            player_idx = players_idx.setdefault(player_name, len(players))
+            if player_idx == len(players):
+                players.append(player_name)
+            for columns in runs:
+                hands, deviation, offset = swing_metrics(as_arrays(columns, SWING_COLUMNS))
+                keys.append((player_idx * len(maps) + map_idx) * len(HANDS) + hands)
+                deviations.append(deviation)
+                offsets.append(offset)
+
+    shape = (len(players), len(maps), len(HANDS))
+    nb_groups = int(np.prod(shape))
+    keys = np.concatenate(keys) if keys else np.empty(0, dtype=np.intp)
+    deviation = np.concatenate(deviations) if deviations else np.empty(0)
+    offset = np.concatenate(offsets) if offsets else np.empty(0)
+    radians = np.radians(deviation)
+    weights = {
+        "notes": None,
+        "deviation": deviation,
+        "deviation_abs": np.abs(deviation),
+        "deviation_abs_sq": deviation ** 2,
+        "cos": np.cos(radians),
+        "sin": np.sin(radians),
+        "offset": offset,
+        "offset_sq": offset ** 2,
+    }
+    sums = {
+        name: np.bincount(keys, weights=values, minlength=nb_groups).reshape(shape) for name, values in weights.items()
+    }
+    return players, maps, sums
+
+
+def swing_statistics(sums):
+    """ Means, stds & consistency of sums (arrays of any shape) """
+
+    notes = sums["notes"]
+    with np.errstate(all="ignore"):
+        deviation_abs = sums["deviation_abs"] / notes
+        offset = sums["offset"] / notes
+        return {
+            "notes": notes,
+            "deviation_bias": sums["deviation"] / notes,
+            "deviation_abs_mean": deviation_abs,
+            "deviation_abs_std": np.sqrt(np.maximum(sums["deviation_abs_sq"] / notes - deviation_abs ** 2, 0)),
+            "consistency": np.hypot(sums["cos"], sums["sin"]) / notes,
+            "offset_mean": offset,
+            "offset_std": np.sqrt(np.maximum(sums["offset_sq"] / notes - offset ** 2, 0)),
+        }
+
+
+def write_swing_stats(note_store, csv_file, name_of_map=None, name_of_player=None):
+    """ Writes one line per player, map & hand (& per player & hand over all maps) into csv_file
+        name_of_map & name_of_player resolve the keys of note_store (ids) into names
+    """
+
+    players, maps, sums = swing_sums(note_store)
+    if name_of_player:
+        players = [name_of_player(player) for player in players]
+    if name_of_map:
+        maps = [name_of_map(map_key) for map_key in maps]
+    per_map = swing_statistics(sums)
+    overall = swing_statistics({name: values.sum(axis=1) for name, values in sums.items()})
+    metric_names = [name for name in per_map if name != "notes"]
+
+    def csv_values(stats, group):
+        return ",".join("" if np.isnan(stats[name][group]) else f"{stats[name][group]:.2f}" for name in metric_names)
+
+    with open(csv_file, "w") as csvf:
+        csvf.write(f"Player,Map,Hand,Notes,{','.join(metric_names)}\n")
+        for player_idx, player_name in enumerate(players):
+            for hand_idx, hand in enumerate(HANDS):
+                group = (player_idx, hand_idx)
+                if overall["notes"][group]:
+                    csvf.write(f"{player_name},all,{hand},{int(overall['notes'][group])},{csv_values(overall, group)}\n")
+            for map_idx, map_name in enumerate(maps):
+                for hand_idx, hand in enumerate(HANDS):
+                    group = (player_idx, map_idx, hand_idx)
+                    if per_map["notes"][group]:
+                        csvf.write(
+                            f"{player_name},{map_name},{hand},{int(per_map['notes'][group])},{csv_values(per_map, group)}\n"
+                        )
+
+    return csv_file
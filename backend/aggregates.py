@@ -0,0 +1,176 @@
+#! /usr/bin/env python3
+
+""" Mergeable partial aggregates of retrieve_relevant_infos results.
+
+    Aggregates are {"maps": map_dict, "averages": averages_dict, "maps_played": MAPS_PLAYED,
+    "extrema": min/max per player & per map} and can be stored as json between
+    invocations. In memory, maps & players are the ids of the symbol tables of
+    parse_logs, rekey_aggregates swaps them with names when saving & loading.
+    map_dict keeps the score of every run so ranks are recomputed
+    exactly after a merge, averages_dict only holds sums & counts.
+
+    merge_aggregates is associative : any set of sessions (a week, a month, the
+    whole season...) can be combined in any grouping, which is what
+    combine_partial_files relies on to merge partitions in parallel.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+from os import replace
+import json
+
+
+def empty_aggregates():
+    return {"maps": {}, "averages": {}, "maps_played": {}, "extrema": {"players": {}, "maps": {}}}
+
+
+def update_extrema(extrema, key, score, acc):
+    try:
+        current = extrema[key]
+        current["score_min"] = min(current["score_min"], score)
+        current["score_max"] = max(current["score_max"], score)
+        current["acc_min"] = min(current["acc_min"], acc)
+        current["acc_max"] = max(current["acc_max"], acc)
+    except KeyError:
+        extrema[key] = {"score_min": score, "score_max": score, "acc_min": acc, "acc_max": acc}
+
+
+def partial_aggregates(map_dict, averages_dict, maps_played):
+    """ Builds the partial aggregates of one session """
+    extrema = {"players": {}, "maps": {}}
+    for map_name, runs in map_dict.items():
+        for pinfos in runs:
+            acc = float(pinfos["acc"])
+            update_extrema(extrema["players"], pinfos["id"], pinfos["score"], acc)
+            update_extrema(extrema["maps"], map_name, pinfos["score"], acc)
+    return {
+        "maps": map_dict,
+        "averages": averages_dict,
+        "maps_played": maps_played,
+        "extrema": extrema,
+    }
+
+
+def merge_extrema(total, other):
+    merged = {key: dict(values) for key, values in total.items()}
+    for key, values in other.items():
+        update_extrema(merged, key, values["score_min"], values["acc_min"])
+        update_extrema(merged, key, values["score_max"], values["acc_max"])
+    return merged
+
+
+def merge_player_averages(total, other):
+    merged = dict(total)
+    for key, value in other.items():
+        if key == "id":
+            continue
+        if key in ("leftAv", "rightAv"):
+            merged[key] = tuple(map(sum, zip(total[key], value)))
+        else:
+            # Sums are added & lists of maps passed/failed concatenated
+            merged[key] = total[key] + value
+    return merged
+
+
+def merge_maps_played(total, other):
+    """ MAPS_PLAYED "count" is 1 + number of runs - number of distinct players,
+        so merging goes back to runs & players to stay exact.
+    """
+    merged = {map_name: {"count": infos["count"], "players": set(infos["players"])} for map_name, infos in total.items()}
+    for map_name, infos in other.items():
+        if map_name not in merged:
+            merged[map_name] = {"count": infos["count"], "players": set(infos["players"])}
+            continue
+        current = merged[map_name]
+        nb_runs = current["count"] + len(current["players"]) - 1 + infos["count"] + len(infos["players"]) - 1
+        current["players"].update(infos["players"])
+        current["count"] = nb_runs - len(current["players"]) + 1
+    return merged
+
+
+def merge_aggregates(total, other):
+    maps = {map_name: list(runs) for map_name, runs in total["maps"].items()}
+    for map_name, runs in other["maps"].items():
+        maps.setdefault(map_name, []).extend(runs)
+
+    averages = dict(total["averages"])
+    for name, pinfos in other["averages"].items():
+        averages[name] = merge_player_averages(averages[name], pinfos) if name in averages else pinfos
+
+    return {
+        "maps": maps,
+        "averages": averages,
+        "maps_played": merge_maps_played(total["maps_played"], other["maps_played"]),
+        "extrema": {
+            "players": merge_extrema(total["extrema"]["players"], other["extrema"]["players"]),
+            "maps": merge_extrema(total["extrema"]["maps"], other["extrema"]["maps"]),
+        },
+    }
+
+
+def rekey_aggregates(aggregates, map_key, player_key):
+    """ Copy of aggregates with every map & player replaced by map_key(map) & player_key(player)
+        (ids to names before saving, names to ids after loading)
+    """
+    maps = {
+        map_key(map_name): [dict(pinfos, id=player_key(pinfos["id"])) for pinfos in runs]
+        for map_name, runs in aggregates["maps"].items()
+    }
+    averages = {
+        player_key(name): dict(
+            pinfos,
+            id=player_key(pinfos["id"]),
+            list_map_passed=[map_key(map_name) for map_name in pinfos["list_map_passed"]],
+            list_map_failed=[map_key(map_name) for map_name in pinfos["list_map_failed"]],
+        )
+        for name, pinfos in aggregates["averages"].items()
+    }
+    maps_played = {
+        map_key(map_name): {"count": infos["count"], "players": [player_key(player) for player in infos["players"]]}
+        for map_name, infos in aggregates["maps_played"].items()
+    }
+    extrema = {
+        "players": {player_key(name): values for name, values in aggregates["extrema"]["players"].items()},
+        "maps": {map_key(map_name): values for map_name, values in aggregates["extrema"]["maps"].items()},
+    }
+    return {"maps": maps, "averages": averages, "maps_played": maps_played, "extrema": extrema}
+
+
+def load_aggregates(aggregates_file):
+    try:
+        with open(aggregates_file) as aggf:
+            aggregates = json.load(aggf)
+    except FileNotFoundError:
+        return empty_aggregates()
+    aggregates.setdefault("extrema", {"players": {}, "maps": {}})
+    # json has no tuples
+    for pinfos in aggregates["averages"].values():
+        pinfos["leftAv"] = tuple(pinfos["leftAv"])
+        pinfos["rightAv"] = tuple(pinfos["rightAv"])
+    return aggregates
+
+
+def save_aggregates(aggregates_file, aggregates):
+    with open(f"{aggregates_file}.tmp", "w") as aggf:
+        json.dump(aggregates, aggf)
+    replace(f"{aggregates_file}.tmp", aggregates_file)
+
+
+def merge_partial_files(partial_files):
+    return reduce(merge_aggregates, (load_aggregates(partial_file) for partial_file in partial_files), empty_aggregates())
+
+
+def combine_partial_files(partial_files, workers=4):
+    """ Merges partial aggregates files, each worker folding a contiguous partition.
+
+        Partitions are contiguous (and not interleaved) so that runs keep the order
+        they would have had in a full re-parse.
+    """
+    partial_files = sorted(partial_files)
+    if workers <= 1 or len(partial_files) < 2 * workers:
+        return merge_partial_files(partial_files)
+
+    size = -(-len(partial_files) // workers)
+    partitions = [partial_files[i : i + size] for i in range(0, len(partial_files), size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return reduce(merge_aggregates, pool.map(merge_partial_files, partitions), empty_aggregates())
@@ -0,0 +1,62 @@
+#! /usr/bin/env python3
+
+""" Detects runs already seen, even across overlapping log files & invocations.
+
+    A run is fingerprinted from the fields identifying it (player, song, difficulty,
+    score & end time) as a 64 bits blake2b digest. Seen fingerprints are kept in a
+    set & persisted as a flat array of unsigned 64 bits ints (8 bytes per run).
+"""
+
+from array import array
+from hashlib import blake2b
+from os import path, replace
+
+
+def run_fingerprint(info_map):
+    win_tracker = info_map["trackers"]["winTracker"]
+    identity = "|".join(
+        str(field)
+        for field in (
+            info_map["playerID"],
+            info_map["songName"],
+            info_map["songArtist"],
+            info_map["songDifficulty"],
+            info_map["songMapper"],
+            info_map["trackers"]["scoreTracker"]["score"],
+            win_tracker["endTime"],
+        )
+    )
+    return int.from_bytes(blake2b(identity.encode(), digest_size=8).digest(), "little")
+
+
+class SeenRuns:
+    def __init__(self, seen_file=None):
+        self.seen_file = seen_file
+        self.seen = set()
+        self.nb_duplicates = 0
+        if seen_file and path.exists(seen_file):
+            fingerprints = array("Q")
+            with open(seen_file, "rb") as seenf:
+                fingerprints.frombytes(seenf.read())
+            self.seen.update(fingerprints)
+
+    def is_seen(self, info_map):
+        """ Returns True (& counts it as a duplicate) if the run was already marked as seen """
+        if run_fingerprint(info_map) in self.seen:
+            self.nb_duplicates += 1
+            return True
+        return False
+
+    def mark(self, info_map):
+        """ Remembers the run : only runs that were actually aggregated are marked, a run skipped
+            by a filter (--restrictmap, --milestones) must still show up in a later report
+        """
+        self.seen.add(run_fingerprint(info_map))
+
+    def save(self):
+        if not self.seen_file:
+            return
+        tmp_file = f"{self.seen_file}.tmp"
+        with open(tmp_file, "wb") as seenf:
+            array("Q", self.seen).tofile(seenf)
+        replace(tmp_file, self.seen_file)
@@ -0,0 +1,85 @@
+#! /usr/bin/env python3
+
+""" Declarative filters of the BeatSaviorData messages that are not runs.
+
+    A rule drops the messages containing a literal ("contains") or matching a
+    regular expression ("regex"), case insensitive unless "ignorecase" is false.
+    Rules of a json config file are added to DEFAULT_RULES, a rule with the name
+    of a default one replaces it & "disabled": true removes it :
+
+        [
+            {"name": "upload", "disabled": true},
+            {"name": "leaderboard", "contains": "leaderboard refreshed"},
+            {"name": "version", "regex": "^version [0-9.]+ loaded"}
+        ]
+
+    Rules are compiled once : literals are searched in the lowered message (one
+    lower() per message whatever the number of rules) & all regexes are joined
+    into a single pattern. Messages are bytes, straight from the log file.
+    Every rule counts the lines it dropped.
+"""
+
+import json
+import re
+
+DEFAULT_RULES = [
+    {"name": "separator", "contains": "********", "ignorecase": False},
+    {"name": "upload", "contains": "upload"},
+    {"name": "practice_cheat", "contains": "cheat in practice mode"},
+    {"name": "replay_cheat", "contains": "was a replay you cheater"},
+]
+
+
+def load_rules(config_file=None):
+    rules = {rule["name"]: rule for rule in DEFAULT_RULES}
+    if config_file:
+        with open(config_file) as conff:
+            for rule in json.load(conff):
+                if rule.get("disabled"):
+                    rules.pop(rule["name"], None)
+                    continue
+                if "contains" not in rule and "regex" not in rule:
+                    raise ValueError(f"Filter rule {rule['name']} needs 'contains' or 'regex'")
+                rules[rule["name"]] = rule
+    return list(rules.values())
+
+
+class LineFilter:
+    def __init__(self, rules=None):
+        rules = DEFAULT_RULES if rules is None else rules
+        self.hits = {rule["name"]: 0 for rule in rules}
+        self.literals = []  # (name, literal bytes, ignorecase)
+        self.regex_names = {}
+        patterns = []
+        for rule in rules:
+            ignorecase = rule.get("ignorecase", True)
+            if "contains" in rule:
+                literal = rule["contains"].encode()
+                self.literals.append((rule["name"], literal.lower() if ignorecase else literal, ignorecase))
+            else:
+                group = f"rule{len(patterns)}"
+                self.regex_names[group] = rule["name"]
+                # Scoped flag so that each rule keeps its own case sensitivity
+                patterns.append(f"(?P<{group}>(?{'i' if ignorecase else '-i'}:{rule['regex']}))")
+        self.regex = re.compile("|".join(patterns).encode()) if patterns else None
+
+    def match(self, message):
+        """ Name of the first rule dropping message (bytes), None if it is kept """
+        lowered = None
+        for name, literal, ignorecase in self.literals:
+            if ignorecase:
+                if lowered is None:
+                    lowered = message.lower()
+                found = literal in lowered
+            else:
+                found = literal in message
+            if found:
+                self.hits[name] += 1
+                return name
+        if self.regex:
+            found = self.regex.search(message)
+            if found:
+                name = self.regex_names[found.lastgroup]
+                self.hits[name] += 1
+                return name
+        return None
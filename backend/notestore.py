@@ -0,0 +1,210 @@
+#! /usr/bin/env python3
+
+""" Storage of deepTracker notes with an optional memory budget.
+
+    Notes are kept as decoded by json until the estimated size of what is held in
+    memory exceeds the budget. Then every run held in memory is converted to
+    columns (one float64 array per note field, NaN when the field is missing) &
+    appended to an on-disk scratch file. Runs are read back map by map, so only
+    the notes of one map are in memory when plotting or averaging.
+"""
+
+from array import array
+from math import isnan, nan
+from tempfile import TemporaryFile
+
+
+NOTE_COLUMNS = (
+    "id",
+    "noteType",
+    "noteDirection",
+    "index",
+    "time",
+    "score0",
+    "score1",
+    "score2",
+    "timeDeviation",
+    "cutType",
+    "multiplier",
+    "cutPointX",
+    "cutPointY",
+    "cutPointZ",
+    "saberDirX",
+    "saberDirY",
+    "saberDirZ",
+)
+INT_COLUMNS = ("id", "noteType", "noteDirection", "index", "cutType", "multiplier")
+# Rough size of a note decoded by json (dict, floats & small lists)
+NOTE_BYTES = 1024
+COLUMN_ITEM_BYTES = array("d").itemsize
+
+
+def note_values(note):
+    """ Values of a note in NOTE_COLUMNS order, whatever the version of the note (v1, v2 or v3) """
+    if "score" in note:
+        score = note["score"]
+        index = note.get("index", nan)
+    else:
+        # v1 notes
+        score = (note.get("before", nan), note.get("accuracy", nan), note.get("after", nan))
+        index = note["column"] * 4 + note["line"] if "line" in note and "column" in note else nan
+    cut_point = note.get("cutPoint") or (nan, nan, nan)
+    saber_dir = note.get("saberDir") or (nan, nan, nan)
+    return (
+        note.get("id", nan),
+        note.get("noteType", nan),
+        note.get("noteDirection", nan),
+        index,
+        note.get("time", nan),
+        score[0],
+        score[1],
+        score[2],
+        note.get("timeDeviation", nan),
+        note.get("cutType", nan),
+        note.get("multiplier", nan),
+        cut_point[0],
+        cut_point[1],
+        cut_point[2],
+        saber_dir[0],
+        saber_dir[1],
+        saber_dir[2],
+    )
+
+
+def notes_to_columns(list_notes):
+    rows = []
+    for note in list_notes:
+        try:
+            rows.append(note_values(note))
+        except (KeyError, TypeError, IndexError):
+            # Broken note, get_run_as_coord would skip it anyway
+            continue
+    columns_values = list(zip(*rows)) if rows else [() for _ in NOTE_COLUMNS]
+
+    columns = {}
+    for column, values in zip(NOTE_COLUMNS, columns_values):
+        try:
+            columns[column] = array("d", values)
+        except TypeError:
+            # Some values are not numbers (null in the log for ex)
+            columns[column] = array("d", (value if isinstance(value, (int, float)) else nan for value in values))
+    return columns
+
+
+def columns_to_notes(columns):
+    """ Rebuilds notes (v3 format) from columns, for code that works on note dicts
+        (a score of a v1 note missing before, accuracy or after is None)
+    """
+    list_notes = []
+    for values in zip(*(columns[column] for column in NOTE_COLUMNS)):
+        raw = dict(zip(NOTE_COLUMNS, values))
+        note = {column: int(raw[column]) for column in INT_COLUMNS if not isnan(raw[column])}
+        note["time"] = raw["time"]
+        note["score"] = [None if isnan(raw[score]) else int(raw[score]) for score in ("score0", "score1", "score2")]
+        note["timeDeviation"] = raw["timeDeviation"]
+        if not isnan(raw["cutPointX"]):
+            note["cutPoint"] = [raw["cutPointX"], raw["cutPointY"], raw["cutPointZ"]]
+            note["saberDir"] = [raw["saberDirX"], raw["saberDirY"], raw["saberDirZ"]]
+        list_notes.append(note)
+    return list_notes
+
+
+def as_v3_notes(list_notes):
+    """ list_notes in the v3 format : v1 notes (before, accuracy & after instead of score) are
+        converted like spilled runs are when read back
+    """
+    if all("score" in note for note in list_notes):
+        return list_notes
+    return columns_to_notes(notes_to_columns(list_notes))
+
+
+class NoteStore:
+    """ Replaces the notes_dict of retrieve_relevant_infos :
+        map_name -> player_name -> list of runs (each run being a list of notes)
+    """
+
+    def __init__(self, budget_mb=None, scratch_dir=None):
+        self.budget = budget_mb * 1024 * 1024 if budget_mb else None
+        self.scratch_dir = scratch_dir
+        self.scratch = None
+        # map_name -> player_name -> list of runs, a run being either its list of
+        # notes or the (offset, nb_notes) of its columns in the scratch file
+        self.runs = {}
+        self.in_memory = 0
+        self.nb_spilled = 0
+
+    def __len__(self):
+        return len(self.runs)
+
+    def __contains__(self, map_name):
+        return map_name in self.runs
+
+    def map_names(self):
+        return list(self.runs.keys())
+
+    def add(self, map_name, player_name, list_notes):
+        self.runs.setdefault(map_name, {}).setdefault(player_name, []).append(list_notes)
+        if self.budget is None:
+            return
+        self.in_memory += len(list_notes) * NOTE_BYTES
+        if self.in_memory > self.budget:
+            self.spill()
+
+    def spill(self):
+        if self.scratch is None:
+            self.scratch = TemporaryFile(prefix="bsdlp-notes-", dir=self.scratch_dir)
+        self.scratch.seek(0, 2)
+        for players_runs in self.runs.values():
+            for runs in players_runs.values():
+                for position, run in enumerate(runs):
+                    if isinstance(run, tuple):
+                        continue
+                    columns = notes_to_columns(run)
+                    offset = self.scratch.tell()
+                    for column in NOTE_COLUMNS:
+                        columns[column].tofile(self.scratch)
+                    runs[position] = (offset, len(columns["id"]))
+                    self.nb_spilled += 1
+        self.scratch.flush()
+        self.in_memory = 0
+
+    def read_columns(self, offset, nb_notes):
+        self.scratch.seek(offset)
+        columns = {}
+        for column in NOTE_COLUMNS:
+            columns[column] = array("d")
+            columns[column].fromfile(self.scratch, nb_notes)
+        return columns
+
+    def run_columns(self, run):
+        """ Columns of a run, wherever it is stored """
+        if isinstance(run, tuple):
+            return self.read_columns(*run)
+        return notes_to_columns(run)
+
+    def runs_of_map(self, map_name):
+        """ {player_name: [list_notes, ...]} of map_name, spilled runs being read back
+            Notes are in the v3 format whether the run was spilled or not
+        """
+        return {
+            player_name: [
+                columns_to_notes(self.read_columns(*run)) if isinstance(run, tuple) else as_v3_notes(run) for run in runs
+            ]
+            for player_name, runs in self.runs[map_name].items()
+        }
+
+    def columns_of_map(self, map_name):
+        """ {player_name: [columns, ...]} of map_name, spilled runs are not turned back into dicts """
+        return {
+            player_name: [self.run_columns(run) for run in runs] for player_name, runs in self.runs[map_name].items()
+        }
+
+    def items(self):
+        """ Streams (map_name, runs_of_map) one map at a time """
+        for map_name in self.map_names():
+            yield map_name, self.runs_of_map(map_name)
+
+    def close(self):
+        if self.scratch is not None:
+            self.scratch.close()
+            self.scratch = None
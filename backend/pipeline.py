@@ -0,0 +1,101 @@
+#! /usr/bin/env python3
+
+""" Producer/consumer pipeline of threads linked by bounded queues.
+
+    The source & each stage run in their own thread : a stage is a function
+    taking the iterable of the items of the previous stage & yielding its own.
+    Items of the last stage are yielded by iterating the pipeline (in the
+    calling thread, which usually aggregates them).
+
+    Queues hold at most `depth` items, a stage producing faster than the next
+    one consumes blocks (backpressure) so memory stays bounded by the depth.
+    Threads overlap I/O (reads, decompression) with decoding, an exception in
+    a stage is raised again by the iteration & stopping the iteration early
+    stops every thread.
+"""
+
+from queue import Queue, Empty, Full
+from threading import Event, Thread
+from time import perf_counter
+
+DONE = object()
+POLL_SECONDS = 0.1
+
+
+class StageFailure:
+    def __init__(self, error):
+        self.error = error
+
+
+class Pipeline:
+    def __init__(self, source, stages=(), depth=8):
+        """ source : iterable (read in its own thread), stages : list of (name, function) """
+
+        self.source = source
+        self.stages = list(stages)
+        self.depth = depth
+        self.stop = Event()
+        # Per stage : items produced & seconds blocked on a full output queue
+        self.stats = {
+            name: {"items": 0, "blocked_seconds": 0.0} for name in ["source"] + [name for name, _ in self.stages]
+        }
+
+    def put(self, out_queue, item, stats):
+        """ Blocks while out_queue is full, returns False if the pipeline was stopped meanwhile """
+
+        start = perf_counter()
+        while not self.stop.is_set():
+            try:
+                out_queue.put(item, timeout=POLL_SECONDS)
+                stats["blocked_seconds"] += perf_counter() - start
+                return True
+            except Full:
+                continue
+        return False
+
+    def items(self, in_queue):
+        """ Items of in_queue until the previous stage is done """
+
+        while not self.stop.is_set():
+            try:
+                item = in_queue.get(timeout=POLL_SECONDS)
+            except Empty:
+                continue
+            if item is DONE:
+                return
+            if isinstance(item, StageFailure):
+                # Forwarded as it is so that it reaches the consumer
+                raise item.error
+            yield item
+
+    def run_stage(self, name, stage_items, out_queue):
+        """ Puts the items of stage_items() into out_queue (stage_items is called in the thread) """
+
+        stats = self.stats[name]
+        try:
+            for item in stage_items():
+                if not self.put(out_queue, item, stats):
+                    return
+                stats["items"] += 1
+        except BaseException as err:  # pylint: disable=broad-except
+            self.put(out_queue, StageFailure(err), stats)
+            return
+        self.put(out_queue, DONE, stats)
+
+    def __iter__(self):
+        out_queue = Queue(self.depth)
+        threads = [Thread(target=self.run_stage, args=("source", lambda: self.source, out_queue), daemon=True)]
+        for name, stage in self.stages:
+            in_queue, out_queue = out_queue, Queue(self.depth)
+            stage_items = lambda stage=stage, in_queue=in_queue: stage(self.items(in_queue))
+            threads.append(Thread(target=self.run_stage, args=(name, stage_items, out_queue), daemon=True))
+
+        self.stop.clear()
+        for thread in threads:
+            thread.start()
+        try:
+            yield from self.items(out_queue)
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
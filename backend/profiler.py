@@ -0,0 +1,100 @@
+#! /usr/bin/env python3
+
+""" Per-stage instrumentation of parse_logs.
+
+    When profiling is off, NullProfiler is used instead of StageProfiler : its
+    stages do nothing but hand back a throwaway dict, so instrumented code
+    doesn't need any `if profile:` around it.
+"""
+
+from contextlib import contextmanager
+from time import perf_counter, process_time
+import cProfile
+import json
+import tracemalloc
+
+
+class NullProfiler:
+    enabled = False
+
+    @contextmanager
+    def stage(self, name):  # pylint: disable=unused-argument
+        yield {}
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def write_report(self, counters=None):
+        pass
+
+
+class StageProfiler:
+    enabled = True
+
+    def __init__(self, report_file, dump_file=None):
+        self.report_file = report_file
+        self.dump_file = dump_file
+        self.stages = []
+        self.cprofile = cProfile.Profile() if dump_file else None
+        self.total_wall = 0.0
+        self.total_cpu = 0.0
+
+    def start(self):
+        tracemalloc.start()
+        if self.cprofile:
+            self.cprofile.enable()
+        self.total_wall = perf_counter()
+        self.total_cpu = process_time()
+
+    def stop(self):
+        self.total_wall = perf_counter() - self.total_wall
+        self.total_cpu = process_time() - self.total_cpu
+        if self.cprofile:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.dump_file)
+        tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name):
+        """ Measures what happens in the with block. The yielded dict can be
+            filled with extra infos (like the number of records handled).
+        """
+        infos = {}
+        tracemalloc.reset_peak()
+        mem_before, _ = tracemalloc.get_traced_memory()
+        wall = perf_counter()
+        cpu = process_time()
+        try:
+            yield infos
+        finally:
+            _, mem_peak = tracemalloc.get_traced_memory()
+            self.stages.append(
+                {
+                    "stage": name,
+                    "wall_seconds": perf_counter() - wall,
+                    "cpu_seconds": process_time() - cpu,
+                    "peak_alloc_mb": (mem_peak - mem_before) / (1024 * 1024),
+                    **infos,
+                }
+            )
+
+    def write_report(self, counters=None):
+        report = {
+            "wall_seconds": self.total_wall,
+            "cpu_seconds": self.total_cpu,
+            "stages": self.stages,
+            "counters": counters or {},
+        }
+        if self.dump_file:
+            report["cprofile_dump"] = self.dump_file
+        with open(self.report_file, "w") as reportf:
+            json.dump(report, reportf, indent=2)
+
+        for stage in self.stages:
+            print(
+                f"{stage['stage']:12} wall {stage['wall_seconds']:8.3f}s  cpu {stage['cpu_seconds']:8.3f}s  peak {stage['peak_alloc_mb']:8.1f}MB  records {stage.get('records', '-')}"
+            )
+        print(f"Profile report written to {self.report_file}")
@@ -0,0 +1,30 @@
+#! /usr/bin/env python3
+
+""" Keeps the records that can't be decoded aside instead of aborting the whole parse.
+
+    Each malformed record is appended to an NDJSON file as
+    {"source": file it comes from, "offset": byte offset in it, "error": ..., "record": raw text}
+    so that it can be inspected or fixed & parsed again later.
+"""
+
+import json
+
+
+class Quarantine:
+    def __init__(self, quarantine_file=None):
+        self.quarantine_file = quarantine_file
+        self.nb_records = 0
+
+    def add(self, source, offset, error, raw_record):
+        self.nb_records += 1
+        if not self.quarantine_file:
+            return
+        with open(self.quarantine_file, "a") as quarf:
+            quarf.write(
+                json.dumps({"source": source, "offset": offset, "error": str(error), "record": raw_record}) + "\n"
+            )
+
+    def summary(self):
+        if not self.quarantine_file:
+            return f"{self.nb_records} malformed records skipped"
+        return f"{self.nb_records} malformed records skipped (quarantined in {self.quarantine_file})"
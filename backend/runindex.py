@@ -0,0 +1,226 @@
+#! /usr/bin/env python3
+
+""" In-memory indexes over run summaries answering ad-hoc filters with bitwise operations.
+
+    Runs are numbered in the order they are added. Each categorical field gets
+    one bitmap per value (a python int whose bit n is set if run n has this
+    value) & each numeric field the runs sorted by value, searched with
+    bisect. A filter is a list of clauses that are all ANDed :
+
+        player=dude|bob, difficulty=ExpertPlus, passed=1, paused=0,
+        date=20201201..20201231, acc>=92.5, misses<5
+
+    Categorical clauses (= or !=) OR the bitmaps of the values (player & map
+    values are case insensitive substrings, like --restrictmap), numeric clauses
+    use =, !=, <, <=, >, >= or an inclusive low..high range (= or != only).
+"""
+
+from bisect import bisect_left, bisect_right
+import re
+
+CATEGORICAL_FIELDS = ("player", "map", "difficulty", "passed", "paused")
+NUMERIC_FIELDS = ("date", "acc", "score", "misses")
+SUBSTRING_FIELDS = ("player", "map")
+BOOLEAN_VALUES = {"true": "1", "yes": "1", "false": "0", "no": "0"}
+CLAUSE_REGEX = re.compile(r"^\s*(\w+)\s*(!=|>=|<=|=|>|<)\s*(.+?)\s*$")
+
+
+def parse_query(query):
+    """ "acc>=92, player=dude|bob" -> [("acc", ">=", "92"), ("player", "=", "dude|bob")] """
+
+    clauses = []
+    for clause in query.split(","):
+        if not clause.strip():
+            continue
+        found = CLAUSE_REGEX.match(clause)
+        if not found:
+            raise ValueError(f"Can't understand the filter '{clause.strip()}'")
+        field, operator, value = found.groups()
+        if field not in CATEGORICAL_FIELDS and field not in NUMERIC_FIELDS:
+            raise ValueError(
+                f"Unknown field '{field}' (fields : {', '.join(CATEGORICAL_FIELDS + NUMERIC_FIELDS)})"
+            )
+        if field in CATEGORICAL_FIELDS and operator not in ("=", "!="):
+            raise ValueError(f"Field '{field}' can only be filtered with = or !=")
+        clauses.append((field, operator, value))
+    return clauses
+
+
+def date_bounds(clauses):
+    """ (first, last) YYYYMMDD dates the runs matching clauses (of parse_query) can have, None for
+        a bound the clauses don't restrict
+    """
+
+    first = last = None
+    for field, operator, value in clauses:
+        if field != "date" or operator == "!=":
+            continue
+        value = value.replace("-", "")
+        if ".." in value:
+            if operator != "=":
+                continue
+            low, high = value.split("..", 1)
+        else:
+            low = value if operator in ("=", ">", ">=") else ""
+            high = value if operator in ("=", "<", "<=") else ""
+        # Clauses are ANDed : the bounds only get narrower
+        if low:
+            first = low if first is None else max(first, low)
+        if high:
+            last = high if last is None else min(last, high)
+    return first, last
+
+
+def categorical_key(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return str(value).lower()
+
+
+def positions_bitmap(positions, nb_runs):
+    """ Bitmap with the bits of positions set """
+
+    # Setting bits in a bytearray is O(1) each, or-ing shifted ints would copy the whole int each time
+    bits = bytearray((nb_runs >> 3) + 1)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, "little")
+
+
+def bitmap_positions(bitmap):
+    """ Numbers of the runs set in bitmap, in increasing order """
+
+    # Scanning the binary string is done in C, shifting the int bit by bit isn't
+    bits = bin(bitmap)[:1:-1]
+    positions = []
+    position = bits.find("1")
+    while position != -1:
+        positions.append(position)
+        position = bits.find("1", position + 1)
+    return positions
+
+
+class RunIndex:
+    def __init__(self):
+        self.nb_runs = 0
+        self.runs_per_value = {field: {} for field in CATEGORICAL_FIELDS}
+        self.values = {field: [] for field in NUMERIC_FIELDS}
+        self.indexes = {}
+
+    def add(self, summary):
+        """ Indexes a run summary (a dict with every field) & returns its number """
+
+        run = self.nb_runs
+        self.nb_runs += 1
+        for field in CATEGORICAL_FIELDS:
+            runs_per_value = self.runs_per_value[field]
+            key = categorical_key(summary[field])
+            try:
+                runs_per_value[key].append(run)
+            except KeyError:
+                runs_per_value[key] = [run]
+        for field in NUMERIC_FIELDS:
+            self.values[field].append(summary[field])
+        # Bitmaps & sorted indexes are (re)built by the next query
+        self.indexes.clear()
+        return run
+
+    def all_runs(self):
+        return (1 << self.nb_runs) - 1
+
+    def bitmaps(self, field):
+        """ Bitmap of each value of a categorical field """
+
+        try:
+            return self.indexes[field]
+        except KeyError:
+            self.indexes[field] = {
+                key: positions_bitmap(runs, self.nb_runs) for key, runs in self.runs_per_value[field].items()
+            }
+            return self.indexes[field]
+
+    def sorted_index(self, field):
+        """ Runs sorted by the value of a numeric field & the sorted values """
+
+        try:
+            return self.indexes[field]
+        except KeyError:
+            values = self.values[field]
+            runs = sorted(range(self.nb_runs), key=values.__getitem__)
+            self.indexes[field] = (runs, [values[run] for run in runs])
+            return self.indexes[field]
+
+    def categorical_bitmap(self, field, values):
+        bitmaps = self.bitmaps(field)
+        bitmap = 0
+        for value in values.split("|"):
+            value = value.strip().lower()
+            value = BOOLEAN_VALUES.get(value, value)
+            if field in SUBSTRING_FIELDS:
+                # Few distinct players & maps, matching every key is cheap
+                for key, key_bitmap in bitmaps.items():
+                    if value in key:
+                        bitmap |= key_bitmap
+            else:
+                bitmap |= bitmaps.get(value, 0)
+        return bitmap
+
+    def range_bitmap(self, field, low=None, high=None, low_inclusive=True, high_inclusive=True):
+        runs, keys = self.sorted_index(field)
+        start = 0
+        end = len(keys)
+        if low is not None:
+            start = bisect_left(keys, low) if low_inclusive else bisect_right(keys, low)
+        if high is not None:
+            end = bisect_right(keys, high) if high_inclusive else bisect_left(keys, high)
+        return positions_bitmap(runs[start:end], self.nb_runs)
+
+    def numeric_bitmap(self, field, operator, value):
+        if field == "date":
+            # 2020-12-30 or 20201230
+            value = value.replace("-", "")
+        if ".." in value:
+            if operator not in ("=", "!="):
+                raise ValueError(f"A range can only be filtered with = or != (not {field}{operator}{value})")
+            low, high = value.split("..", 1)
+            bitmap = self.range_bitmap(field, float(low) if low else None, float(high) if high else None)
+            return bitmap if operator == "=" else self.all_runs() & ~bitmap
+        value = float(value)
+        if operator == "=":
+            return self.range_bitmap(field, value, value)
+        if operator == "!=":
+            return self.all_runs() & ~self.range_bitmap(field, value, value)
+        if operator == ">=":
+            return self.range_bitmap(field, low=value)
+        if operator == ">":
+            return self.range_bitmap(field, low=value, low_inclusive=False)
+        if operator == "<=":
+            return self.range_bitmap(field, high=value)
+        return self.range_bitmap(field, high=value, high_inclusive=False)
+
+    def select(self, clauses):
+        """ Bitmap of the runs matching every clause (of parse_query) """
+
+        selected = self.all_runs()
+        for clause in clauses:
+            # Bitmaps of clauses are kept until the next add (successive queries often share clauses)
+            try:
+                bitmap = self.indexes[clause]
+            except KeyError:
+                field, operator, value = clause
+                if field in CATEGORICAL_FIELDS:
+                    bitmap = self.categorical_bitmap(field, value)
+                    if operator == "!=":
+                        bitmap = self.all_runs() & ~bitmap
+                else:
+                    bitmap = self.numeric_bitmap(field, operator, value)
+                self.indexes[clause] = bitmap
+            selected &= bitmap
+            if not selected:
+                break
+        return selected
+
+    def query(self, query):
+        """ Numbers of the runs matching query (a string like "acc>=92, paused=0") """
+
+        return bitmap_positions(self.select(parse_query(query)))
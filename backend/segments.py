@@ -0,0 +1,281 @@
+#! /usr/bin/env python3
+
+""" Compaction of the BSDlogs/<playerID>/<timestamp> files written by restful.py.
+
+    The runs of a player are rolled into one segment per month, <YYYY-MM>.ndjson.gz :
+    a series of gzip members (blocks of about BLOCK_SIZE bytes of NDJSON, one run
+    per line) that any gzip reader (parse_logs included) reads as a whole. Its
+    index, <YYYY-MM>.ndjson.gz.idx, gives the offset, length, first & last
+    timestamps of each block so that a reader seeks straight to the runs it needs.
+
+    Compaction is incremental (blocks of new runs are appended to the segment of
+    their month) & original files are only deleted once the blocks written are
+    read back & match them. Retention can drop the deepTrackers of runs older
+    than deep_days & whole runs older than keep_days (segments are rewritten).
+"""
+
+from os import fsync, listdir, path, remove, replace, stat
+from time import localtime, strftime, strptime, time
+import json
+import zlib
+
+RUN_NAME_FORMAT = "%Y-%m-%d-%H-%M-%S"
+SEGMENT_EXT = ".ndjson.gz"
+INDEX_EXT = ".idx"
+BLOCK_SIZE = 256 * 1024
+
+
+def run_timestamp(name):
+    """ Timestamp of a run file written by restful.py, None for any other file """
+
+    try:
+        strptime(name, RUN_NAME_FORMAT)
+    except ValueError:
+        return None
+    return name
+
+
+def cutoff_timestamp(days, now):
+    return strftime(RUN_NAME_FORMAT, localtime(now - days * 86400)) if days is not None else None
+
+
+def load_index(segment):
+    try:
+        with open(segment + INDEX_EXT) as idxf:
+            return json.load(idxf)
+    except FileNotFoundError:
+        return {"size": 0, "blocks": []}
+
+
+def save_index(segment, index):
+    with open(f"{segment}{INDEX_EXT}.tmp", "w") as idxf:
+        json.dump(index, idxf)
+    replace(f"{segment}{INDEX_EXT}.tmp", segment + INDEX_EXT)
+
+
+def compress_block(lines):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # gzip member
+    return compressor.compress(b"".join(lines)) + compressor.flush()
+
+
+def write_blocks(segf, runs):
+    """ Appends runs ([(timestamp, record)] sorted by timestamp) to segf as blocks,
+        returns the blocks for the index & their uncompressed content
+    """
+
+    blocks = []
+    contents = []
+    lines = []
+    block = None
+    for timestamp, record in runs:
+        if block is None:
+            block = {"first": timestamp, "runs": 0, "deep_first": None}
+            lines = []
+            size = 0
+        line = (json.dumps(record) + "\n").encode()
+        lines.append(line)
+        size += len(line)
+        block["last"] = timestamp
+        block["runs"] += 1
+        if record.get("deepTrackers") and block["deep_first"] is None:
+            block["deep_first"] = timestamp
+        if size >= BLOCK_SIZE:
+            blocks.append(block)
+            contents.append(lines)
+            block = None
+    if block is not None:
+        blocks.append(block)
+        contents.append(lines)
+
+    for block, lines in zip(blocks, contents):
+        data = compress_block(lines)
+        block["offset"] = segf.tell()
+        block["length"] = len(data)
+        segf.write(data)
+    segf.flush()
+    fsync(segf.fileno())
+    return blocks, [b"".join(lines) for lines in contents]
+
+
+def read_block(segf, block):
+    segf.seek(block["offset"])
+    return zlib.decompress(segf.read(block["length"]), 31)
+
+
+def verify_blocks(segment, blocks, contents):
+    """ True if the blocks read back from segment are the ones that were written """
+
+    with open(segment, "rb") as segf:
+        for block, content in zip(blocks, contents):
+            try:
+                if read_block(segf, block) != content:
+                    return False
+            except zlib.error:
+                return False
+    return True
+
+
+def segment_runs(segment, index, since=None, until=None):
+    """ Yields (timestamp, record) of the runs of segment between since & until (timestamps
+        or prefixes of timestamps like 2020-12-24), only reading the blocks that can have some
+    """
+
+    with open(segment, "rb") as segf:
+        for block in index["blocks"]:
+            if (since and block["last"] < since) or (until and block["first"][: len(until)] > until):
+                continue
+            for line in read_block(segf, block).splitlines():
+                record = json.loads(line)
+                timestamp = record.get("_timestamp", block["first"])
+                if (since and timestamp < since) or (until and timestamp[: len(until)] > until):
+                    continue
+                yield timestamp, record
+
+
+def apply_retention(runs, deep_cutoff, keep_cutoff, stats):
+    kept = []
+    for timestamp, record in runs:
+        if keep_cutoff and timestamp < keep_cutoff:
+            stats["dropped_runs"] += 1
+            continue
+        if deep_cutoff and timestamp < deep_cutoff and record.pop("deepTrackers", None) is not None:
+            stats["stripped_runs"] += 1
+        kept.append((timestamp, record))
+    return kept
+
+
+def needs_rewrite(index, deep_cutoff, keep_cutoff):
+    for block in index["blocks"]:
+        if keep_cutoff and block["first"] < keep_cutoff:
+            return True
+        if deep_cutoff and block["deep_first"] and block["deep_first"] < deep_cutoff:
+            return True
+    return False
+
+
+def rewrite_segment(segment, runs, stats):
+    """ Replaces segment by one made of runs, None if it couldn't be verified """
+
+    if not runs:
+        for leftover in (segment, segment + INDEX_EXT):
+            if path.exists(leftover):
+                remove(leftover)
+        return {"size": 0, "blocks": []}
+    with open(f"{segment}.tmp", "wb") as segf:
+        blocks, contents = write_blocks(segf, runs)
+        size = segf.tell()
+    if not verify_blocks(f"{segment}.tmp", blocks, contents):
+        stats["failed_segments"] += 1
+        remove(f"{segment}.tmp")
+        return None
+    replace(f"{segment}.tmp", segment)
+    index = {"size": size, "blocks": blocks}
+    save_index(segment, index)
+    return index
+
+
+def append_to_segment(segment, index, runs, stats):
+    """ Appends runs to segment, returns its new index (None if blocks couldn't be verified) """
+
+    mode = "r+b" if path.exists(segment) else "wb"
+    with open(segment, mode) as segf:
+        # Blocks of an interrupted compaction are past the indexed size & are overwritten
+        segf.truncate(index["size"])
+        segf.seek(index["size"])
+        blocks, contents = write_blocks(segf, runs)
+        size = segf.tell()
+    if not verify_blocks(segment, blocks, contents):
+        stats["failed_segments"] += 1
+        return None
+    index = {"size": size, "blocks": index["blocks"] + blocks}
+    save_index(segment, index)
+    return index
+
+
+def new_stats():
+    return {
+        "compacted_runs": 0,
+        "malformed_runs": 0,
+        "stripped_runs": 0,
+        "dropped_runs": 0,
+        "segments": 0,
+        "failed_segments": 0,
+    }
+
+
+def compact_player(player_dir, min_age=3600, deep_days=None, keep_days=None, now=None, stats=None):
+    """ Rolls the run files of player_dir older than min_age seconds into monthly segments """
+
+    now = time() if now is None else now
+    stats = new_stats() if stats is None else stats
+    deep_cutoff = cutoff_timestamp(deep_days, now)
+    keep_cutoff = cutoff_timestamp(keep_days, now)
+
+    runs_per_month = {}
+    for name in sorted(listdir(player_dir)):
+        timestamp = run_timestamp(name)
+        run_file = path.join(player_dir, name)
+        if not timestamp or stat(run_file).st_mtime > now - min_age:
+            continue
+        try:
+            with open(run_file) as runf:
+                record = json.load(runf)
+        except ValueError:
+            # Left in place, for someone to have a look
+            stats["malformed_runs"] += 1
+            continue
+        # Files of a month are merged : the timestamp is the only thing left of their name
+        record["_timestamp"] = timestamp
+        runs_per_month.setdefault(timestamp[:7], []).append((timestamp, record, run_file))
+
+    months = {name[: -len(SEGMENT_EXT)] for name in listdir(player_dir) if name.endswith(SEGMENT_EXT)}
+    for month in sorted(months | set(runs_per_month)):
+        segment = path.join(player_dir, month + SEGMENT_EXT)
+        index = load_index(segment)
+        new_runs = runs_per_month.get(month, [])
+        runs = [(timestamp, record) for timestamp, record, _ in new_runs]
+        if needs_rewrite(index, deep_cutoff, keep_cutoff):
+            runs = sorted(list(segment_runs(segment, index)) + runs, key=lambda run: run[0])
+            index = rewrite_segment(segment, apply_retention(runs, deep_cutoff, keep_cutoff, stats), stats)
+        elif runs:
+            runs = apply_retention(runs, deep_cutoff, keep_cutoff, stats)
+            if runs:
+                index = append_to_segment(segment, index, runs, stats)
+        else:
+            continue
+        if index is None:
+            # Originals are kept, the next compaction tries again
+            continue
+        stats["segments"] += 1
+        for _, _, run_file in new_runs:
+            remove(run_file)
+        stats["compacted_runs"] += len(new_runs)
+
+    return stats
+
+
+def compact_tree(root, min_age=3600, deep_days=None, keep_days=None, now=None):
+    """ Compacts every player directory of root (BSDlogs) """
+
+    stats = new_stats()
+    for player in sorted(listdir(root)):
+        player_dir = path.join(root, player)
+        if path.isdir(player_dir):
+            compact_player(player_dir, min_age, deep_days, keep_days, now, stats)
+    return stats
+
+
+def player_runs(player_dir, since=None, until=None):
+    """ Yields the records of a compacted player directory between since & until (timestamps
+        or prefixes like 2020-12 or 2020-12-24), seeking straight to their blocks
+    """
+
+    for name in sorted(listdir(player_dir)):
+        if not name.endswith(SEGMENT_EXT):
+            continue
+        month = name[: -len(SEGMENT_EXT)]
+        if (since and month < since[:7]) or (until and month > until[:7]):
+            continue
+        segment = path.join(player_dir, name)
+        for _, record in segment_runs(segment, load_index(segment), since, until):
+            yield record
@@ -0,0 +1,258 @@
+#! /usr/bin/env python3
+
+""" Sidecar index of the play sessions of a long lived log (_latest.log, merged logs...).
+
+    A session starts with the settings records BeatSaviorData writes when the
+    game starts (saberAColor) or with a run played more than `gap` seconds after
+    the previous run. Lines are only scanned (no json decoding) & each session
+    gets its byte range in the log, its number of runs, its players & the time
+    of its first & last records (with the number of midnights crossed since the
+    start of the log) :
+
+        {"size", "mtime_ns", "head_size", "head", "gap", "sessions": [{"offset", "end", "runs", "players", "first", "last", "day"}]}
+
+    The index is written next to the log (<logfile>.sessions). When the log only
+    grew since it was indexed, its last session is scanned again from its offset
+    & the next sessions are appended. Offsets of compressed logs are offsets in
+    the decompressed stream (getting there means decompressing up to it : a
+    compressed log is opened again & read from its start, zstd streams can't
+    seek backwards).
+"""
+
+from hashlib import blake2b
+from os import replace, stat
+import io
+import json
+import re
+
+INDEX_EXT = ".sessions"
+SESSION_GAP = 1800
+HEAD_SIZE = 4096
+TIME_REGEX = re.compile(rb"^\[\w+ @ (\d\d):(\d\d):(\d\d) \|")
+PLAYER_REGEX = re.compile(rb'"playerID": ?"([^"]*)"')
+
+
+def is_record_start(line):
+    # "[INFO @ 20:12:50 | BeatSaviorData] {..." or the bare json of an already cleaned log
+    return line.startswith(b"{") or b"BeatSaviorData] {" in line
+
+
+def time_of_day(seconds):
+    seconds %= 86400
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def head_digest(head):
+    """ Hash of the first bytes of the log : a rotated log doesn't start like the indexed one """
+
+    return blake2b(head, digest_size=8).hexdigest()
+
+
+def open_log(logfile, opener=open, offset=0):
+    """ Buffered binary stream of logfile (opener(logfile, "rb")) positioned at offset """
+
+    logf = opener(logfile, "rb")
+    if not isinstance(logf, io.BufferedIOBase):
+        # zstd stream_reader : no readline (nor iteration) without a buffer
+        logf = io.BufferedReader(logf)
+    if logf.seekable():
+        logf.seek(offset)
+        return logf
+    # Streams that can't seek are decompressed up to offset
+    while offset > 0:
+        chunk = logf.read(min(offset, 1 << 20))
+        if not chunk:
+            break
+        offset -= len(chunk)
+    return logf
+
+
+class SessionScanner:
+    """ Splits the records of a log into sessions, fed line by line """
+
+    def __init__(self, gap=SESSION_GAP, day=0):
+        self.gap = gap
+        self.sessions = []
+        self.session = None
+        self.record = None  # record being read (its lines until the next record)
+        self.day = day
+        self.previous_seconds = None
+        self.last_run_seconds = None
+
+    def start_session(self, offset, seconds):
+        if self.session is not None:
+            self.session["end"] = offset
+        self.session = {"offset": offset, "end": offset, "runs": 0, "players": [], "seconds": seconds}
+        self.sessions.append(self.session)
+
+    def close_record(self):
+        record = self.record
+        self.record = None
+        if record is None:
+            return
+        if record["settings"]:
+            # Settings of every player are written when the game starts, the session starts at the first one
+            if self.session is None or self.session["runs"]:
+                self.start_session(record["offset"], record["seconds"])
+        else:
+            # The first run after the settings belongs to their session, whatever the time in between
+            if self.session is None or (
+                self.gap
+                and self.session["runs"]
+                and record["seconds"] is not None
+                and self.last_run_seconds is not None
+                and record["seconds"] - self.last_run_seconds > self.gap
+            ):
+                self.start_session(record["offset"], record["seconds"])
+            self.session["runs"] += 1
+            if record["seconds"] is not None:
+                self.last_run_seconds = record["seconds"]
+        if record["player"] and record["player"] not in self.session["players"]:
+            self.session["players"].append(record["player"])
+        if self.session["seconds"] is None:
+            self.session["seconds"] = record["seconds"]
+        if record["seconds"] is not None:
+            self.session["last_seconds"] = record["seconds"]
+
+    def feed(self, line, offset):
+        """ line (bytes) starts at offset in the log """
+
+        seconds = None
+        found = TIME_REGEX.match(line)
+        if found:
+            hours, minutes, secs = (int(value) for value in found.groups())
+            seconds = self.day * 86400 + hours * 3600 + minutes * 60 + secs
+            if self.previous_seconds is not None and seconds < self.previous_seconds - 43200:
+                # Going half a day back in time means the log went past midnight (lines of
+                # other threads can be a bit out of order)
+                self.day += 1
+                seconds += 86400
+            self.previous_seconds = max(seconds, self.previous_seconds or 0)
+
+        if is_record_start(line):
+            self.close_record()
+            self.record = {"offset": offset, "settings": False, "player": None, "seconds": seconds}
+        if self.record is None:
+            return
+        if b'"saberAColor"' in line:
+            self.record["settings"] = True
+        if self.record["player"] is None:
+            found = PLAYER_REGEX.search(line)
+            if found:
+                self.record["player"] = found.group(1).decode(errors="replace")
+
+    def finish(self, size):
+        """ Sessions of the log (size bytes long) as they are stored in the index """
+
+        self.close_record()
+        if self.session is not None:
+            self.session["end"] = size
+        for session in self.sessions:
+            seconds = session.pop("seconds")
+            last_seconds = session.pop("last_seconds", seconds)
+            if seconds is not None:
+                session["first"] = time_of_day(seconds)
+                session["last"] = time_of_day(last_seconds)
+                session["day"] = seconds // 86400
+        return self.sessions
+
+
+def scan_sessions(logf, offset=0, gap=SESSION_GAP, day=0):
+    """ Sessions of the binary stream logf, positioned at offset (the start of a session), to its
+        end, the offset of its end & its first HEAD_SIZE bytes (if scanned from the start)
+    """
+
+    scanner = SessionScanner(gap, day)
+    head = b""
+    for line in logf:
+        if offset < HEAD_SIZE:
+            head += line[: HEAD_SIZE - offset]
+        scanner.feed(line, offset)
+        offset += len(line)
+    return scanner.finish(offset), offset, head
+
+
+def load_index(logfile):
+    try:
+        with open(logfile + INDEX_EXT) as idxf:
+            return json.load(idxf)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def save_index(logfile, index):
+    with open(f"{logfile}{INDEX_EXT}.tmp", "w") as idxf:
+        json.dump(index, idxf)
+    replace(f"{logfile}{INDEX_EXT}.tmp", logfile + INDEX_EXT)
+
+
+def session_index(logfile, opener=open, gap=SESSION_GAP):
+    """ Index of the sessions of logfile, (re)built if the log changed since it was indexed.
+        opener(logfile, "rb") returns the (decompressed) binary stream of the log.
+    """
+
+    index = load_index(logfile)
+    stats = stat(logfile)
+    size = stats.st_size
+    if index and index["size"] == size and index["mtime_ns"] == stats.st_mtime_ns and index["gap"] == gap:
+        return index
+
+    sessions = []
+    offset = 0
+    day = 0
+    if index and index["sessions"] and index["gap"] == gap and index["size"] < size:
+        # Compressed streams don't seek back : the head is read from a stream of its own
+        with open_log(logfile, opener) as logf:
+            head = logf.read(HEAD_SIZE)
+        if index["head"] == head_digest(head[: index["head_size"]]):
+            # The log only grew : its last session may go on, it is scanned again
+            sessions = index["sessions"][:-1]
+            offset = index["sessions"][-1]["offset"]
+            day = index["sessions"][-1].get("day", 0)
+    with open_log(logfile, opener, offset) as logf:
+        new_sessions, _, scanned_head = scan_sessions(logf, offset, gap, day)
+    if not offset:
+        # The digest is taken while scanning
+        head = scanned_head
+    # size & mtime are the ones of the file (to notice it changed), offsets are in the decompressed stream
+    index = {
+        "size": size,
+        "mtime_ns": stats.st_mtime_ns,
+        "head_size": len(head),
+        "head": head_digest(head),
+        "gap": gap,
+        "sessions": sessions + new_sessions,
+    }
+    save_index(logfile, index)
+    return index
+
+
+def select_session(sessions, session):
+    """ Session entry of "last", "N" (first session is 1) or "-N" (from the last one) """
+
+    if not sessions:
+        raise ValueError("No session found in the log")
+    if session == "last":
+        return sessions[-1]
+    try:
+        number = int(session)
+    except ValueError as err:
+        raise ValueError(f"Session must be 'last', a number (1 is the first one) or a negative number (-1 is the last one), not '{session}'") from err
+    if number == 0 or abs(number) > len(sessions):
+        raise ValueError(f"No session {session} ({len(sessions)} sessions in the log)")
+    return sessions[number - 1 if number > 0 else number]
+
+
+def read_session(logfile, session, opener=open, chunk_size=1 << 20):
+    """ Yields the bytes of session (an entry of the index) in chunks, seeking straight to it
+        (decompressing up to it for compressed logs)
+    """
+
+    with open_log(logfile, opener, session["offset"]) as logf:
+        remaining = session["end"] - session["offset"]
+        while remaining > 0:
+            chunk = logf.read(min(chunk_size, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
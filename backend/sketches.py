@@ -0,0 +1,161 @@
+#! /usr/bin/env python3
+
+""" Streaming, mergeable percentile sketches of accuracies per map.
+
+    Each map (its name includes the difficulty) gets a merging t-digest : a small
+    sorted list of centroids (mean, weight) whose size only depends on the
+    compression (at most `compression` centroids), not on the number of runs.
+    The k1 scale function keeps centroids small near the tails so p90/p99 stay
+    accurate.
+"""
+
+from math import asin, pi
+from os import replace
+import json
+
+
+class TDigest:
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.centroids = []
+        self.buffer = []
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value, weight=1.0):
+        self.buffer.append((value, weight))
+        self.total += weight
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self.buffer) > 5 * self.compression:
+            self.compress()
+
+    def merge(self, other):
+        if not other.total:
+            return
+        other.compress()
+        self.buffer.extend(other.centroids)
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.compress()
+
+    def scale(self, quantile):
+        return self.compression / (2 * pi) * asin(max(-1.0, min(1.0, 2 * quantile - 1)))
+
+    def compress(self):
+        if not self.buffer:
+            return
+        items = sorted(self.centroids + self.buffer)
+        self.buffer = []
+        merged = []
+        cumul = 0.0
+        k_left = self.scale(0.0)
+        mean, weight = items[0]
+        for next_mean, next_weight in items[1:]:
+            if self.scale((cumul + weight + next_weight) / self.total) - k_left <= 1:
+                mean = (mean * weight + next_mean * next_weight) / (weight + next_weight)
+                weight += next_weight
+            else:
+                merged.append((mean, weight))
+                cumul += weight
+                k_left = self.scale(cumul / self.total)
+                mean, weight = next_mean, next_weight
+        merged.append((mean, weight))
+        self.centroids = merged
+
+    def quantile(self, quantile):
+        """ Value below which `quantile` (0 to 1) of the values are """
+        self.compress()
+        if not self.centroids:
+            return None
+        target = quantile * self.total
+        cumul = 0.0
+        prev_mean, prev_mid = self.min, 0.0
+        for mean, weight in self.centroids:
+            mid = cumul + weight / 2
+            if target < mid:
+                if mid == prev_mid:
+                    return mean
+                return prev_mean + (target - prev_mid) / (mid - prev_mid) * (mean - prev_mean)
+            prev_mean, prev_mid = mean, mid
+            cumul += weight
+        if self.total == prev_mid:
+            return self.max
+        return prev_mean + (target - prev_mid) / (self.total - prev_mid) * (self.max - prev_mean)
+
+    def percentile_of(self, value):
+        """ Percentage (0 to 100) of the values lower than value """
+        self.compress()
+        if not self.centroids or value <= self.min:
+            return 0.0
+        if value >= self.max:
+            return 100.0
+        cumul = 0.0
+        prev_mean, prev_mid = self.min, 0.0
+        for mean, weight in self.centroids:
+            mid = cumul + weight / 2
+            if value < mean:
+                return 100 * (prev_mid + (value - prev_mean) / (mean - prev_mean) * (mid - prev_mid)) / self.total
+            prev_mean, prev_mid = mean, mid
+            cumul += weight
+        return 100 * (prev_mid + (value - prev_mean) / (self.max - prev_mean) * (self.total - prev_mid)) / self.total
+
+    def to_dict(self):
+        self.compress()
+        return {
+            "compression": self.compression,
+            "centroids": self.centroids,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, infos):
+        digest = cls(infos["compression"])
+        digest.centroids = [tuple(centroid) for centroid in infos["centroids"]]
+        digest.total = infos["total"]
+        digest.min = infos["min"]
+        digest.max = infos["max"]
+        return digest
+
+
+class MapSketches:
+    """ One t-digest of accuracies per map, persisted as json """
+
+    def __init__(self, sketches_file=None, compression=100):
+        self.sketches_file = sketches_file
+        self.compression = compression
+        self.digests = {}
+        if sketches_file:
+            try:
+                with open(sketches_file) as sketchf:
+                    for map_name, infos in json.load(sketchf).items():
+                        self.digests[map_name] = TDigest.from_dict(infos)
+            except FileNotFoundError:
+                pass
+
+    def add(self, map_name, acc):
+        try:
+            self.digests[map_name].add(acc)
+        except KeyError:
+            self.digests[map_name] = TDigest(self.compression)
+            self.digests[map_name].add(acc)
+
+    def merge(self, other):
+        for map_name, digest in other.digests.items():
+            if map_name not in self.digests:
+                self.digests[map_name] = TDigest(digest.compression)
+            self.digests[map_name].merge(digest)
+
+    def get(self, map_name):
+        return self.digests.get(map_name)
+
+    def save(self):
+        if not self.sketches_file:
+            return
+        with open(f"{self.sketches_file}.tmp", "w") as sketchf:
+            json.dump({map_name: digest.to_dict() for map_name, digest in self.digests.items()}, sketchf)
+        replace(f"{self.sketches_file}.tmp", self.sketches_file)
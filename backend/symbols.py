@@ -0,0 +1,29 @@
+#! /usr/bin/env python3
+
+""" Symbol tables interning map & player names into small integer ids.
+
+    Runs are decoded into dicts keyed by ids : one copy of each name is kept
+    (in the table) whatever the number of runs, & ints are cheaper to hash &
+    compare than long map names. Names are only resolved back for output.
+"""
+
+
+class SymbolTable:
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        """ Returns the id of name, a new one if name was never seen """
+        try:
+            return self.ids[name]
+        except KeyError:
+            symbol_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+            return symbol_id
+
+    def name(self, symbol_id):
+        return self.names[symbol_id]
@@ -0,0 +1,157 @@
+#! /usr/bin/env python3
+
+""" Watches a directory for new (or completed) log files.
+
+    inotify is used when available (linux, through libc) so that waiting costs
+    nothing & doesn't depend on the number of files in the directory. Otherwise
+    the directory is polled & a file is considered complete once its size &
+    mtime didn't change between two polls.
+"""
+
+from ctypes import CDLL, get_errno
+from ctypes.util import find_library
+from os import path, read, close, replace, scandir, stat, strerror, O_NONBLOCK
+from select import select
+from struct import calcsize, unpack_from
+from time import sleep, monotonic
+import json
+
+from backend.segments import INDEX_EXT as SEGMENT_INDEX_EXT
+from backend.sessions import INDEX_EXT as SESSION_INDEX_EXT
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+INOTIFY_EVENT = "iIII"
+INOTIFY_EVENT_SIZE = calcsize(INOTIFY_EVENT)
+
+
+def is_log_candidate(name):
+    # Files written by parse_logs itself next to the logs must not trigger anything
+    return (
+        not name.startswith(".")
+        and not name.endswith("_cleaned")
+        and not name.endswith(".tmp")
+        and not name.endswith(".csv")  # reports written in the current directory
+        and not name.endswith(SEGMENT_INDEX_EXT)  # indexes of compacted segments
+        and not name.endswith(SESSION_INDEX_EXT)  # indexes of the sessions of a log
+    )
+
+
+def load_manifest(manifest_file):
+    try:
+        with open(manifest_file) as manf:
+            return json.load(manf)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(manifest_file, manifest):
+    with open(f"{manifest_file}.tmp", "w") as manf:
+        json.dump(manifest, manf)
+    # rename is atomic, a crash never leaves a half written manifest
+    replace(f"{manifest_file}.tmp", manifest_file)
+
+
+def scan_directory(directory):
+    """ Returns {path: [size, mtime_ns]} of the log files in directory """
+    files = {}
+    with scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and is_log_candidate(entry.name):
+                stats = entry.stat()
+                files[f"{directory}/{entry.name}"] = [stats.st_size, stats.st_mtime_ns]
+    return files
+
+
+class Inotify:
+    def __init__(self, directory):
+        libc_name = find_library("c")
+        if not libc_name:
+            raise OSError("libc not found")
+        self.libc = CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify not supported")
+        self.fd = self.libc.inotify_init1(O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(strerror(get_errno()))
+        if self.libc.inotify_add_watch(self.fd, directory.encode(), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            close(self.fd)
+            raise OSError(strerror(get_errno()))
+        self.directory = directory
+
+    def wait(self, timeout):
+        """ Returns the names of the files closed after writing or moved into the directory """
+        ready, _, _ = select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        names = []
+        buf = read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(buf):
+            _, _, _, name_len = unpack_from(INOTIFY_EVENT, buf, offset)
+            offset += INOTIFY_EVENT_SIZE
+            name = buf[offset : offset + name_len].rstrip(b"\0").decode()
+            offset += name_len
+            if is_log_candidate(name):
+                names.append(name)
+        return names
+
+    def close(self):
+        close(self.fd)
+
+
+class DirectoryWatcher:
+    def __init__(self, directory, manifest_file, poll_interval=5.0, ignored_files=()):
+        """ ignored_files : other files parse_logs writes (the quarantine file for ex) that may be in directory """
+        self.directory = directory.rstrip("/")
+        self.manifest_file = manifest_file
+        self.ignored_files = {path.abspath(ignored_file) for ignored_file in ignored_files if ignored_file}
+        self.manifest = load_manifest(manifest_file)
+        self.poll_interval = poll_interval
+        self.pending = {}
+        try:
+            self.inotify = Inotify(self.directory)
+        except OSError as err:
+            print(f"inotify not available ({err}), falling back to polling every {poll_interval}s")
+            self.inotify = None
+
+    def log_files(self):
+        """ {path: [size, mtime_ns]} of the log files of the directory """
+        return {
+            logfile: stats
+            for logfile, stats in scan_directory(self.directory).items()
+            if path.abspath(logfile) not in self.ignored_files
+        }
+
+    def new_files(self):
+        """ Files that are not in the manifest (or changed since they were processed) """
+        return sorted(logfile for logfile, stats in self.log_files().items() if self.manifest.get(logfile) != stats)
+
+    def wait_new_files(self):
+        """ Blocks until some new files are complete & returns them """
+        while True:
+            if self.inotify:
+                logfiles = {f"{self.directory}/{name}" for name in self.inotify.wait(self.poll_interval)}
+                logfiles = {logfile for logfile in logfiles if path.abspath(logfile) not in self.ignored_files}
+                if logfiles:
+                    return sorted(logfiles)
+                continue
+
+            # Polling : a file is complete when it didn't move since the previous poll
+            deadline = monotonic() + self.poll_interval
+            current = {logfile: stats for logfile, stats in self.log_files().items() if self.manifest.get(logfile) != stats}
+            completed = [logfile for logfile, stats in current.items() if self.pending.get(logfile) == stats]
+            self.pending = {logfile: stats for logfile, stats in current.items() if logfile not in completed}
+            if completed:
+                return sorted(completed)
+            sleep(max(0.0, deadline - monotonic()))
+
+    def mark_processed(self, logfiles):
+        for logfile in logfiles:
+            try:
+                stats = stat(logfile)
+                self.manifest[logfile] = [stats.st_size, stats.st_mtime_ns]
+            except FileNotFoundError:
+                # File vanished in the meantime
+                continue
+        save_manifest(self.manifest_file, self.manifest)
@@ -0,0 +1,288 @@
+#! /usr/bin/env python3
+
+""" Durable write queue between the ingestion server & the disk.
+
+    Runs accepted by the server are appended to a journal, as the json bytes they
+    were received as (decoding & encoding a run with deepTrackers costs
+    milliseconds, the server decodes it once to check it & that's it) : a json
+    header line {"timestamp", "player", "length"} followed by the run. Appends are
+    group committed : every run waiting when the journal thread wakes up is
+    written & fsynced at once, & the server acknowledges them once journaled.
+    A writer thread then writes each run to <directory>/<playerID>/<timestamp>
+    like restful.py did (fsyncing the files & their directories) & records in a
+    checkpoint how far into the journal it went. The journal is truncated each
+    time the writer catches up with it. A run that can't be written is retried
+    (with the next batches, or every RETRY_DELAY seconds) & the checkpoint waits
+    for it.
+
+    On start, runs of the journal past the checkpoint (acknowledged but not
+    written before a crash) are written again : they get the same file as the
+    first time so writing one twice is harmless.
+"""
+
+from os import O_RDONLY, close, fsync, makedirs, open as os_open, path, replace, truncate
+from queue import Queue, Empty
+from threading import Lock, Thread
+import asyncio
+import json
+
+STOP = object()
+MAX_BATCH = 512
+RETRY_DELAY = 5.0
+
+
+def player_dir_name(record):
+    """ Directory of the runs of a player (restful.py put the runs without playerID in Unknown) """
+
+    player = str(record.get("playerID", "Unknown")) if isinstance(record, dict) else "Unknown"
+    # restful.py would have written anywhere with a playerID like ../..
+    if not player or player in (".", "..") or "/" in player or "\\" in player:
+        return "Unknown"
+    return player
+
+
+def resolve(future, error):
+    # The client may be gone (& its future cancelled) while its run was journaled
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+
+class WriteQueue:
+    def __init__(self, directory="BSDlogs", journal_file=None, sync=True, depth=10000):
+        """ sync : fsync the journal before acknowledging & run files (& their directories) before the checkpoint
+            depth : runs journaled but not written yet before the journal thread waits for the writer
+        """
+
+        self.directory = directory
+        # Starts with a dot : ignored by the watcher & the compaction of the directory
+        self.journal_file = journal_file or path.join(directory, ".journal")
+        self.checkpoint_file = f"{self.journal_file}.checkpoint"
+        self.sync = sync
+        self.pending = Queue()
+        self.to_write = Queue(depth)
+        self.lock = Lock()
+        self.journalf = None
+        self.journal_offset = 0
+        self.player_dirs = set()
+        self.dirty_dirs = set()  # directories of the files written since the last sync_dirs
+        self.threads = []
+        self.failed_runs = []  # runs that couldn't be written (yet), the checkpoint stays before them
+        self.written_offset = 0  # end of the last run given to the writer
+        self.stats = {"journaled": 0, "journal_batches": 0, "written": 0, "replayed": 0, "errors": 0}
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_file) as checkf:
+                return json.load(checkf)["offset"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return 0
+
+    def save_checkpoint(self, offset):
+        with open(f"{self.checkpoint_file}.tmp", "w") as checkf:
+            json.dump({"offset": offset}, checkf)
+        replace(f"{self.checkpoint_file}.tmp", self.checkpoint_file)
+
+    def write_run(self, timestamp, player, run):
+        player_dir = path.join(self.directory, player)
+        if player_dir not in self.player_dirs:
+            makedirs(player_dir, exist_ok=True)
+            self.player_dirs.add(player_dir)
+            # The entry of a new player directory is in the directory of the runs
+            self.dirty_dirs.add(self.directory)
+        with open(path.join(player_dir, timestamp), "wb") as runf:
+            runf.write(run)
+            if self.sync:
+                runf.flush()
+                fsync(runf.fileno())
+        self.dirty_dirs.add(player_dir)
+
+    def sync_dirs(self):
+        """ fsyncs the directories of the files written since the last call (their entries are durable) """
+
+        if self.sync:
+            for directory in self.dirty_dirs:
+                dirfd = os_open(directory, O_RDONLY)
+                try:
+                    fsync(dirfd)
+                finally:
+                    close(dirfd)
+        self.dirty_dirs.clear()
+
+    def replay(self):
+        """ Writes the runs of the journal past the checkpoint, returns how many there were """
+
+        if not path.exists(self.journal_file):
+            return 0
+        replayed = 0
+        with open(self.journal_file, "rb") as journalf:
+            journalf.seek(self.load_checkpoint())
+            for line in journalf:
+                try:
+                    entry = json.loads(line)
+                    run = journalf.read(entry["length"] + 1)[:-1]
+                except ValueError:
+                    # Last run of a crash in the middle of an append : never acknowledged
+                    break
+                if len(run) < entry["length"]:
+                    break
+                self.write_run(entry["timestamp"], entry["player"], run)
+                replayed += 1
+        self.sync_dirs()
+        self.save_checkpoint(0)
+        with open(self.journal_file, "wb"):
+            pass
+        self.stats["replayed"] += replayed
+        return replayed
+
+    def start(self):
+        makedirs(self.directory, exist_ok=True)
+        replayed = self.replay()
+        self.journalf = open(self.journal_file, "ab")
+        self.journal_offset = self.journalf.tell()
+        self.threads = [
+            Thread(target=self.run_journal, name="journal", daemon=True),
+            Thread(target=self.run_writer, name="writer", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+        return replayed
+
+    def submit(self, timestamp, player, run):
+        """ Future (of the running event loop) resolved once run (bytes) is journaled """
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.put((timestamp, player, run, future, loop))
+        return future
+
+    def append_to_journal(self, batch):
+        """ Appends batch to the journal, returns the offset of the end of each run """
+
+        lines = [
+            (json.dumps({"timestamp": timestamp, "player": player, "length": len(run)}) + "\n").encode() + run + b"\n"
+            for timestamp, player, run, _, _ in batch
+        ]
+        ends = []
+        with self.lock:
+            try:
+                self.journalf.write(b"".join(lines))
+                self.journalf.flush()
+                if self.sync:
+                    fsync(self.journalf.fileno())
+            except OSError:
+                # The replay stops at a partial line, the runs appended after it would be lost
+                self.reopen_journal()
+                raise
+            for line in lines:
+                self.journal_offset += len(line)
+                ends.append(self.journal_offset)
+        return ends
+
+    def reopen_journal(self):
+        try:
+            self.journalf.close()
+        except OSError:
+            pass
+        truncate(self.journal_file, self.journal_offset)
+        self.journalf = open(self.journal_file, "ab")
+
+    def run_journal(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            item = self.pending.get()
+            while item is not STOP:
+                batch.append(item)
+                if len(batch) == MAX_BATCH:
+                    break
+                try:
+                    item = self.pending.get_nowait()
+                except Empty:
+                    break
+            stopping = item is STOP
+            if not batch:
+                continue
+            try:
+                ends = self.append_to_journal(batch)
+            except OSError as err:
+                # Disk full for ex : clients are told their runs weren't saved
+                self.stats["errors"] += len(batch)
+                for _, _, _, future, loop in batch:
+                    loop.call_soon_threadsafe(resolve, future, err)
+                continue
+            self.stats["journaled"] += len(batch)
+            self.stats["journal_batches"] += 1
+            for _, _, _, future, loop in batch:
+                loop.call_soon_threadsafe(resolve, future, None)
+            for (timestamp, player, run, _, _), end in zip(batch, ends):
+                # Blocks while the writer is depth runs behind
+                self.to_write.put((timestamp, player, run, end))
+        self.to_write.put(STOP)
+
+    def run_writer(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                # Runs that couldn't be written are retried even when no other run comes
+                item = self.to_write.get(timeout=RETRY_DELAY if self.failed_runs else None)
+            except Empty:
+                item = None
+            while item is not None and item is not STOP:
+                batch.append(item)
+                try:
+                    item = self.to_write.get_nowait()
+                except Empty:
+                    break
+            stopping = item is STOP
+            if not batch and not self.failed_runs:
+                continue
+            if batch:
+                self.written_offset = batch[-1][3]
+
+            failed_runs = []
+            # In journal order : runs that failed before come first
+            entries = [(True, entry) for entry in self.failed_runs] + [(False, entry) for entry in batch]
+            for retry, (timestamp, player, run, end) in entries:
+                try:
+                    self.write_run(timestamp, player, run)
+                    self.stats["written"] += 1
+                except OSError as err:
+                    # The run stays in the journal (the checkpoint doesn't go past it) & is retried
+                    if not retry:
+                        print(f"Couldn't write the run of {player} at {timestamp} : {err}")
+                    self.stats["errors"] += 1
+                    failed_runs.append((timestamp, player, run, end))
+            self.failed_runs = failed_runs
+            try:
+                # Run files & their directory entries must be on disk before the checkpoint goes past them
+                self.sync_dirs()
+            except OSError as err:
+                print(f"Couldn't sync the written runs : {err}")
+                self.stats["errors"] += 1
+                continue
+            if not self.failed_runs:
+                self.checkpoint(self.written_offset)
+
+    def checkpoint(self, offset):
+        with self.lock:
+            if offset == self.journal_offset:
+                # Every journaled run is written : the journal starts again from scratch
+                self.save_checkpoint(0)
+                self.journalf.truncate(0)
+                self.journal_offset = 0
+            else:
+                self.save_checkpoint(offset)
+
+    def close(self):
+        """ Journals & writes every submitted run then stops the threads """
+
+        self.pending.put(STOP)
+        for thread in self.threads:
+            thread.join()
+        if self.journalf:
+            self.journalf.close()
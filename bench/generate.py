@@ -0,0 +1,200 @@
+#! /usr/bin/env python3
+
+""" Generates synthetic (but realistic) raw Beat Savior logs.
+
+    Usage : python -m bench.generate -o bench_20201230.log -s 100
+
+    Output looks like what BeatSaviorData writes in _latest.log : runs & settings
+    records prefixed with `Data]`, messages that clean_logfile must skip, noise
+    from other mods and deepTracker notes in the v1, v2 & v3 formats.
+"""
+
+from argparse import ArgumentParser
+import json
+import random
+from zlib import crc32
+
+
+SKIPPED_LINES = (
+    "[INFO @ 20:12:54 | BeatSaviorData] Uploading data to the server...",
+    "[INFO @ 20:12:54 | BeatSaviorData] Upload successful",
+    "[INFO @ 20:12:54 | BeatSaviorData] You can't cheat in practice mode, data won't be sent",
+    "[INFO @ 20:12:54 | BeatSaviorData] That was a replay you cheater, data won't be sent",
+    "[INFO @ 20:12:54 | BeatSaviorData] ********************************************",
+)
+NOISE_LINES = (
+    "[DEBUG @ 20:12:50 | SongCore] Loading song Shadow Cross",
+    "[INFO @ 20:12:51 | CustomAvatar] Loaded avatar",
+    "[WARNING @ 20:12:52 | Camera2] Could not find a main camera",
+)
+SONGS = (
+    ("Shadow Cross", "Kaneko Chiharu", "Nolan121405"),
+    ("Ghost", "Camellia", "Fatbeanzoop, Joetastic"),
+    ("Sunset Mirage", "Sakuzyo", "Hexagonial"),
+    ("Lift Off", "Galantis", "Skeelie"),
+    ("Reality Check Through The Skull", "DM DOKURO", "Rustic"),
+    ("Tera I/O", "Camellia", "cerret"),
+    ("Big Daddy", "Muzzy", "Alice"),
+    ("Rain of Light", "Xi", "Kival Evan"),
+)
+DIFFICULTIES = ("easy", "normal", "hard", "expert", "expertplus")
+
+
+def note_v1(note_id, time_note, rng, layout):
+    return {
+        "noteType": layout & 1,
+        "line": (layout >> 1) % 4,
+        "column": (layout >> 3) % 3,
+        "id": note_id,
+        "time": time_note,
+        "before": rng.randint(50, 70),
+        "accuracy": rng.randint(5, 15),
+        "after": rng.randint(20, 30),
+        "timeDeviation": rng.uniform(-0.05, 0.08),
+        "saberSpeed": rng.uniform(10, 40),
+        "cutDirDeviation": rng.uniform(-10, 10),
+        "cutDistanceToCenter": rng.uniform(0, 0.5),
+    }
+
+
+def note_v2(note_id, time_note, rng, layout):
+    return {
+        "noteType": layout & 1,
+        "noteDirection": (layout >> 5) % 9,
+        "index": (layout >> 1) % 12,
+        "id": note_id,
+        "time": time_note,
+        "score": [rng.randint(50, 70), rng.randint(5, 15), rng.randint(20, 30)],
+        "timeDeviation": rng.uniform(-0.05, 0.08),
+        "cutPoint": [rng.uniform(-1, 1), rng.uniform(0, 2), rng.uniform(1, 2)],
+        "saberDir": [rng.uniform(-0.3, 0.3), rng.uniform(-0.3, 0.3), rng.uniform(-0.1, 0.1)],
+    }
+
+
+def note_v3(note_id, time_note, rng, layout):
+    note = note_v2(note_id, time_note, rng, layout)
+    note["cutType"] = rng.choices((0, 1, 2), weights=(95, 4, 1))[0]
+    note["multiplier"] = rng.choice((1, 2, 4, 8))
+    return note
+
+
+NOTE_FORMATS = (note_v1, note_v2, note_v3)
+
+
+def settings_record(player_id, rng):
+    return {
+        "playerID": player_id,
+        "saberAColor": [rng.random(), rng.random(), rng.random(), 1.0],
+        "saberBColor": [rng.random(), rng.random(), rng.random(), 1.0],
+        "settings": {"leftHanded": False, "playerHeight": rng.uniform(1.5, 2.0), "noFail": True},
+    }
+
+
+def run_record(player_id, song, difficulty, nb_notes, rng, deep=True):
+    song_name, song_artist, song_mapper = song
+    won = rng.random() > 0.1
+    duration = nb_notes * 0.4
+    end_time = duration if won else rng.uniform(10, duration)
+    ratio = rng.uniform(0.85, 0.97)
+    run = {
+        "songDataType": 1 if won else 2,
+        "playerID": player_id,
+        "songID": f"{crc32(song_name.encode()):X}",
+        "songDifficulty": difficulty,
+        "songName": song_name,
+        "songArtist": song_artist,
+        "songMapper": song_mapper,
+        "gameMode": "Standard",
+        "songDifficultyRank": DIFFICULTIES.index(difficulty) * 2 + 1,
+        "songSpeed": 1,
+        "songStartTime": 0,
+        "songDuration": duration,
+        "songJumpDistance": 18,
+        "trackers": {
+            "hitTracker": {"miss": rng.randint(0, 20), "maxCombo": rng.randint(10, nb_notes)},
+            "accuracyTracker": {
+                "accRight": rng.uniform(100, 113),
+                "accLeft": rng.uniform(100, 113),
+                "leftSpeed": rng.uniform(40, 60),
+                "rightSpeed": rng.uniform(40, 60),
+                "leftAverageCut": [rng.uniform(60, 70), rng.uniform(8, 14), rng.uniform(25, 30)],
+                "rightAverageCut": [rng.uniform(60, 70), rng.uniform(8, 14), rng.uniform(25, 30)],
+            },
+            "scoreTracker": {
+                "score": int(ratio * 115 * 8 * nb_notes),
+                "modifiedRatio": ratio,
+            },
+            "winTracker": {"won": won, "endTime": end_time, "nbOfPause": rng.choices((0, 1), weights=(9, 1))[0]},
+            "distanceTracker": {
+                "rightSaber": rng.uniform(500, 1500),
+                "leftSaber": rng.uniform(500, 1500),
+                "rightHand": rng.uniform(100, 300),
+                "leftHand": rng.uniform(100, 300),
+            },
+        },
+    }
+    if deep:
+        note_format = rng.choice(NOTE_FORMATS)
+        run["deepTrackers"] = {
+            "noteTracker": {
+                "notes": [
+                    # Hand, position & direction of a note only depend on the map, like in the game
+                    note_format(note_id, note_id * 0.4 + rng.random() * 0.1, rng, crc32(f"{song_name}{note_id}".encode()))
+                    for note_id in range(nb_notes)
+                ]
+            }
+        }
+    return run
+
+
+def player_ids(nb_players=8, seed=0):
+    rng = random.Random(seed)
+    return [str(76561198000000000 + rng.randint(0, 10 ** 9)) for _ in range(nb_players)]
+
+
+def generate_log(output, size_mb, nb_players=8, nb_notes=300, seed=0):
+    """ Writes a raw log of about size_mb megabytes & returns the number of runs written """
+
+    rng = random.Random(seed)
+    players = player_ids(nb_players, seed)
+    maps = [(song, rng.choice(DIFFICULTIES)) for song in SONGS]
+    target = size_mb * 1024 * 1024
+    written = 0
+    nb_runs = 0
+
+    with open(output, "w") as logf:
+        while written < target:
+            # A new session starts with the settings record of every player
+            for player_id in players:
+                line = f"[INFO @ 20:12:50 | BeatSaviorData] {json.dumps(settings_record(player_id, rng))}\n"
+                logf.write(line)
+                written += len(line)
+            for song, difficulty in rng.sample(maps, k=4):
+                for player_id in players:
+                    for noise in rng.sample(NOISE_LINES + SKIPPED_LINES, k=2):
+                        logf.write(noise + "\n")
+                        written += len(noise) + 1
+                    run = run_record(player_id, song, difficulty, nb_notes, rng)
+                    line = f"[INFO @ 20:15:02 | BeatSaviorData] {json.dumps(run)}\n"
+                    logf.write(line)
+                    written += len(line)
+                    nb_runs += 1
+
+    return nb_runs
+
+
+def main():
+    parser = ArgumentParser(prog="bench.generate", description="Generates synthetic Beat Savior logs")
+    parser.add_argument("-o", "--output", type=str, help="output file", default="bench_20201230.log")
+    parser.add_argument("-s", "--size", type=float, help="approximate size of the log in MB", default=10)
+    parser.add_argument("-p", "--players", type=int, help="number of players", default=8)
+    parser.add_argument("-n", "--notes", type=int, help="number of notes per run", default=300)
+    parser.add_argument("--seed", type=int, help="random seed", default=0)
+    args = parser.parse_args()
+
+    nb_runs = generate_log(args.output, args.size, args.players, args.notes, args.seed)
+    print(f"{args.output}: {nb_runs} runs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#! /usr/bin/env python3
+
+""" Load test of the ingestion server (restful_async.py, or restful.py to compare).
+
+    Usage : python -m bench.ingest_load --spawn [-c 64] [-n 5000] [--server restful]
+            python -m bench.ingest_load --url http://localhost:8080/
+
+    Clients post generated runs (`POST /`, like BeatSaviorData does) over
+    keep-alive connections, `concurrency` of them at once, & the latency of each
+    request is measured until its answer is read. Reports p50/p99/max latency &
+    throughput. With --spawn, the server is started in a temp directory &, once
+    it is stopped, the run files it wrote are counted (each request is sent with
+    its own playerID so that no run file overwrites another).
+"""
+
+from argparse import ArgumentParser
+from os import makedirs, path, walk
+from signal import SIGINT
+from subprocess import Popen
+from sys import exit as sexit, executable
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from urllib.parse import urlsplit
+import asyncio
+import json
+import random
+
+from bench.generate import DIFFICULTIES, SONGS, run_record
+
+
+REPO_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+SERVERS = {"restful_async": "restful_async.py", "restful": "restful.py"}
+PLAYER_PLACEHOLDER = b'"{PLAYER}"'
+
+
+def run_bodies(nb_bodies, nb_notes, seed=0):
+    """ Serialized runs, with a placeholder for their playerID """
+
+    rng = random.Random(seed)
+    bodies = []
+    for _ in range(nb_bodies):
+        run = run_record("{PLAYER}", rng.choice(SONGS), rng.choice(DIFFICULTIES), nb_notes, rng)
+        bodies.append(json.dumps(run).encode())
+    return bodies
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed by the server")
+    version, status = status_line.split()[:2]
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if "content-length" in headers:
+        content = await reader.readexactly(int(headers["content-length"]))
+    else:
+        content = await reader.read()
+    keep_alive = headers.get("connection", "").lower() != "close" and version == b"HTTP/1.1"
+    return int(status), content, keep_alive
+
+
+async def client(host, port, bodies, counter, nb_requests, latencies, errors):
+    connection = None
+    while True:
+        request = next(counter)
+        if request >= nb_requests:
+            break
+        body = bodies[request % len(bodies)].replace(PLAYER_PLACEHOLDER, b'"%d"' % (76561198000000000 + request))
+        start = perf_counter()
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection(host, port)
+            reader, writer = connection
+            writer.write(
+                (
+                    f"POST / HTTP/1.1\r\nHost: {host}:{port}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n"
+                ).encode()
+                + body
+            )
+            await writer.drain()
+            status, content, keep_alive = await read_response(reader)
+        except (ConnectionError, asyncio.IncompleteReadError) as err:
+            errors.append(str(err))
+            connection = None
+            continue
+        latencies.append(perf_counter() - start)
+        if status != 200 or json.loads(content).get("message") != "Ok":
+            errors.append(f"{status} {content.decode(errors='replace').strip()}")
+        if not keep_alive:
+            # restful.py (werkzeug) answers in HTTP/1.0 & closes each connection
+            writer.close()
+            connection = None
+    if connection:
+        connection[1].close()
+
+
+async def load(host, port, bodies, nb_requests, concurrency):
+    latencies = []
+    errors = []
+    counter = iter(range(nb_requests + concurrency))
+    start = perf_counter()
+    await asyncio.gather(
+        *(client(host, port, bodies, counter, nb_requests, latencies, errors) for _ in range(concurrency))
+    )
+    return latencies, errors, perf_counter() - start
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+async def wait_for_server(host, port, proc, timeout=30):
+    start = perf_counter()
+    while perf_counter() - start < timeout:
+        if proc.poll() is not None:
+            return False
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return True
+        except OSError:
+            await asyncio.sleep(0.1)
+    return False
+
+
+def count_run_files(directory):
+    return sum(1 for _, _, files in walk(directory) for name in files if not name.startswith("."))
+
+
+def main():
+    parser = ArgumentParser(prog="bench.ingest_load", description="Load test of the ingestion server")
+    parser.add_argument("-u", "--url", type=str, help="url of a running server", default="http://127.0.0.1:8080/")
+    parser.add_argument("--spawn", action="store_true", help="starts the server (in a temp directory) & stops it once done")
+    parser.add_argument("--server", type=str, choices=SERVERS, help="server started by --spawn", default="restful_async")
+    parser.add_argument("--nosync", action="store_true", help="starts restful_async without fsync")
+    parser.add_argument("-n", "--requests", type=int, help="number of runs posted", default=5000)
+    parser.add_argument("-c", "--concurrency", type=int, help="number of clients posting at once", default=64)
+    parser.add_argument("--notes", type=int, help="notes of the deepTrackers of each run (size of a request)", default=300)
+    parser.add_argument("-o", "--output", type=str, help="also writes results to this json file")
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    bodies = run_bodies(50, args.notes)
+    print(f"{args.requests} runs of ~{sum(map(len, bodies)) // len(bodies) // 1024} KB, {args.concurrency} clients")
+
+    with TemporaryDirectory() as workdir:
+        proc = None
+        if args.spawn:
+            command = [executable, path.join(REPO_DIR, SERVERS[args.server])]
+            if args.server == "restful_async":
+                command += ["--host", host, "--port", str(port), "--directory", path.join(workdir, "BSDlogs")]
+                command += ["--nosync"] if args.nosync else []
+            else:
+                # restful.py always listens on 8080 & writes to BSDlogs (which must exist)
+                port = 8080
+                makedirs(path.join(workdir, "BSDlogs"))
+            proc = Popen(command, cwd=workdir)
+            if not asyncio.run(wait_for_server(host, port, proc)):
+                print("Server didn't start")
+                proc.kill()
+                sexit(1)
+
+        try:
+            latencies, errors, elapsed = asyncio.run(load(host, port, bodies, args.requests, args.concurrency))
+        finally:
+            if proc:
+                proc.send_signal(SIGINT)
+                proc.wait()
+
+        latencies.sort()
+        results = {
+            "server": args.server if args.spawn else args.url,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "errors": len(errors),
+            "seconds": elapsed,
+            "throughput_req_s": len(latencies) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+        }
+        if args.spawn:
+            results["run_files"] = count_run_files(path.join(workdir, "BSDlogs"))
+
+    print(
+        f"throughput {results['throughput_req_s']:9.1f} req/s  p50 {results['p50_ms']:7.2f} ms  "
+        f"p99 {results['p99_ms']:7.2f} ms  max {results['max_ms']:7.2f} ms  errors {results['errors']}"
+    )
+    if errors:
+        print(f"first error : {errors[0]}")
+    if args.spawn:
+        print(f"run files written : {results['run_files']}/{args.requests}")
+    if args.output:
+        with open(args.output, "w") as outf:
+            json.dump(results, outf, indent=2)
+
+    if errors or (args.spawn and results["run_files"] != args.requests):
+        sexit(1)
+
+
+if __name__ == "__main__":
+    main()
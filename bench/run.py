@@ -0,0 +1,140 @@
+#! /usr/bin/env python3
+
+""" Benchmarks each stage of parse_logs (and the whole main()) on synthetic logs.
+
+    Usage : python -m bench.run -s 10,100,1000 [--save-baseline] [--baseline bench/baseline.json]
+
+    Each stage runs in its own process so that the peak RSS reported is the one
+    of that stage (plus what it needs as input) and not of the previous ones.
+"""
+
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from multiprocessing import get_context
+from os import chdir, devnull, makedirs, path
+from resource import getrusage, RUSAGE_SELF
+from sys import exit as sexit
+from time import perf_counter
+import json
+import sys
+
+from bench.generate import generate_log, player_ids
+
+
+STAGES = ("clean", "parse", "retrieve", "csv", "main")
+LOG_TEMPLATE = "bench-{}mb_20201230.log"
+
+
+def run_stage(stage, raw_log, workdir, nb_players, result_pipe):
+    import parse_logs  # pylint: disable=import-outside-toplevel
+
+    chdir(workdir)
+    # Names are resolved beforehand so that no stage waits on the network
+    for id_player in player_ids(nb_players):
+        parse_logs.ID_PLAYERS[id_player] = {"name": id_player}
+    parse_logs.DATETIME = "20201230"
+
+    with open(devnull, "w") as null, redirect_stdout(null):
+        infos = map_dict = averages_dict = None
+        if stage in ("parse", "retrieve", "csv"):
+            cleaned_log = parse_logs.clean_logfile(raw_log)
+        if stage in ("retrieve", "csv"):
+            infos = parse_logs.parse_logfile(cleaned_log)
+        if stage == "csv":
+            map_dict, averages_dict, _ = parse_logs.retrieve_relevant_infos(infos, None)
+
+        start = perf_counter()
+        if stage == "clean":
+            parse_logs.clean_logfile(raw_log)
+        elif stage == "parse":
+            infos = parse_logs.parse_logfile(cleaned_log)
+        elif stage == "retrieve":
+            parse_logs.retrieve_relevant_infos(infos, None)
+        elif stage == "csv":
+            parse_logs.relevant_infos_as_csv(map_dict)
+            parse_logs.show_averages(averages_dict, map_dict, no_color=True)
+        elif stage == "main":
+            sys.argv = ["parse_logs.py", "-f", raw_log, "-nc", "1"]
+            parse_logs.main()
+        elapsed = perf_counter() - start
+
+    # ru_maxrss is in kilobytes on linux
+    result_pipe.send({"seconds": elapsed, "peak_rss_mb": getrusage(RUSAGE_SELF).ru_maxrss / 1024})
+    result_pipe.close()
+
+
+def bench_size(size_mb, workdir, nb_players, stages):
+    raw_log = path.abspath(path.join(workdir, LOG_TEMPLATE.format(size_mb)))
+    if not path.exists(raw_log):
+        print(f"Generating {raw_log}...")
+        generate_log(raw_log, size_mb, nb_players)
+    real_size_mb = path.getsize(raw_log) / (1024 * 1024)
+
+    results = {}
+    ctx = get_context("spawn")
+    for stage in stages:
+        parent_pipe, child_pipe = ctx.Pipe(duplex=False)
+        proc = ctx.Process(target=run_stage, args=(stage, raw_log, path.abspath(workdir), nb_players, child_pipe))
+        proc.start()
+        result = parent_pipe.recv()
+        proc.join()
+        result["throughput_mb_s"] = real_size_mb / result["seconds"] if result["seconds"] else 0.0
+        results[stage] = result
+        print(
+            f"{size_mb:>6} MB  {stage:10} {result['seconds']:9.3f} s  {result['throughput_mb_s']:9.2f} MB/s  {result['peak_rss_mb']:9.1f} MB RSS"
+        )
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    regressions = []
+    for size_mb, stages in results.items():
+        for stage, result in stages.items():
+            try:
+                reference = baseline[size_mb][stage]
+            except KeyError:
+                continue
+            time_ratio = result["seconds"] / reference["seconds"] if reference["seconds"] else 1.0
+            rss_ratio = result["peak_rss_mb"] / reference["peak_rss_mb"] if reference["peak_rss_mb"] else 1.0
+            flag = ""
+            if time_ratio > 1 + tolerance or rss_ratio > 1 + tolerance:
+                flag = "  <-- REGRESSION"
+                regressions.append((size_mb, stage))
+            print(f"{size_mb:>6} MB  {stage:10} time x{time_ratio:.2f}  rss x{rss_ratio:.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(prog="bench.run", description="Benchmarks parse_logs stages on synthetic logs")
+    parser.add_argument("-s", "--sizes", type=str, help="sizes of the logs in MB", default="10,100,1000")
+    parser.add_argument("-st", "--stages", type=str, help="stages to run", default=",".join(STAGES))
+    parser.add_argument("-w", "--workdir", type=str, help="where logs & outputs are written", default="bench_data")
+    parser.add_argument("-p", "--players", type=int, help="number of players in generated logs", default=8)
+    parser.add_argument("-b", "--baseline", type=str, help="baseline file", default="bench/baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="stores results as the new baseline")
+    parser.add_argument("-t", "--tolerance", type=float, help="allowed slowdown before flagging a regression", default=0.10)
+    args = parser.parse_args()
+
+    makedirs(args.workdir, exist_ok=True)
+    stages = [stage for stage in args.stages.split(",") if stage in STAGES]
+
+    results = {}
+    for size_mb in args.sizes.split(","):
+        results[size_mb] = bench_size(int(size_mb), args.workdir, args.players, stages)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as baself:
+            json.dump(results, baself, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if path.exists(args.baseline):
+        with open(args.baseline) as baself:
+            baseline = json.load(baself)
+        print(f"\nCompared to {args.baseline}:")
+        if compare_to_baseline(results, baseline, args.tolerance):
+            sexit(1)
+
+
+if __name__ == "__main__":
+    main()
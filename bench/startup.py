@@ -0,0 +1,121 @@
+#! /usr/bin/env python3
+
+""" Benchmarks the startup of parse_logs (import, --help & a small report).
+
+    Usage : python -m bench.startup [-n 10] [--save-baseline] [--baseline bench/startup_baseline.json]
+
+    Each command runs in a fresh interpreter & the median wall time is kept.
+    Besides timings, the modules imported by each command are checked : a plain
+    report must not load matplotlib, numpy or requests. Exits with 1 on regression.
+"""
+
+from argparse import ArgumentParser
+from os import makedirs, path
+from statistics import median
+from subprocess import run, DEVNULL, PIPE
+from sys import exit as sexit, executable
+from time import perf_counter
+import json
+
+from bench.generate import generate_log, player_ids
+
+
+REPO_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+HEAVY_MODULES = ("matplotlib", "numpy", "requests")
+
+# Names are resolved beforehand so that the report doesn't wait on the network.
+# Loaded heavy modules are written to stderr once the command is done.
+COMMAND_TEMPLATE = """
+import sys
+sys.path.insert(0, {repo!r})
+import parse_logs
+for id_player in {ids!r}:
+    parse_logs.ID_PLAYERS[id_player] = {{"name": id_player}}
+sys.argv = ["parse_logs.py"] + {argv!r}
+try:
+    {call}
+except SystemExit:
+    pass
+sys.stderr.write(",".join(module for module in {heavy!r} if module in sys.modules))
+"""
+
+
+def commands(log_dir, nb_players):
+    ids = player_ids(nb_players)
+    report = ["report", "-d", log_dir, "-dt", "20201230", "-nc", "1"]
+    return {
+        "import": COMMAND_TEMPLATE.format(repo=REPO_DIR, ids=ids, argv=[], call="pass", heavy=HEAVY_MODULES),
+        "help": COMMAND_TEMPLATE.format(repo=REPO_DIR, ids=ids, argv=["--help"], call="parse_logs.main()", heavy=HEAVY_MODULES),
+        "report": COMMAND_TEMPLATE.format(repo=REPO_DIR, ids=ids, argv=report, call="parse_logs.main()", heavy=HEAVY_MODULES),
+    }
+
+
+def time_command(code, workdir, repeat):
+    timings = []
+    loaded = ""
+    for _ in range(repeat):
+        start = perf_counter()
+        proc = run([executable, "-c", code], cwd=workdir, stdout=DEVNULL, stderr=PIPE, check=True)
+        timings.append(perf_counter() - start)
+        loaded = proc.stderr.decode().strip().splitlines()[-1] if proc.stderr.strip() else ""
+    return {"seconds": median(timings), "heavy_modules": [module for module in loaded.split(",") if module]}
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        time_ratio = result["seconds"] / reference["seconds"] if reference["seconds"] else 1.0
+        flag = ""
+        if time_ratio > 1 + tolerance:
+            flag = "  <-- REGRESSION"
+            regressions.append(name)
+        print(f"{name:8} time x{time_ratio:.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(prog="bench.startup", description="Benchmarks parse_logs startup time")
+    parser.add_argument("-n", "--repeat", type=int, help="runs per command (median is kept)", default=10)
+    parser.add_argument("-w", "--workdir", type=str, help="where the log & outputs are written", default="bench_data/startup")
+    parser.add_argument("-p", "--players", type=int, help="number of players in the generated log", default=8)
+    parser.add_argument("-b", "--baseline", type=str, help="baseline file", default="bench/startup_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="stores results as the new baseline")
+    parser.add_argument("-t", "--tolerance", type=float, help="allowed slowdown before flagging a regression", default=0.20)
+    args = parser.parse_args()
+
+    workdir = path.abspath(args.workdir)
+    log_dir = path.join(workdir, "logs")
+    makedirs(log_dir, exist_ok=True)
+    raw_log = path.join(log_dir, "bench-startup_20201230.log")
+    if not path.exists(raw_log):
+        generate_log(raw_log, 1, args.players)
+
+    results = {}
+    regressions = []
+    for name, code in commands(log_dir, args.players).items():
+        results[name] = time_command(code, workdir, args.repeat)
+        heavy = results[name]["heavy_modules"]
+        flag = f"  <-- loads {', '.join(heavy)}" if heavy else ""
+        if heavy:
+            regressions.append(name)
+        print(f"{name:8} {results[name]['seconds']:7.3f} s{flag}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as baself:
+            json.dump(results, baself, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif path.exists(args.baseline):
+        with open(args.baseline) as baself:
+            baseline = json.load(baself)
+        print(f"\nCompared to {args.baseline}:")
+        regressions.extend(compare_to_baseline(results, baseline, args.tolerance))
+
+    if regressions:
+        sexit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,15 @@
 
 from argparse import ArgumentParser
 from time import strftime
+import sys
 
+# Each subcommand only gets the options it uses & sets the legacy flag that
+# selects its stages in parse_logs (so that heavy modules are only imported by
+# the subcommands that need them)
+SUBCOMMANDS = ("report", "graph", "deep", "milestones", "ingest", "compact")
 
-def handle_args():
 
-    parser = ArgumentParser(
-        prog="BSaviorLogParser", description="Parse Beat-savior log file to get important infos",
-    )
+def add_input_args(parser):
     parser.add_argument(
         "-f",
         "--logfile",
@@ -45,30 +47,167 @@ def handle_args():
         default=0,
     )
     parser.add_argument(
-        "-g",
-        "--graph",
+        "-dt",
+        "--date",
+        type=str,
+        help="By default, date used is today. You can modify this with this option (must be formatted like : 20201230)",
+        default=strftime("%Y%m%d"),
+    )
+    parser.add_argument(
+        "-nc",
+        "--nocolor",
         type=bool,
-        help="Indicates that graph infos (as csv) must be generated (files in directory must have a name like {player}-{date}. For example: dude-20200606.log)",
+        help="By default, output is colorize. You can disable it with this flag",
+        default=False,
     )
     parser.add_argument(
-        "-w",
-        "--show",
+        "-lf",
+        "--linefilters",
+        type=str,
+        help="Json file of rules dropping BeatSaviorData messages that are not runs (added to the default ones, see backend/linefilter.py). Lines dropped by each rule are shown",
+    )
+    parser.add_argument(
+        "-qf",
+        "--quarantine",
+        type=str,
+        help="Records that can't be decoded are always skipped & counted instead of stopping the parse, this option also appends them to this NDJSON file (with their source file & byte offset)",
+    )
+    parser.add_argument(
+        "-ss",
+        "--session",
+        type=str,
+        help="Only parses one session of the logfile : 'last', its number (1 is the first one) or a negative number (-1 is the last one). Sessions start with the settings records written when the game starts or after --sessiongap seconds without runs & are indexed in <logfile>.sessions so that only the session is read",
+    )
+    parser.add_argument(
+        "-lss",
+        "--listsessions",
         type=bool,
-        help="Indicates that graph must be built & shown (pairs with --graph option)",
+        help="Lists the sessions of the logfile (times, number of runs & players) & exits",
     )
     parser.add_argument(
-        "-dt",
-        "--date",
+        "-sg",
+        "--sessiongap",
+        type=int,
+        help="Seconds without runs after which the next run starts a new session",
+        default=1800,
+    )
+    parser.add_argument(
+        "-pl",
+        "--pipeline",
+        type=bool,
+        help="Reads, cleans & decodes the logs in background threads while runs are aggregated (overlaps disk/network reads with decoding, no merged or cleaned file is written)",
+    )
+    parser.add_argument(
+        "-qd",
+        "--queuedepth",
+        type=int,
+        help="With --pipeline, number of chunks (1MB) & of records that can wait between two threads (bounds the memory used)",
+        default=8,
+    )
+    parser.add_argument(
+        "-sr",
+        "--seenruns",
         type=str,
-        help="By default, date used is today. You can modify this with this option (must be formatted like : 20201230)",
-        default=strftime("%Y%m%d"),
+        help="Runs are always deduplicated inside one invocation. With this option, fingerprints of seen runs are also stored in this file so that runs already parsed by a previous invocation are skipped",
     )
     parser.add_argument(
-        "-dp",
-        "--deeptrackers",
+        "-mb",
+        "--memorybudget",
+        type=int,
+        help="Memory budget in MB. Records are decoded one by one & once deepTracker notes held in memory exceed the budget, they are spilled to a columnar scratch file & read back map by map",
+    )
+    parser.add_argument(
+        "-scd",
+        "--scratchdir",
+        type=str,
+        help="With --memorybudget, directory of the scratch file (default : system temp dir)",
+    )
+    parser.add_argument(
+        "-pf",
+        "--profile",
+        type=str,
+        help="Writes per-stage timings, memory peaks & name lookup counters to the given json file (for example : 'profile.json')",
+    )
+    parser.add_argument(
+        "-pfd",
+        "--profiledump",
+        type=str,
+        help="If --profile option is used, also dumps cProfile stats to this file (readable with pstats or snakeviz)",
+    )
+    parser.add_argument(
+        "-wk",
+        "--workers",
+        type=int,
+        help="Number of processes used to merge partial aggregates & to render graphs",
+        default=4,
+    )
+
+
+def add_report_args(parser):
+    parser.add_argument(
+        "-rp",
+        "--reportplan",
+        type=str,
+        help="Json file listing several reports (each with its own restrictmap, top, milestones, overall & output directory) that are all computed from one parse of the logs",
+    )
+    parser.add_argument(
+        "-q",
+        "--query",
+        type=str,
+        action="append",
+        help="Reports only on the runs matching this filter, for example 'player=dude|bob, difficulty=ExpertPlus, date=20201201..20201231, passed=1, paused=0, acc>=92' (fields : player, map, difficulty, passed, paused, date, acc, score, misses). Runs are indexed once so the option can be repeated, '-' reads queries from stdin",
+    )
+    parser.add_argument(
+        "-t",
+        "--top",
         type=bool,
-        help="With this option, deep trackers will be tacken in account & graphs per map/player will be showed",
+        help="Shows only the best runs on each maps",
     )
+    parser.add_argument(
+        "-sk",
+        "--sketches",
+        type=str,
+        help="Keeps accuracy percentile sketches per map in this file (updated at each run, pair it with --seenruns to not count runs twice) & shows p50/p90/p99 & the percentile of each run",
+    )
+    parser.add_argument(
+        "-sp",
+        "--savepartial",
+        type=str,
+        help="Saves the session results as mergeable partial aggregates (sums, counts, min/max & runs per map) in this directory",
+    )
+    parser.add_argument(
+        "-cp",
+        "--combine",
+        type=str,
+        help="Reports on partial aggregates (a directory or a glob like 'partials/partial-202012*.json') instead of parsing logs",
+    )
+
+
+def add_publish_args(parser):
+    parser.add_argument(
+        "-pub",
+        "--publish",
+        type=str,
+        help="Publishes map leaderboards, session averages (& trends with --graph) as versioned, precompressed json snapshots in this directory (only pieces that changed are written, see manifest.json)",
+    )
+    parser.add_argument(
+        "-pubh",
+        "--publishhtml",
+        type=bool,
+        help="With --publish, also writes an html page per piece & an index.html",
+    )
+
+
+def add_graph_args(parser):
+    parser.add_argument(
+        "-w",
+        "--show",
+        type=bool,
+        help="Indicates that graph must be built & shown (pairs with --graph option)",
+    )
+
+
+def add_deep_args(parser):
     parser.add_argument(
         "-dps",
         "--deeptrackerstoshow",
@@ -89,11 +228,108 @@ def handle_args():
         help="If --mapanalysis option is used, it is possible to average the multiple runs into one",
     )
     parser.add_argument(
-        "-nc",
-        "--nocolor",
+        "-mp",
+        "--maxpoints",
+        type=int,
+        help="Deep tracker series longer than this are downsampled to about this number of points before being drawn (0 draws every note)",
+        default=1000,
+    )
+    parser.add_argument(
+        "-dsm",
+        "--downsampling",
+        type=str,
+        help="Downsampling of deep tracker series : lttb (keeps the shape) or minmax (keeps every spike)",
+        default="lttb",
+        choices=("lttb", "minmax"),
+    )
+    parser.add_argument(
+        "-hm",
+        "--heatmaps",
         type=bool,
-        help="By default, output is colorize. You can disable it with this flag",
-        default=False,
+        help="Aggregates preswing, precision, postswing & timing of every deep tracked note per player, hand, grid cell & direction into heatmaps-{date}.csv/json",
+    )
+    parser.add_argument(
+        "-sw",
+        "--swing",
+        type=bool,
+        help="Computes swing angle deviation from the note direction, cut offset from the note center & saber direction consistency of every v2/v3 deep tracked note per player, map & hand into swing-{date}.csv",
+    )
+    parser.add_argument(
+        "-sec",
+        "--sections",
+        type=str,
+        help="Cuts every deep tracked run in windows ('5s' for 5 seconds, '20n' for 20 notes) & writes accuracy, misses & timing per window into sections-{date}.csv (restricted to --mapanalysis maps if given). Several comma-separated specs ('5s,20n') each get their own sections-{spec}-{date}.csv",
+    )
+
+
+def add_render_args(parser):
+    parser.add_argument(
+        "-rd",
+        "--renderdir",
+        type=str,
+        help="Instead of showing graphs (--deeptrackers, --show) one by one, renders all of them to files in this directory, in parallel & without display (with an index.html listing them)",
+    )
+    parser.add_argument(
+        "-rf",
+        "--renderformat",
+        type=str,
+        help="Format of rendered graphs : png or svg",
+        default="png",
+        choices=("png", "svg"),
+    )
+
+
+def add_ingest_args(parser):
+    parser.add_argument(
+        "-sd",
+        "--statedir",
+        type=str,
+        help="With --daemon, where the manifest of processed files & the persistent aggregates are stored",
+        default=".bsdlp_state",
+    )
+    parser.add_argument(
+        "-pi",
+        "--pollinterval",
+        type=float,
+        help="With --daemon, polling interval in seconds when inotify is not available",
+        default=5.0,
+    )
+
+
+def add_compact_args(parser):
+    parser.add_argument(
+        "-mia",
+        "--minage",
+        type=int,
+        help="With --compact, run files younger than this (in seconds) are left for the next compaction",
+        default=3600,
+    )
+    parser.add_argument(
+        "-ddy",
+        "--deepdays",
+        type=int,
+        help="With --compact, deepTrackers of runs older than this number of days are dropped",
+    )
+    parser.add_argument(
+        "-kdy",
+        "--keepdays",
+        type=int,
+        help="With --compact, runs older than this number of days are dropped",
+    )
+
+
+def add_legacy_args(parser):
+    parser.add_argument(
+        "-g",
+        "--graph",
+        type=bool,
+        help="Indicates that graph infos (as csv) must be generated (files in directory must have a name like {player}-{date}. For example: dude-20200606.log)",
+    )
+    parser.add_argument(
+        "-dp",
+        "--deeptrackers",
+        type=bool,
+        help="With this option, deep trackers will be tacken in account & graphs per map/player will be showed",
     )
     parser.add_argument(
         "-m",
@@ -102,10 +338,111 @@ def handle_args():
         help="Allows to pass a milestones (as a json string) to check against",
     )
     parser.add_argument(
-        "-t",
-        "--top",
+        "-dm",
+        "--daemon",
         type=bool,
-        help="Shows only the best runs on each maps",
+        help="Watches --directory & only parses newly arrived log files, folding them into persistent standings (csv are regenerated after each batch)",
+    )
+    parser.add_argument(
+        "-ct",
+        "--compact",
+        type=bool,
+        help="Rolls the runs received by restful.py (--directory BSDlogs) into per player, per month compressed & indexed segments, then deletes them",
     )
 
-    return parser.parse_args()
\ No newline at end of file
+
+def legacy_parser():
+    """ The historical flat parser : every option, no subcommand (defaults to 'report') """
+
+    parser = ArgumentParser(
+        prog="BSaviorLogParser",
+        description="Parse Beat-savior log file to get important infos (subcommands : {})".format(
+            ", ".join(SUBCOMMANDS)
+        ),
+    )
+    add_input_args(parser)
+    add_legacy_args(parser)
+    add_report_args(parser)
+    add_publish_args(parser)
+    add_graph_args(parser)
+    add_deep_args(parser)
+    add_render_args(parser)
+    add_ingest_args(parser)
+    add_compact_args(parser)
+
+    return parser
+
+
+def subcommands_parser():
+
+    parser = ArgumentParser(
+        prog="BSaviorLogParser", description="Parse Beat-savior log file to get important infos",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    report = subparsers.add_parser("report", help="Shows sessions standings (default when no subcommand is given)")
+    add_input_args(report)
+    add_report_args(report)
+    add_publish_args(report)
+
+    graph = subparsers.add_parser("graph", help="Generates graph infos (as csv) from {player}-{date} log files")
+    add_input_args(graph)
+    add_graph_args(graph)
+    add_publish_args(graph)
+    add_render_args(graph)
+
+    deep = subparsers.add_parser("deep", help="Takes deep trackers in account & shows graphs per map/player")
+    add_input_args(deep)
+    add_deep_args(deep)
+    add_render_args(deep)
+
+    milestones = subparsers.add_parser("milestones", help="Checks runs against milestones")
+    add_input_args(milestones)
+    milestones.add_argument(
+        "milestones", type=str, help="Milestones (as a json string) to check against",
+    )
+
+    ingest = subparsers.add_parser("ingest", help="Watches --directory & folds newly arrived log files into persistent standings")
+    add_input_args(ingest)
+    add_report_args(ingest)
+    add_publish_args(ingest)
+    add_ingest_args(ingest)
+
+    compact = subparsers.add_parser(
+        "compact", help="Rolls the runs received by restful.py into per player, per month compressed segments"
+    )
+    compact.add_argument(
+        "-d", "--directory", type=str, help="directory of the runs received by restful.py", default="BSDlogs",
+    )
+    add_compact_args(compact)
+
+    return parser
+
+
+def handle_args(args=None):
+
+    if args is None:
+        args = sys.argv[1:]
+
+    if not args or args[0] not in SUBCOMMANDS:
+        parsed = legacy_parser().parse_args(args)
+        parsed.command = "report"
+        return parsed
+
+    parsed = subcommands_parser().parse_args(args)
+
+    # Options not exposed by the subcommand keep their defaults
+    for option, default in vars(legacy_parser().parse_args([])).items():
+        if not hasattr(parsed, option):
+            setattr(parsed, option, default)
+
+    if parsed.command == "graph":
+        parsed.graph = True
+    elif parsed.command == "deep":
+        parsed.deeptrackers = True
+    elif parsed.command == "ingest":
+        parsed.daemon = True
+    elif parsed.command == "compact":
+        parsed.compact = True
+
+    return parsed
@@ -0,0 +1,115 @@
+#! /usr/bin/env python3
+
+""" Shape preserving downsampling of deepTracker series before plotting.
+
+    A screen can't resolve more than a few thousand points per line, so each
+    series longer than max_points is reduced to about max_points points with :
+      - lttb : Largest-Triangle-Three-Buckets, keeps the visual shape
+      - minmax : min & max of each bucket, keeps every spike
+
+    Series are plain lists of a few thousand notes at most, pure python is
+    faster than numpy for such small buckets (& doesn't need to import it).
+"""
+
+from math import isnan
+
+METHODS = ("lttb", "minmax")
+
+
+def bucket_edges(nb_points, nb_buckets):
+    """ nb_buckets + 1 edges splitting the points between the first & the last one """
+    step = (nb_points - 2) / nb_buckets
+    return [1 + int(step * bucket) for bucket in range(nb_buckets)] + [nb_points - 1]
+
+
+def lttb_indices(x_vals, y_vals, max_points):
+    nb_points = len(x_vals)
+    if max_points < 3 or nb_points <= max_points:
+        return list(range(nb_points))
+
+    edges = bucket_edges(nb_points, max_points - 2)
+    indices = [0]
+    selected = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # The third point of the triangle is the average of the next bucket (or the last point)
+        if bucket + 2 < len(edges):
+            next_start, next_end = end, edges[bucket + 2]
+        else:
+            next_start, next_end = nb_points - 1, nb_points
+        next_y = [y_val for y_val in y_vals[next_start:next_end] if not isnan(y_val)]
+        avg_x = sum(x_vals[next_start:next_end]) / (next_end - next_start)
+        avg_y = sum(next_y) / len(next_y) if next_y else 0.0
+
+        anchor_x, anchor_y = x_vals[selected], y_vals[selected]
+        if isnan(anchor_y):
+            anchor_y = avg_y
+        best_area = -1.0
+        best = start
+        for index in range(start, end):
+            area = abs(
+                (anchor_x - avg_x) * (y_vals[index] - anchor_y) - (anchor_x - x_vals[index]) * (avg_y - anchor_y)
+            )
+            # NaN areas (missing notes) are never greater
+            if area > best_area:
+                best_area = area
+                best = index
+        selected = best
+        indices.append(selected)
+
+    indices.append(nb_points - 1)
+    return indices
+
+
+def minmax_indices(y_vals, max_points):
+    nb_points = len(y_vals)
+    if max_points < 4 or nb_points <= max_points:
+        return list(range(nb_points))
+
+    edges = bucket_edges(nb_points, (max_points - 2) // 2)
+    indices = [0]
+    for start, end in zip(edges, edges[1:]):
+        bucket = [index for index in range(start, end) if not isnan(y_vals[index])]
+        if not bucket:
+            indices.append(start)
+            continue
+        low = min(bucket, key=y_vals.__getitem__)
+        high = max(bucket, key=y_vals.__getitem__)
+        indices.extend(sorted({low, high}))
+    indices.append(nb_points - 1)
+    return indices
+
+
+def downsample_indices(x_vals, y_vals, max_points, method="lttb"):
+    if method == "minmax":
+        return minmax_indices(y_vals, max_points)
+    return lttb_indices(x_vals, y_vals, max_points)
+
+
+def downsample_map(all_x, all_y, max_points, method="lttb", bands=None, x_of=None):
+    """ Returns all_x, all_y & bands with every series reduced to about max_points points.
+
+        x_of(all_x, y_name) gives the x of a series (several series can share one x),
+        a downsampled series gets its own x stored under its name in all_x.
+        A band is reduced with the indices of its series.
+    """
+    if not max_points:
+        return all_x, all_y, bands
+
+    new_x = dict(all_x)
+    new_y = {}
+    new_bands = dict(bands) if bands else bands
+    for y_name, y_vals in all_y.items():
+        x_vals = x_of(all_x, y_name) if x_of else all_x[y_name]
+        if len(y_vals) <= max_points:
+            new_y[y_name] = y_vals
+            continue
+        x_vals, y_vals = list(x_vals), [float(y_val) for y_val in y_vals]
+        indices = downsample_indices(x_vals, y_vals, max_points, method)
+        new_x[y_name] = [x_vals[index] for index in indices]
+        new_y[y_name] = [y_vals[index] for index in indices]
+        if bands and y_name in bands:
+            limits = [list(limit) for limit in bands[y_name]]
+            new_bands[y_name] = tuple([limit[index] for index in indices] for limit in limits)
+
+    return new_x, new_y, new_bands
@@ -0,0 +1,134 @@
+#! /usr/bin/env python3
+
+""" Versioned & precompressed static snapshots of the standings for the web frontend.
+
+    Each piece (a map leaderboard, the session averages, a trend...) is a json-able
+    dict, either a table {"title", "columns", "rows"} or series {"title", "x", "series"}.
+    It is written as pieces/<slug>.<hash>.json (& .json.gz, .html & .html.gz with
+    html=True) where hash is the hash of its content : a file never changes once
+    written (it can be cached forever) & a piece that didn't change since the
+    last publish isn't written again.
+
+    manifest.json maps the name of each piece to its current files. It is replaced
+    last & atomically, like every file, so a viewer never sees a half written
+    snapshot. Pieces that aren't published again (a publish restricted to some maps,
+    a daemon batch that only rebuilt the maps it touched...) keep their entries.
+    Files only referenced by older manifests than the previous one are removed.
+"""
+
+from hashlib import blake2b
+from html import escape
+from os import listdir, makedirs, path, remove, replace
+from time import strftime
+import gzip
+import json
+
+from frontend.render import slugify
+
+
+def content_hash(piece):
+    canonical = json.dumps(piece, sort_keys=True, separators=(",", ":")).encode()
+    return blake2b(canonical, digest_size=8).hexdigest()
+
+
+def write_atomic(filename, data):
+    """ Writes data (bytes) & its gzipped copy (for servers serving precompressed files) """
+
+    for target, content in ((filename, data), (f"{filename}.gz", gzip.compress(data, mtime=0))):
+        with open(f"{target}.tmp", "wb") as tmpf:
+            tmpf.write(content)
+        replace(f"{target}.tmp", target)
+
+
+def html_cell(value):
+    return "" if value is None else escape(str(value))
+
+
+def piece_as_html(piece):
+    lines = [f"<html><head><meta charset=\"utf-8\"><title>{escape(piece['title'])}</title></head><body>"]
+    lines.append(f"<h2>{escape(piece['title'])}</h2>\n<table border=\"1\">")
+    if "series" in piece:
+        lines.append("<tr><th></th>" + "".join(f"<th>{html_cell(x)}</th>" for x in piece["x"]) + "</tr>")
+        for serie, values in piece["series"].items():
+            cells = "".join(f"<td>{html_cell(value)}</td>" for value in values)
+            lines.append(f"<tr><th>{html_cell(serie)}</th>{cells}</tr>")
+    else:
+        lines.append("<tr>" + "".join(f"<th>{html_cell(column)}</th>" for column in piece["columns"]) + "</tr>")
+        for row in piece["rows"]:
+            lines.append("<tr>" + "".join(f"<td>{html_cell(value)}</td>" for value in row) + "</tr>")
+    lines.append("</table></body></html>\n")
+    return "\n".join(lines)
+
+
+def index_as_html(manifest):
+    lines = ["<html><head><meta charset=\"utf-8\"><title>Standings</title></head><body>"]
+    lines.append(f"<h2>Standings (version {manifest['version']}, {manifest['published']})</h2>\n<ul>")
+    for name, entry in sorted(manifest["pieces"].items()):
+        link = entry.get("html", entry["json"])
+        lines.append(f"<li><a href=\"{escape(link)}\">{escape(name)}</a></li>")
+    lines.append("</ul></body></html>\n")
+    return "\n".join(lines)
+
+
+def load_manifest(output_dir):
+    try:
+        with open(path.join(output_dir, "manifest.json")) as manf:
+            return json.load(manf)
+    except FileNotFoundError:
+        return {"version": 0, "pieces": {}, "previous_files": []}
+
+
+def manifest_files(manifest):
+    files = set()
+    for entry in manifest["pieces"].values():
+        files.add(entry["json"])
+        if "html" in entry:
+            files.add(entry["html"])
+    return files
+
+
+def publish(output_dir, pieces, html=False):
+    """ Publishes pieces ({name: piece}) to output_dir, returns (written, unchanged) counts
+        The other pieces of the previous manifest are kept as they were
+    """
+
+    makedirs(path.join(output_dir, "pieces"), exist_ok=True)
+    previous = load_manifest(output_dir)
+    manifest = {"version": previous["version"], "published": previous.get("published"), "pieces": dict(previous["pieces"])}
+    written = 0
+    for name, piece in pieces.items():
+        digest = content_hash(piece)
+        entry = previous["pieces"].get(name)
+        if entry and entry["hash"] == digest and ("html" in entry) == html:
+            manifest["pieces"][name] = entry
+            continue
+        base = path.join("pieces", f"{slugify(name)}.{digest}")
+        entry = {"hash": digest, "json": f"{base}.json"}
+        write_atomic(path.join(output_dir, entry["json"]), json.dumps(piece).encode())
+        if html:
+            entry["html"] = f"{base}.html"
+            write_atomic(path.join(output_dir, entry["html"]), piece_as_html(piece).encode())
+        manifest["pieces"][name] = entry
+        written += 1
+
+    unchanged = len(pieces) - written
+    if not written:
+        return written, unchanged
+
+    manifest["version"] += 1
+    manifest["published"] = strftime("%Y-%m-%d %H:%M:%S")
+    for entry in manifest["pieces"].values():
+        entry.setdefault("version", manifest["version"])
+    # Viewers that fetched the previous manifest can still fetch its files
+    manifest["previous_files"] = sorted(manifest_files(previous))
+    if html:
+        write_atomic(path.join(output_dir, "index.html"), index_as_html(manifest).encode())
+    write_atomic(path.join(output_dir, "manifest.json"), json.dumps(manifest, indent=2).encode())
+
+    kept = manifest_files(manifest) | set(manifest["previous_files"])
+    for name in listdir(path.join(output_dir, "pieces")):
+        piece_file = path.join("pieces", name[:-3] if name.endswith(".gz") else name)
+        if piece_file not in kept and not name.endswith(".tmp"):
+            remove(path.join(output_dir, "pieces", name))
+
+    return written, unchanged
@@ -0,0 +1,129 @@
+#! /usr/bin/env python3
+
+""" Headless rendering of deepTracker & trend graphs to files.
+
+    Figures are drawn by a pool of processes with the non-interactive Agg backend
+    (no display needed) through matplotlib's object API : each figure is created,
+    saved & dropped by the worker, so memory doesn't grow with the number of
+    charts. The number of figures waiting in the pool is bounded as well.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from os import makedirs, path
+import json
+import re
+
+
+def slugify(name):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", name).strip("_")[:120]
+
+
+def series_x(all_x, y_name):
+    """ x of a series : its own if all_x has one (several runs), otherwise the one of its hand """
+    if y_name in all_x:
+        return all_x[y_name]
+    return all_x["Left notes timing"] if "left" in y_name else all_x["Right notes timing"]
+
+
+def draw_map(fig, all_x, all_y, player_name, map_name, bands):
+    from matplotlib import colormaps  # pylint: disable=import-outside-toplevel
+
+    palette = colormaps["Set1"]
+    axes = fig.subplots()
+    for color, (y_name, y_vals) in enumerate(all_y.items()):
+        x_note_time = series_x(all_x, y_name)
+        linewidth = 1 if "Hit timing" in y_name else 2
+        if bands and y_name in bands:
+            axes.fill_between(x_note_time, *bands[y_name], color=palette(color), alpha=0.2, linewidth=0)
+        axes.plot(x_note_time, y_vals, marker="", color=palette(color), linewidth=linewidth, alpha=0.9, label=y_name)
+    axes.legend(loc="upper center", bbox_to_anchor=(0.5, 1.15), ncol=5, fancybox=True, shadow=True)
+    axes.set_title(f"|{player_name}| ({map_name})", loc="left", fontsize=14, fontweight=4, color="White")
+    axes.set_xlabel("Time (seconds)")
+    axes.set_ylabel("Score (points) & hit timing (millisecs)")
+    axes.grid()
+
+
+def draw_graph(fig, type_maps, x_axis, all_y):
+    from matplotlib import colormaps  # pylint: disable=import-outside-toplevel
+
+    palette = colormaps["Set1"]
+    axes = fig.subplots()
+    for palette_color, player in enumerate(all_y.keys()):
+        axes.plot(x_axis, all_y[player], marker="", color=palette(palette_color), linewidth=2, alpha=0.9, label=player)
+    axes.legend(loc="upper center", bbox_to_anchor=(0.5, 1.15), ncol=4, fancybox=True, shadow=True)
+    axes.set_title(type_maps, loc="left", fontsize=24, fontweight=4, color="orange")
+    axes.set_xlabel("Date")
+    axes.set_ylabel("Score")
+    axes.grid()
+
+
+DRAWERS = {"map": draw_map, "graph": draw_graph}
+
+
+def render_figure(kind, args, output):
+    """ Runs in a worker : draws one figure & writes it to output """
+    # pylint: disable=import-outside-toplevel
+    from matplotlib import style
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    with style.context("dark_background"):
+        fig = Figure(figsize=(19.2, 10.8))
+        FigureCanvasAgg(fig)
+        DRAWERS[kind](fig, *args)
+        fig.savefig(output, bbox_inches="tight")
+    return output
+
+
+class BatchRenderer:
+    def __init__(self, output_dir, image_format="png", workers=4):
+        makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.image_format = image_format
+        self.workers = workers
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.pending = []
+        self.index = []
+        self.names = set()
+
+    def output_for(self, name):
+        slug = slugify(name)
+        candidate = slug
+        counter = 2
+        while candidate in self.names:
+            candidate = f"{slug}-{counter}"
+            counter += 1
+        self.names.add(candidate)
+        return path.join(self.output_dir, f"{candidate}.{self.image_format}")
+
+    def submit(self, kind, name, args, infos):
+        """ Queues a figure, blocking while too many figures are already waiting """
+        while len(self.pending) >= 2 * self.workers:
+            self.collect(self.pending.pop(0))
+        output = self.output_for(name)
+        self.pending.append((self.pool.submit(render_figure, kind, args, output), {"kind": kind, "file": path.basename(output), **infos}))
+
+    def collect(self, pending):
+        future, infos = pending
+        try:
+            future.result()
+            self.index.append(infos)
+        except Exception as err:  # pylint: disable=broad-except
+            print(f"Could not render {infos['file']} : {err}")
+
+    def close(self):
+        """ Waits for every figure & writes the index (json & html) of what was rendered """
+        for pending in self.pending:
+            self.collect(pending)
+        self.pending = []
+        self.pool.shutdown()
+
+        with open(path.join(self.output_dir, "index.json"), "w") as indexf:
+            json.dump(self.index, indexf, indent=2)
+        with open(path.join(self.output_dir, "index.html"), "w") as indexf:
+            indexf.write("<html><body>\n")
+            for infos in self.index:
+                label = " - ".join(str(value) for key, value in infos.items() if key not in ("file", "kind"))
+                indexf.write(f'<h3>{label}</h3>\n<img src="{infos["file"]}" width="100%">\n')
+            indexf.write("</body></html>\n")
+        print(f"{len(self.index)} figures rendered in {self.output_dir} (see index.html)")
@@ -1,6 +1,6 @@
 """ This script computes a lot of stats from bsd logfiles.
 
-    Most up-to-date usage guide is available with `parse_logs.py --help`
+    Most up-to-date usage guide is available with `parse_logs.py --help` (& `parse_logs.py <report|graph|deep|milestones|ingest> --help`)
 
 """
 
@@ -11,95 +11,324 @@
 # pylint: disable=line-too-long, bad-continuation
 
 from sys import exit as sexit  # prevents redefining exit builtin
-from os import access, R_OK, SEEK_SET, listdir, fsencode, fsdecode
-from time import strftime, strptime
+from os import access, R_OK, SEEK_SET, SEEK_END, listdir, fsencode, fsdecode, makedirs, path
+from time import localtime, strftime, strptime, perf_counter
+from shutil import copyfileobj
+from glob import glob
+from itertools import chain
+import io
+import gzip
+import bz2
+import lzma
 import json
-import requests
+# matplotlib (~1s), requests & numpy (analysis package) are imported by the functions
+# using them so that commands which don't draw/fetch/align don't pay for them at startup
 from colorama import Fore, Style  # Back,
-from matplotlib.pyplot import (
-    get_cmap,
-    style,
-    plot,
-    legend,
-    title,
-    xlabel,
-    ylabel,
-    grid,
-    show,
-    get_current_fig_manager,
-    # savefig,
-    # figure,
-)
 from frontend.cli import handle_args
+from frontend.render import BatchRenderer, series_x, slugify
+from frontend.downsample import downsample_map
+from backend.profiler import NullProfiler, StageProfiler
+from backend.dedup import SeenRuns
+from backend.sketches import MapSketches
+from backend.notestore import NoteStore
+from backend.symbols import SymbolTable
+from backend.linefilter import LineFilter, load_rules
+from backend.quarantine import Quarantine
+from backend.runindex import RunIndex, date_bounds, parse_query
+from backend.pipeline import Pipeline
+from backend.segments import INDEX_EXT as SEGMENT_INDEX_EXT, SEGMENT_EXT, compact_tree, player_runs
+from backend.sessions import INDEX_EXT as SESSION_INDEX_EXT, read_session, select_session, session_index
+from backend.watcher import DirectoryWatcher
+from backend.aggregates import (
+    load_aggregates,
+    save_aggregates,
+    merge_aggregates,
+    partial_aggregates,
+    combine_partial_files,
+    rekey_aggregates,
+)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 URLSS = "https://new.scoresaber.com/api/player/{}/full"
 ID_PLAYERS = {}
 MAPS_PLAYED = {}
+# Maps & players are interned into ids when runs are decoded, names are resolved for output only
+MAP_SYMBOLS = SymbolTable()
+PLAYER_SYMBOLS = SymbolTable()
 CSVF_HEADER = "Rank,Player,Acc,Left Average,Left Before,Precision,Left After,Right Average,Right Before,Precision,Right After,Miss,Failed\n"
 CSVF_HEADER_DISTANCE = "Rank,Player,Acc,Left Average,Left Before,Precision,Left After,Left Distance Saber,Left Distance Hand,Right Average,Right Before,Precision,Right After,Right Distance Saber,Right Distance Hand,Miss,Failed\n"
 CSVF_HEADER_AVERAGE = "Rank,AvRank,Player,Acc,Left Average,Left Before,Precision,Left After,Right Average,Right Before,Precision,Right After,Miss,Nb Map Played,Nb Map Failed\n"
 CSVF_HEADER_AVERAGE_DISTANCE = "Rank,AvRank,Player,Acc,Left Average,Left Before,Precision,Left After,Left Distance Saber,Left Distance Hand,Right Average,Right Before,Precision,Right After,Right Distance Saber,Right Distance Hand,Miss,Nb Map Played,Nb Map Failed\n"
 MAPS_MISC_INFOS = {}
 DATETIME = ""
+PROFILER = NullProfiler()
+RENDERER = None  # BatchRenderer when figures are written to files instead of shown
+QUARANTINE = Quarantine()  # malformed records are only counted unless a quarantine file is given
+LINE_FILTER = LineFilter()  # drops the BeatSaviorData messages that are not runs
+DOWNSAMPLING = {"max_points": 1000, "method": "lttb"}  # per series, 0 plots every note
+NAME_LOOKUPS = {"cache_hits": 0, "cache_misses": 0, "http_calls": 0, "http_errors": 0, "http_seconds": 0.0}
+COMPRESSION_MAGICS = {
+    b"\x1f\x8b": "gzip",
+    b"BZh": "bz2",
+    b"\xfd7zXZ\x00": "xz",
+    b"\x28\xb5\x2f\xfd": "zstd",
+}
+COMPRESSION_EXTS = (".gz", ".bz2", ".xz", ".zst")
+
+
+def detect_compression(logfile):
+    """ Returns the compression format of logfile (found with its magic bytes) or None """
+    with open(logfile, "rb") as logf:
+        head = logf.read(6)
+    for magic, compression in COMPRESSION_MAGICS.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def open_logfile(logfile, mode="r"):
+    """ Opens logfile for reading, transparently decompressing it while streaming.
+
+        Mode "r" returns a text stream, "rb" a binary one. Nothing is
+        inflated to a temp file, decompression happens chunk by chunk as
+        the caller reads.
+    """
+    compression = detect_compression(logfile)
+    if compression == "gzip":
+        raw = gzip.open(logfile, "rb")
+    elif compression == "bz2":
+        raw = bz2.open(logfile, "rb")
+    elif compression == "xz":
+        raw = lzma.open(logfile, "rb")
+    elif compression == "zstd":
+        if zstandard is None:
+            print(f"{logfile} is zstd compressed but the zstandard module is not installed")
+            sexit(1)
+        raw = zstandard.ZstdDecompressor().stream_reader(
+            open(logfile, "rb"), read_across_frames=True, closefd=True
+        )
+    else:
+        raw = open(logfile, "rb")
+    if mode == "rb":
+        return raw
+    return io.TextIOWrapper(raw, encoding="utf-8", errors="replace")
+
+
+def strip_compression_ext(logfile):
+    for ext in COMPRESSION_EXTS:
+        if logfile.endswith(ext):
+            return logfile[: -len(ext)]
+    return logfile
+
+
+def clean_line(line):
+    """ Cleaned line (bytes) as written in the cleaned logfile, None if it is dropped """
+
+    if line.endswith(b"\r\n"):
+        line = line[:-2] + b"\n"
+    try:
+        json.loads(line)
+        return line + b",\n"
+    except ValueError:
+        _, _, line_cleaned = line.partition(b"Data]")
+        line_cleaned = line_cleaned.replace(b"Data]", b"")[1:]
+        # Records are kept as they are, only other messages go through the filters
+        if line_cleaned and not line_cleaned.startswith(b"{") and LINE_FILTER.match(line_cleaned):
+            return None
+        if line_cleaned.startswith(b"}"):
+            line_cleaned = b"},\n"
+        if line_cleaned.endswith(b"}}\n"):
+            line_cleaned += b",\n"
+        return line_cleaned
 
 
 def clean_logfile(logfile):
+    """ Keeps the BeatSaviorData records of logfile as a json list, other messages
+        being dropped by LINE_FILTER. Lines are handled as bytes, never decoded.
+    """
 
-    cleaned_name = f"{logfile}_cleaned"
+    cleaned_name = f"{strip_compression_ext(logfile)}_cleaned"
 
-    cleaned_logfile = open(cleaned_name, "w")
+    cleaned_logfile = open(cleaned_name, "wb")
 
-    with open(logfile, "r") as logf:
-        cleaned_logfile.write("[\n")
+    with open_logfile(logfile, "rb") as logf:
+        cleaned_logfile.write(b"[\n")
         for line in logf:
-            try:
-                json.loads(line)
-                line_cleaned = line + ",\n"
-            except json.decoder.JSONDecodeError:
-                line_cleaned = "".join(line.split("Data]")[1:])[1:]
-                if "********" in line_cleaned:
-                    continue
-                if "upload" in line_cleaned.lower():
-                    continue
-                if "cheat in practice mode" in line_cleaned.lower():
-                    continue
-                if "was a replay you cheater" in line_cleaned.lower():
-                    continue
-                if line_cleaned.startswith("}"):
-                    line_cleaned = "},\n"
-                if line_cleaned.endswith("}}\n"):
-                    line_cleaned += ",\n"
-            cleaned_logfile.write(line_cleaned)
+            line_cleaned = clean_line(line)
+            if line_cleaned is not None:
+                cleaned_logfile.write(line_cleaned)
 
     cleaned_logfile.seek(cleaned_logfile.tell() - 2, SEEK_SET)
-    cleaned_logfile.write("]")
+    cleaned_logfile.write(b"]")
     cleaned_logfile.close()
 
     return cleaned_name
 
 
-def parse_logfile(cleaned_logfile):
+def parse_logfile(cleaned_logfile, quarantine=None):
+    """ Decodes the whole cleaned logfile at once. If it isn't valid json, falls back
+        to decoding it record by record, malformed records going to quarantine.
+    """
 
     infos = []
 
-    with open(cleaned_logfile, "r") as logf:
+    with open_logfile(cleaned_logfile) as logf:
         try:
             infos = json.load(logf)
-        except json.decoder.JSONDecodeError as jsonerr:
-            print(jsonerr)
-            sexit(1)
+        except json.decoder.JSONDecodeError:
+            infos = None
+
+    if infos is None:
+        infos = list(iter_logfile(cleaned_logfile, quarantine=quarantine))
 
     return infos
 
 
+def iter_logfile(cleaned_logfile, chunk_size=1 << 20, quarantine=None):
+    """ Yields the records of a cleaned logfile one by one, without loading the whole file.
+
+        A record that can't be decoded is skipped up to the next line starting a record
+        & handed to quarantine (QUARANTINE by default) with its byte offset.
+    """
+
+    with open_logfile(cleaned_logfile) as logf:
+        yield from iter_records(logf.read, cleaned_logfile, chunk_size, quarantine)
+
+
+def iter_records(read, source, chunk_size=1 << 20, quarantine=None):
+    """ Yields the records of the cleaned text returned by read(size) ("" once it is all read),
+        malformed records going to quarantine with source & their offset in the text
+    """
+
+    quarantine = quarantine or QUARANTINE
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    buf_offset = 0  # byte offset of buf in the text
+    eof = False
+    read_size = chunk_size
+    while True:
+        # Skips what is between records
+        while pos < len(buf) and buf[pos] in " \t\r\n,[]":
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                return
+            buf_offset += len(buf.encode())
+            buf = read(chunk_size)
+            pos = 0
+            eof = not buf
+            continue
+        try:
+            record, end = decoder.raw_decode(buf, pos)
+        except json.decoder.JSONDecodeError as jsonerr:
+            next_record = buf.find("\n{", pos + 1)
+            if next_record == -1 and not eof:
+                # Record cut by the end of the buffer : reads more (twice as much each time
+                # so that a huge record is not decoded again & again)
+                chunk = read(read_size)
+                read_size *= 2
+                eof = not chunk
+                buf_offset += len(buf[:pos].encode())
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            # Malformed record (truncated run of a crashed session for ex)
+            end = next_record + 1 if next_record != -1 else len(buf)
+            quarantine.add(
+                source,
+                buf_offset + len(buf[:pos].encode()),
+                jsonerr,
+                buf[pos:end].rstrip(" \t\r\n,[]"),
+            )
+            pos = end
+            continue
+        read_size = chunk_size
+        if not isinstance(record, dict):
+            quarantine.add(source, buf_offset + len(buf[:pos].encode()), "not a record", buf[pos:end])
+            pos = end
+            continue
+        pos = end
+        yield record
+
+
+def read_logfiles(logfiles, chunk_size=1 << 20):
+    """ Reader stage : yields (logfile, chunk) for bulk reads of each logfile (decompressed
+        on the fly), an empty chunk ending each file
+    """
+
+    for logfile in logfiles:
+        with open_logfile(logfile, "rb") as logf:
+            chunk = logf.read(chunk_size)
+            while chunk:
+                yield logfile, chunk
+                chunk = logf.read(chunk_size)
+        yield logfile, b""
+
+
+def cleaned_text(chunk, chunks, cleaned=False):
+    """ Yields the cleaned text of one logfile, from its chunk until the empty one ending it
+        (decoded like open_logfile does : what isn't utf-8 is replaced)
+    """
+
+    partial = b""
+    while chunk:
+        # Lines cut by the end of the chunk are completed by the next one
+        lines = (partial + chunk).split(b"\n")
+        partial = lines.pop()
+        if cleaned:
+            yield b"\n".join(lines).decode(errors="replace") + "\n"
+        else:
+            yield b"".join(filter(None, map(clean_line, [line + b"\n" for line in lines]))).decode(errors="replace")
+        _, chunk = next(chunks)
+    if partial:
+        yield (partial if cleaned else clean_line(partial) or b"").decode(errors="replace")
+
+
+def text_reader(pieces):
+    """ read(size) function over an iterator of text pieces """
+
+    def read(size):
+        text = []
+        length = 0
+        for piece in pieces:
+            text.append(piece)
+            length += len(piece)
+            if length >= size:
+                break
+        return "".join(text)
+
+    return read
+
+
+def decode_chunks(chunks, cleaned=False):
+    """ Decoder stage : yields the records of the (logfile, chunk) of read_logfiles.
+        Offsets of quarantined records are offsets in the cleaned text of their logfile.
+    """
+
+    for logfile, chunk in chunks:
+        # cleaned_text consumes the chunks of this logfile only
+        yield from iter_records(text_reader(cleaned_text(chunk, chunks, cleaned)), logfile)
+
+
 def get_name_by_id(id_player):
 
     name_player = id_player
 
     if ID_PLAYERS.get(id_player):
+        NAME_LOOKUPS["cache_hits"] += 1
         return ID_PLAYERS[id_player]["name"]
 
+    import requests  # pylint: disable=import-outside-toplevel
+
+    NAME_LOOKUPS["cache_misses"] += 1
+    NAME_LOOKUPS["http_calls"] += 1
+    start_request = perf_counter()
     try:
         req_infos_ssaber = requests.get(URLSS.format(id_player))
         req_infos_ssaber.raise_for_status()
@@ -109,8 +338,10 @@ def get_name_by_id(id_player):
         ID_PLAYERS[id_player]["name"] = name_player
     except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError):
         # Api is certainly dead or there is an issue with connection, we fallback to id...
+        NAME_LOOKUPS["http_errors"] += 1
         ID_PLAYERS[id_player] = {}
         ID_PLAYERS[id_player]["name"] = id_player
+    NAME_LOOKUPS["http_seconds"] += perf_counter() - start_request
 
     return name_player
 
@@ -138,15 +369,32 @@ def retrieve_player_infos(info_map):
         )
 
 
-def show_map(all_x, all_y, player_name, map_name):
+def show_map(all_x, all_y, player_name, map_name, bands=None):
+    """ bands can hold a (low, high) band drawn around some of the all_y series """
+    all_x, all_y, bands = downsample_map(
+        all_x, all_y, DOWNSAMPLING["max_points"], DOWNSAMPLING["method"], bands, x_of=series_x
+    )
+
+    if RENDERER:
+        RENDERER.submit(
+            "map",
+            f"{map_name}-{player_name}",
+            (all_x, all_y, player_name, map_name, bands),
+            {"map": map_name, "player": player_name},
+        )
+        return
+
+    # pylint: disable=import-outside-toplevel
+    from matplotlib.pyplot import get_cmap, style, plot, legend, title, xlabel, ylabel, grid, show, fill_between
+
     style.use("dark_background")
     palette = get_cmap("Set1")
     color = 0
     for y_name, y_vals in all_y.items():
-        x_note_time = (
-            all_x["Left notes timing"] if "left" in y_name else all_x["Right notes timing"]
-        )
+        x_note_time = series_x(all_x, y_name)
         linewidth = 1 if "Hit timing" in y_name else 2
+        if bands and y_name in bands:
+            fill_between(x_note_time, *bands[y_name], color=palette(color), alpha=0.2, linewidth=0)
         plot(
             x_note_time,
             y_vals,
@@ -165,8 +413,7 @@ def show_map(all_x, all_y, player_name, map_name):
     xlabel("Time (seconds)")
     ylabel("Score (points) & hit timing (millisecs)")
     grid()
-    mng = get_current_fig_manager()
-    mng.resize(*mng.window.maxsize())
+    maximize_window()
     show()
 
 
@@ -224,63 +471,58 @@ def get_run_as_coord(list_notes, sub_deeptrackers):
         "Postswing (right)": y_right_postswing,
     }
 
-    if sub_deeptrackers:
-        subdp = sub_deeptrackers.split(",")
-        y_sub = all_y.copy()
+    return all_x, keep_sub_deeptrackers(all_y, sub_deeptrackers)
 
-        for y in y_sub.keys():
-            # if subdp.lower() not in y.lower():
-            found = False
-            for sub in subdp:
-                if sub.lower() in y.lower():
-                    found = True
-            if not found:
-                del all_y[y]
 
-    return all_x, all_y
+def keep_sub_deeptrackers(all_y, sub_deeptrackers):
+    if not sub_deeptrackers or sub_deeptrackers == "all":
+        return all_y
+
+    subdp = sub_deeptrackers.split(",")
+    return {y: y_vals for y, y_vals in all_y.items() if any(sub.lower() in y.lower() for sub in subdp)}
 
 
-def show_multiple_runs_map(map_name, players_runs, sub_deeptrackers, averaged=False):
+def show_multiple_runs_map(map_name, players_runs, sub_deeptrackers):
 
     all_x = {}
     all_y = {}
     player_run = 1
 
-    for player_name in players_runs:
-        for list_notes in players_runs[player_name]:
-            all_x, player_y = get_run_as_coord(list_notes, sub_deeptrackers)
+    for player_id in players_runs:
+        player_name = PLAYER_SYMBOLS.name(player_id)
+        for list_notes in players_runs[player_id]:
+            player_x, player_y = get_run_as_coord(list_notes, sub_deeptrackers)
             for y_name, y_list in player_y.items():
+                # Runs don't have the same notes, each series keeps the timing of its own run
+                all_x[f"{y_name}_{player_name}_{str(player_run)}"] = series_x(player_x, y_name)
                 all_y[f"{y_name}_{player_name}_{str(player_run)}"] = y_list
             player_run += 1
         player_run = 1
 
-    if not player_name:
-        player_name = "Averaged"
-    if not averaged:
-        show_map(all_x, all_y, player_name, map_name)
-    else:
-        import statistics
+    show_map(all_x, all_y, player_name, map_name)
 
-        sort_all_y = {}
-        for name, y in all_y.items():
-            y_name, player_name, player_run = name.split("_")
-            try:
-                sort_all_y[y_name].append(y)
-            except KeyError:
-                sort_all_y[y_name] = [y]
 
-        av_all_y = {}
-        for name, y in sort_all_y.items():
-            print(y[-1])
-            av_y = [statistics.mean(k) for k in zip(*y)]
-            print(av_y[-1])
-            av_all_y[name] = av_y
-        show_map(all_x, av_all_y, player_name, map_name)
+def show_averaged_runs_map(map_name, players_columns, sub_deeptrackers):
+    """ Averages runs note by note (aligned on note ids, missing notes being ignored)
+        & shows the mean of each series with its 10-90 percentiles band.
+    """
+    from analysis.alignment import SERIES, HANDS, align_runs, runs_statistics  # pylint: disable=import-outside-toplevel
+
+    runs_columns = [columns for runs in players_columns.values() for columns in runs]
+    _, aligned = align_runs(runs_columns)
+    series_names = keep_sub_deeptrackers(
+        {f"{series} ({hand})": None for hand in HANDS for series in SERIES}, sub_deeptrackers
+    )
+    all_x, all_stats = runs_statistics(aligned, series_names=series_names)
+
+    av_all_y = {y_name: stats["mean"] for y_name, stats in all_stats.items()}
+    bands = {y_name: (stats["low"], stats["high"]) for y_name, stats in all_stats.items()}
+    show_map(all_x, av_all_y, f"Averaged over {len(runs_columns)} runs", map_name, bands)
 
 
 def handle_notes_values(notes_dict, sub_deeptrackers, maps_to_analyze, averaged=False):
     """
-        notes_dict looks like : 
+        notes_dict is a NoteStore, its runs_of_map(map_name) looks like :
         {
             map_name : 
                 player_name : 
@@ -355,25 +597,27 @@ v3:
 
     if maps_to_analyze:
         maps_to_analyze_list = maps_to_analyze.split(",")
-        notes_dict_strip = notes_dict.copy()
 
-        for map_name in notes_dict_strip.keys():
+        for map_id in notes_dict.map_names():
+            map_name = MAP_SYMBOLS.name(map_id)
             found = False
             for map_to_analyze in maps_to_analyze_list:
                 if map_to_analyze.lower() in map_name.lower():
                     found = True
             if not found:
-                del notes_dict[map_name]
-
-        for map_name, players_runs in notes_dict.items():
-            show_multiple_runs_map(map_name, players_runs, sub_deeptrackers, averaged)
+                continue
+            # Runs are read back (from the scratch file if they were spilled) one map at a time
+            if averaged:
+                show_averaged_runs_map(map_name, notes_dict.columns_of_map(map_id), sub_deeptrackers)
+            else:
+                show_multiple_runs_map(map_name, notes_dict.runs_of_map(map_id), sub_deeptrackers)
 
     else:
-        for map_name, player_runs in notes_dict.items():
-            for player_name in player_runs:
-                for list_notes in player_runs[player_name]:
+        for map_id, player_runs in notes_dict.items():
+            for player_id in player_runs:
+                for list_notes in player_runs[player_id]:
                     all_x, all_y = get_run_as_coord(list_notes, sub_deeptrackers)
-                    show_map(all_x, all_y, player_name, map_name)
+                    show_map(all_x, all_y, PLAYER_SYMBOLS.name(player_id), MAP_SYMBOLS.name(map_id))
 
 def reached_milestones(map_name, score, pauses, map_passed, misses, acc, milestones):
     milestones = json.loads(milestones)
@@ -386,8 +630,23 @@ def reached_milestones(map_name, score, pauses, map_passed, misses, acc, milesto
     return False
 
 
-def retrieve_relevant_infos(infos, restrict_to_maps, milestones=[], top_only=False):
+def get_map_name(info_map):
+    if "," in info_map["songMapper"]:
+        info_map["songMapper"] = info_map["songMapper"].split(",")[0]
+    return f"{info_map['songName']} {info_map['songArtist']} {info_map['songDifficulty']} by {info_map['songMapper']}"
+
+
+def retrieve_relevant_infos(
+    infos, restrict_to_maps, milestones=[], top_only=False, seen_runs=None, sketches=None, note_store=None
+):
     """
+    map_dict, averages_dict, notes_dict & MAPS_PLAYED are keyed by the ids of MAP_SYMBOLS
+    & PLAYER_SYMBOLS (as are the "id" of player infos & the lists of maps passed/failed).
+    Runs already in seen_runs (or duplicated in infos) are skipped.
+    If sketches is given, the accuracy of every run is added to the sketch of its map.
+    Notes of deepTrackers are moved out of infos into note_store (a NoteStore without
+    memory budget by default) which is returned as notes_dict.
+
     New enum : SongDataType {
                 0: none
                 1: pass
@@ -404,28 +663,39 @@ def retrieve_relevant_infos(infos, restrict_to_maps, milestones=[], top_only=Fal
 
     map_dict = {}  # stores player infos per map
     averages_dict = {}  # stores averages per player
-    notes_dict = {}
+    notes_dict = note_store if note_store is not None else NoteStore()
     reached_at_least_one_milestone = False
 
     if isinstance(infos, dict):
         infos = [infos]
 
+    if seen_runs is None:
+        seen_runs = SeenRuns()
+    nb_duplicates = seen_runs.nb_duplicates
+
     for info_map in infos:
 
         if info_map.get("saberAColor"):
             #retrieve_player_infos(info_map)
             continue
 
-        if "," in info_map["songMapper"]:
-            info_map["songMapper"] = info_map["songMapper"].split(",")[0]
-        map_name = f"{info_map['songName']} {info_map['songArtist']} {info_map['songDifficulty']} by {info_map['songMapper']}"
+        # Any other json that ended up in the logs (a record of a quarantine file for ex) isn't a run
+        if "trackers" not in info_map:
+            continue
+
+        # Same run coming from overlapping logs (_latest.log & its dated copy for ex)
+        if seen_runs.is_seen(info_map):
+            continue
+
+        map_name = get_map_name(info_map)
 
         if restrict_to_maps:
             if not any(substring.lower() in map_name.lower() for substring in restrict_to_maps):
                 continue
 
         # Retrieving all relevant infos into variables
-        name = get_name_by_id(info_map["playerID"])
+        map_id = MAP_SYMBOLS.intern(map_name)
+        player_id = PLAYER_SYMBOLS.intern(get_name_by_id(info_map["playerID"]))
         score = info_map["trackers"]["scoreTracker"]["score"]
         pauses = info_map["trackers"]["winTracker"]["nbOfPause"]
         map_passed = info_map["trackers"]["winTracker"]["won"]
@@ -439,6 +709,10 @@ def retrieve_relevant_infos(infos, restrict_to_maps, milestones=[], top_only=Fal
                 reached_at_least_one_milestone = True
             continue
 
+        seen_runs.mark(info_map)
+        if sketches is not None:
+            sketches.add(map_name, acc)
+
         acc_left = float(info_map["trackers"]["accuracyTracker"]["accLeft"])
         acc_right = float(info_map["trackers"]["accuracyTracker"]["accRight"])
         try:
@@ -457,15 +731,8 @@ def retrieve_relevant_infos(infos, restrict_to_maps, milestones=[], top_only=Fal
             right_av_tuple = (0.0, 0.0, 0.0)
 
         if info_map.get("deepTrackers"):
-            if notes_dict.get(map_name):
-                try:
-                    notes_dict[map_name][name].append(
-                        info_map["deepTrackers"]["noteTracker"]["notes"]
-                    )
-                except KeyError:
-                    notes_dict[map_name][name] = [info_map["deepTrackers"]["noteTracker"]["notes"]]
-            else:
-                notes_dict[map_name] = {name: [info_map["deepTrackers"]["noteTracker"]["notes"]]}
+            # Popped so that notes spilled to disk are not still referenced by infos
+            notes_dict.add(map_id, player_id, info_map.pop("deepTrackers")["noteTracker"]["notes"])
 
         try:
             # If BSD version supports distanceTracker
@@ -492,13 +759,13 @@ def retrieve_relevant_infos(infos, restrict_to_maps, milestones=[], top_only=Fal
             right_speed = 0.0
             nb_with_speed = 0
 
-        if MAPS_PLAYED.get(map_name):
-            if name in MAPS_PLAYED[map_name]["players"]:
-                MAPS_PLAYED[map_name]["count"] += 1
+        if MAPS_PLAYED.get(map_id):
+            if player_id in MAPS_PLAYED[map_id]["players"]:
+                MAPS_PLAYED[map_id]["count"] += 1
             else:
-                MAPS_PLAYED[map_name]["players"].append(name)
+                MAPS_PLAYED[map_id]["players"].add(player_id)
         else:
-            MAPS_PLAYED[map_name] = {"count": 1, "players": [name]}
+            MAPS_PLAYED[map_id] = {"count": 1, "players": {player_id}}
 
         # Preparing values for map_dict and storing them
         acc_format = "{:.2f}".format(acc)
@@ -517,7 +784,7 @@ def retrieve_relevant_infos(infos, restrict_to_maps, milestones=[], top_only=Fal
         left_speed_format = "{:.2f}".format(left_speed) if left_speed else ""
         right_speed_format = "{:.2f}".format(right_speed) if right_speed else ""
         player_infos = {
-            "id": name,
+            "id": player_id,
             "score": score,
             "acc": acc_format,
             "accLeft": acc_left_format,
@@ -536,55 +803,55 @@ def retrieve_relevant_infos(infos, restrict_to_maps, milestones=[], top_only=Fal
             "right_speed": right_speed_format,
         }
         try:
-            map_dict[map_name].append(player_infos)
+            map_dict[map_id].append(player_infos)
         except KeyError:
-            map_dict[map_name] = [player_infos]
+            map_dict[map_id] = [player_infos]
 
         # Preparing value for averages_dict and storing it
         try:
             if map_passed:
-                averages_dict[name]["list_map_passed"].append(map_name)
-                averages_dict[name]["nb_map_passed"] += 1
+                averages_dict[player_id]["list_map_passed"].append(map_id)
+                averages_dict[player_id]["nb_map_passed"] += 1
             else:
-                averages_dict[name]["list_map_failed"].append(map_name)
-                averages_dict[name]["nb_map_failed"] += 1
-            averages_dict[name]["score"] += score
-            averages_dict[name]["acc"] += acc
-            averages_dict[name]["accLeft"] += acc_left
-            averages_dict[name]["accRight"] += acc_right
-            prev_left_av_tuple = averages_dict[name]["leftAv"]
-            prev_right_av_tuple = averages_dict[name]["rightAv"]
-            averages_dict[name]["leftAv"] = tuple(map(sum, zip(prev_left_av_tuple, left_av_tuple)))
-            averages_dict[name]["rightAv"] = tuple(
+                averages_dict[player_id]["list_map_failed"].append(map_id)
+                averages_dict[player_id]["nb_map_failed"] += 1
+            averages_dict[player_id]["score"] += score
+            averages_dict[player_id]["acc"] += acc
+            averages_dict[player_id]["accLeft"] += acc_left
+            averages_dict[player_id]["accRight"] += acc_right
+            prev_left_av_tuple = averages_dict[player_id]["leftAv"]
+            prev_right_av_tuple = averages_dict[player_id]["rightAv"]
+            averages_dict[player_id]["leftAv"] = tuple(map(sum, zip(prev_left_av_tuple, left_av_tuple)))
+            averages_dict[player_id]["rightAv"] = tuple(
                 map(sum, zip(prev_right_av_tuple, right_av_tuple))
             )
-            averages_dict[name]["pause"] += pauses
-            averages_dict[name]["miss"] += misses
-            averages_dict[name]["nb_map_played"] += 1
+            averages_dict[player_id]["pause"] += pauses
+            averages_dict[player_id]["miss"] += misses
+            averages_dict[player_id]["nb_map_played"] += 1
             if distance_lhand:
-                averages_dict[name]["distance_rsaber"] += distance_rsaber
-                averages_dict[name]["distance_lsaber"] += distance_lsaber
-                averages_dict[name]["distance_rhand"] += distance_rhand
-                averages_dict[name]["distance_lhand"] += distance_lhand
-                averages_dict[name]["nb_with_distance"] += 1
+                averages_dict[player_id]["distance_rsaber"] += distance_rsaber
+                averages_dict[player_id]["distance_lsaber"] += distance_lsaber
+                averages_dict[player_id]["distance_rhand"] += distance_rhand
+                averages_dict[player_id]["distance_lhand"] += distance_lhand
+                averages_dict[player_id]["nb_with_distance"] += 1
             if left_speed:
-                averages_dict[name]["left_speed"] += left_speed
-                averages_dict[name]["right_speed"] += right_speed
-                averages_dict[name]["nb_with_speed"] += 1
+                averages_dict[player_id]["left_speed"] += left_speed
+                averages_dict[player_id]["right_speed"] += right_speed
+                averages_dict[player_id]["nb_with_speed"] += 1
 
         except KeyError:
             if map_passed:
-                list_map_passed = [map_name]
+                list_map_passed = [map_id]
                 list_map_failed = []
                 nb_map_passed = 1
                 nb_map_failed = 0
             else:
                 list_map_passed = []
-                list_map_failed = [map_name]
+                list_map_failed = [map_id]
                 nb_map_passed = 0
                 nb_map_failed = 1
             averages_infos = {
-                "id": name,
+                "id": player_id,
                 "score": score,
                 "acc": acc,
                 "accLeft": acc_left,
@@ -607,16 +874,19 @@ def retrieve_relevant_infos(infos, restrict_to_maps, milestones=[], top_only=Fal
                 "right_speed": right_speed,
                 "nb_with_speed": nb_with_speed,
             }
-            averages_dict[name] = averages_infos
+            averages_dict[player_id] = averages_infos
     
+    if seen_runs.nb_duplicates > nb_duplicates:
+        print(f"{seen_runs.nb_duplicates - nb_duplicates} duplicated runs skipped\n")
+
     if not reached_at_least_one_milestone and milestones:
         print("Sorry, didn't reach any milestone :anguished:")
     
     if top_only:
         maps_d = map_dict.copy()
-        for map_name in maps_d.keys():
-            sorted_pinfos = sorted(map_dict[map_name], key=lambda kv: kv["score"], reverse=True)
-            map_dict[map_name] = [sorted_pinfos[0]]
+        for map_id in maps_d.keys():
+            sorted_pinfos = sorted(map_dict[map_id], key=lambda kv: kv["score"], reverse=True)
+            map_dict[map_id] = [sorted_pinfos[0]]
 
 
     return map_dict, averages_dict, notes_dict
@@ -624,16 +894,16 @@ def retrieve_relevant_infos(infos, restrict_to_maps, milestones=[], top_only=Fal
 
 def get_ranking_per_map(maps_dict):
     player_ranking_dict = {}
-    for map_name in maps_dict.keys():
-        sorted_pinfos = sorted(maps_dict[map_name], key=lambda kv: kv["score"], reverse=True)
+    for map_id in maps_dict.keys():
+        sorted_pinfos = sorted(maps_dict[map_id], key=lambda kv: kv["score"], reverse=True)
         for rank, pinfos in enumerate(sorted_pinfos):
             try:
-                if player_ranking_dict[pinfos["id"]].get(map_name):
-                    player_ranking_dict[pinfos["id"]][map_name].append(rank + 1)
+                if player_ranking_dict[pinfos["id"]].get(map_id):
+                    player_ranking_dict[pinfos["id"]][map_id].append(rank + 1)
                 else:
-                    player_ranking_dict[pinfos["id"]][map_name] = [rank + 1]
+                    player_ranking_dict[pinfos["id"]][map_id] = [rank + 1]
             except KeyError:
-                player_ranking_dict[pinfos["id"]] = {map_name: [rank + 1]}
+                player_ranking_dict[pinfos["id"]] = {map_id: [rank + 1]}
     return player_ranking_dict
 
 
@@ -641,7 +911,7 @@ def show_relevant_infos(maps_dict, no_color=False):
 
     infos = maps_dict
 
-    for map_name in infos.keys():
+    for map_id in infos.keys():
         if no_color:
             Style.BRIGHT = ""
             Style.RESET_ALL = ""
@@ -649,12 +919,12 @@ def show_relevant_infos(maps_dict, no_color=False):
             Fore.YELLOW = ""
             Fore.BLUE = ""
             Fore.RED = ""
-        print(f"{Style.BRIGHT}{map_name}{Style.RESET_ALL}")
-        sorted_pinfos = sorted(infos[map_name], key=lambda kv: kv["score"], reverse=True)
+        print(f"{Style.BRIGHT}{MAP_SYMBOLS.name(map_id)}{Style.RESET_ALL}")
+        sorted_pinfos = sorted(infos[map_id], key=lambda kv: kv["score"], reverse=True)
         for rank, pinfos in enumerate(sorted_pinfos):
             # if pinfos['distance_rsaber']:
             print(
-                f"     {rank + 1} -  {pinfos['id']:28} with {pinfos['acc']:5} ({pinfos['score']})   (left: {pinfos['accLeft']:6} [{pinfos['leftAv']:>18}]{Style.DIM}{Fore.BLUE}[{pinfos['distance_lsaber']:>8},{pinfos['distance_lhand']:>8}]{Style.RESET_ALL}{Style.DIM}{Fore.YELLOW}[{pinfos['left_speed']:>5}]{Style.RESET_ALL}, right: {pinfos['accRight']:6} [{pinfos['rightAv']:>18}]{Style.DIM}{Fore.BLUE}[{pinfos['distance_rsaber']:>8},{pinfos['distance_rhand']:>8}]{Style.RESET_ALL}{Style.DIM}{Fore.YELLOW}[{pinfos['right_speed']:>5}]{Style.RESET_ALL}, {pinfos['miss']} miss)"
+                f"     {rank + 1} -  {PLAYER_SYMBOLS.name(pinfos['id']):28} with {pinfos['acc']:5} ({pinfos['score']})   (left: {pinfos['accLeft']:6} [{pinfos['leftAv']:>18}]{Style.DIM}{Fore.BLUE}[{pinfos['distance_lsaber']:>8},{pinfos['distance_lhand']:>8}]{Style.RESET_ALL}{Style.DIM}{Fore.YELLOW}[{pinfos['left_speed']:>5}]{Style.RESET_ALL}, right: {pinfos['accRight']:6} [{pinfos['rightAv']:>18}]{Style.DIM}{Fore.BLUE}[{pinfos['distance_rsaber']:>8},{pinfos['distance_rhand']:>8}]{Style.RESET_ALL}{Style.DIM}{Fore.YELLOW}[{pinfos['right_speed']:>5}]{Style.RESET_ALL}, {pinfos['miss']} miss)"
             )
             # else:
             #    print(f"     {rank + 1} -  {pinfos['id']:20} with {pinfos['acc']:5}   (left: {pinfos['accLeft']:6} [{pinfos['leftAv']:>18}], right: {pinfos['accRight']:6} [{pinfos['rightAv']:>18}], {pinfos['miss']} miss)")
@@ -669,6 +939,22 @@ def show_relevant_infos(maps_dict, no_color=False):
         print()
 
 
+def show_percentiles(maps_dict, sketches):
+
+    for map_id in maps_dict.keys():
+        map_name = MAP_SYMBOLS.name(map_id)
+        digest = sketches.get(map_name)
+        if not digest:
+            continue
+        print(
+            f"{Style.BRIGHT}{map_name}{Style.RESET_ALL} ({int(digest.total)} runs) p50: {digest.quantile(0.5):.2f}  p90: {digest.quantile(0.9):.2f}  p99: {digest.quantile(0.99):.2f}"
+        )
+        sorted_pinfos = sorted(maps_dict[map_id], key=lambda kv: kv["score"], reverse=True)
+        for pinfos in sorted_pinfos:
+            print(f"     {PLAYER_SYMBOLS.name(pinfos['id']):28} {pinfos['acc']:5} -> percentile {digest.percentile_of(float(pinfos['acc'])):.1f}")
+    print()
+
+
 def get_average_ranking(player_ranking_dict, nb_map_played):
     # played_all = True
     rank_sum = 0
@@ -677,7 +963,7 @@ def get_average_ranking(player_ranking_dict, nb_map_played):
     return rank_sum / nb_map_played
 
 
-def show_averages(averages_dict, maps_dict, overall=0, no_color=False):
+def show_averages(averages_dict, maps_dict, overall=0, no_color=False, output_dir="."):
     players_ranking_dict = get_ranking_per_map(maps_dict)
     infos = averages_dict
 
@@ -696,9 +982,10 @@ def show_averages(averages_dict, maps_dict, overall=0, no_color=False):
         f"{Style.BRIGHT}### AVERAGES OF THE WHOLE SESSION (sorted by total score on all maps) ###{Style.RESET_ALL}"
     )
     for rank, averages in enumerate(sorted_pinfos):
-        name, pinfos = averages
+        player_id, pinfos = averages
+        name = PLAYER_SYMBOLS.name(player_id)
 
-        av_rank = get_average_ranking(players_ranking_dict[name], pinfos["nb_map_played"])
+        av_rank = get_average_ranking(players_ranking_dict[player_id], pinfos["nb_map_played"])
         # played_all = True if pinfos["nb_map_played"] == nb_map_session else False
         played_all = pinfos["nb_map_played"] == nb_map_session
 
@@ -713,8 +1000,8 @@ def show_averages(averages_dict, maps_dict, overall=0, no_color=False):
         av_acc_right = pinfos["accRight"] / pinfos["nb_map_played"]
         av_misses = pinfos["miss"] / pinfos["nb_map_played"]
         av_pauses = pinfos["pause"]  # / pinfos["nb_map_played"]
-        map_passed = ", ".join(pinfos["list_map_passed"])
-        map_failed = ", ".join(pinfos["list_map_failed"])
+        map_passed = ", ".join(MAP_SYMBOLS.name(map_id) for map_id in pinfos["list_map_passed"])
+        map_failed = ", ".join(MAP_SYMBOLS.name(map_id) for map_id in pinfos["list_map_failed"])
         nb_map_failed = pinfos["nb_map_failed"]
         nb_map_passed = pinfos["nb_map_passed"]
         if pinfos["nb_with_distance"]:
@@ -795,41 +1082,42 @@ def show_averages(averages_dict, maps_dict, overall=0, no_color=False):
         #    line_in_csv.append((rank+1, rank_format, name, acc_format, acc_left_format, left_av_format, acc_right_format, right_av_format, av_misses, pinfos['nb_map_played'], nb_map_failed, nb_map_session))
         rank += 1
     print()
-    averages_as_csv(line_in_csv)
+    averages_as_csv(line_in_csv, output_dir)
+    return line_in_csv
 
 
-def relevant_infos_as_csv(maps_dict):
+def relevant_infos_as_csv(maps_dict, output_dir="."):
 
     infos = maps_dict
 
     # with open(f"infos-{strftime('%Y%m%d')}.csv",'w') as csvf:
-    with open(f"infos-{DATETIME}.csv", "w") as csvf:
+    with open(path.join(output_dir, f"infos-{DATETIME}.csv"), "w") as csvf:
         csvf.write("Maps played\n")
-        for map_name in infos.keys():
-            csvf.write(f"{map_name}\n")
+        for map_id in infos.keys():
+            csvf.write(f"{MAP_SYMBOLS.name(map_id)}\n")
         csvf.write("\nDetails per map")
-        for map_name in infos.keys():
-            csvf.write(f"\n{map_name}\n")
+        for map_id in infos.keys():
+            csvf.write(f"\n{MAP_SYMBOLS.name(map_id)}\n")
             # if infos[map_name][0]['distance_rhand']:
             csvf.write(CSVF_HEADER_DISTANCE)
             # else:
             #    csvf.write(CSVF_HEADER)
-            sorted_pinfos = sorted(infos[map_name], key=lambda kv: kv["score"], reverse=True)
+            sorted_pinfos = sorted(infos[map_id], key=lambda kv: kv["score"], reverse=True)
             for rank, pinfos in enumerate(sorted_pinfos):
                 failed = (
                     f"Failed at {pinfos['failed_time']:.2f}" if not pinfos["map_passed"] else ""
                 )
                 # if pinfos['distance_rhand']:
                 csvf.write(
-                    f"{rank + 1},{pinfos['id']},{pinfos['acc']},{pinfos['accLeft']},{pinfos['leftAv']},{pinfos['distance_lsaber']},{pinfos['distance_lhand']},{pinfos['accRight']},{pinfos['rightAv']},{pinfos['distance_rsaber']},{pinfos['distance_rhand']},{pinfos['miss']},{failed}\n"
+                    f"{rank + 1},{PLAYER_SYMBOLS.name(pinfos['id'])},{pinfos['acc']},{pinfos['accLeft']},{pinfos['leftAv']},{pinfos['distance_lsaber']},{pinfos['distance_lhand']},{pinfos['accRight']},{pinfos['rightAv']},{pinfos['distance_rsaber']},{pinfos['distance_rhand']},{pinfos['miss']},{failed}\n"
                 )
                 # else:
                 #    csvf.write(f"{rank + 1},{pinfos['id']},{pinfos['acc']},{pinfos['accLeft']},{pinfos['leftAv']},{pinfos['accRight']},{pinfos['rightAv']},{pinfos['miss']},{failed}\n")
 
 
-def averages_as_csv(lines):
+def averages_as_csv(lines, output_dir="."):
     # with open(f"av_infos-{strftime('%Y%m%d')}.csv",'w') as csvf:
-    with open(f"av_infos-{DATETIME}.csv", "w") as csvf:
+    with open(path.join(output_dir, f"av_infos-{DATETIME}.csv"), "w") as csvf:
         # csvf.write(f"{{strftime('%Y%m%d')}\n")
         if DATETIME == "overall":
             csvf.write(f"{DATETIME}\n")
@@ -871,12 +1159,89 @@ def averages_as_csv(lines):
             #    csvf.write(f"{rank},{rank_format},{name},{acc_format},{acc_left_format},{left_av_format},{acc_right_format},{right_av_format},{av_misses:.2f},{nb_map_played},{nb_map_failed}\n")
 
 
+def leaderboard_pieces(maps_dict):
+    """ Leaderboard of each map as a piece of the published snapshot """
+
+    pieces = {}
+    for map_id, runs in maps_dict.items():
+        map_name = MAP_SYMBOLS.name(map_id)
+        sorted_pinfos = sorted(runs, key=lambda kv: kv["score"], reverse=True)
+        pieces[f"leaderboards/{map_name}"] = {
+            "title": map_name,
+            "columns": ["Rank", "Player", "Score", "Acc", "Left Acc", "Left Average", "Right Acc", "Right Average", "Miss", "Pauses", "Failed at"],
+            "rows": [
+                [
+                    rank + 1,
+                    PLAYER_SYMBOLS.name(pinfos["id"]),
+                    pinfos["score"],
+                    pinfos["acc"],
+                    pinfos["accLeft"],
+                    pinfos["leftAv"],
+                    pinfos["accRight"],
+                    pinfos["rightAv"],
+                    pinfos["miss"],
+                    pinfos["pause"],
+                    None if pinfos["map_passed"] else round(pinfos["failed_time"], 2),
+                ]
+                for rank, pinfos in enumerate(sorted_pinfos)
+            ],
+        }
+    return pieces
+
+
+def averages_piece(lines):
+    """ Session averages (lines of show_averages) as a piece of the published snapshot """
+
+    return {
+        "title": f"Averages ({DATETIME})",
+        "columns": ["Rank", "AvRank", "Player", "Acc", "Left Acc", "Left Average", "Right Acc", "Right Average", "Miss", "Nb Map Played", "Nb Map Failed"],
+        "rows": [
+            [rank, av_rank, name, acc, acc_left, left_av, acc_right, right_av, round(misses, 2), nb_played, nb_failed]
+            for (_, _, _, _, rank, av_rank, name, acc, acc_left, left_av, acc_right, right_av, misses, nb_played, nb_failed, _) in lines
+        ],
+    }
+
+
+def trend_pieces(xy_per_type):
+    """ Average acc per player & date of each type of maps as pieces of the published snapshot """
+
+    return {
+        f"trends/{type_maps}": {
+            "title": type_maps,
+            "x": dates,
+            "series": {
+                player: [round(average, 2) if average else None for average in averages]
+                for player, averages in players_averages.items()
+            },
+        }
+        for type_maps, (dates, players_averages) in xy_per_type.items()
+    }
+
+
+def publish_pieces(args, pieces):
+    from frontend.publish import publish  # pylint: disable=import-outside-toplevel
+
+    with PROFILER.stage("publish") as stage:
+        written, unchanged = publish(args.publish, pieces, args.publishhtml)
+        stage["records"] = written
+    print(f"Snapshot published in {args.publish} : {written} pieces written, {unchanged} unchanged\n")
+
+
 def get_files_in_dir(directory_in_str):
 
     list_files = []
     directory = fsencode(directory_in_str)
     for logfile in listdir(directory):
-        list_files.append(f"{directory_in_str}/{fsdecode(logfile)}")
+        logfile = fsdecode(logfile)
+        # Leftovers of a previous run (cleaned copies of compressed logs) must not be parsed twice
+        # & indexes of compacted segments or of sessions (or csv reports) are not logs
+        if logfile.endswith(("_cleaned", SEGMENT_INDEX_EXT, SESSION_INDEX_EXT, ".tmp", ".csv")):
+            continue
+        # Nor is the quarantine file (--quarantine), which can be in the parsed directory
+        logfile = f"{directory_in_str}/{logfile}"
+        if QUARANTINE.quarantine_file and path.abspath(logfile) == path.abspath(QUARANTINE.quarantine_file):
+            continue
+        list_files.append(logfile)
 
     return list_files
 
@@ -884,22 +1249,25 @@ def get_files_in_dir(directory_in_str):
 def merge_files(cleaned_list, name_template="cleaned-{}.log", cleaned=False):
     # merged_file = f"cleaned-{strftime('%Y%m%d')}.log"
     merged_file = name_template.format(DATETIME)
-    with open(merged_file, "w") as outfile:
+    with open(merged_file, "wb") as outfile:
         if cleaned:
-            outfile.write("[")
+            outfile.write(b"[")
         for fname in cleaned_list:
-            with open(fname) as infile:
-                outfile.write(infile.read())
+            # The merged file can be in the parsed directory : copying it chunk by chunk into
+            # itself would never end
+            if path.abspath(fname) == path.abspath(merged_file):
+                continue
+            # Compressed files are decompressed on the fly, chunk by chunk
+            with open_logfile(fname, "rb") as infile:
+                copyfileobj(infile, outfile)
                 if cleaned:
-                    outfile.write(",")
+                    outfile.write(b",")
 
     if cleaned:
-        all_file = ""
-        with open(merged_file, "r") as mfile:
-            all_file = mfile.read()
-        all_file = all_file[:-1] + "]"
-        with open(merged_file, "w") as mfile:
-            mfile.write(all_file)
+        # Replaces the trailing comma in place instead of reloading the whole file
+        with open(merged_file, "rb+") as mfile:
+            mfile.seek(-1, SEEK_END)
+            mfile.write(b"]")
 
     return merged_file
 
@@ -964,7 +1332,8 @@ def classify_reference_maps_per_type(maps_by_name):
 
 def classify_played_maps_per_type_and_date(maps_dict, date, played_type_maps):
 
-    for map_name, infos in maps_dict.items():
+    for map_id, infos in maps_dict.items():
+        map_name = MAP_SYMBOLS.name(map_id)
         try:
             map_misc_infos = MAPS_MISC_INFOS[map_name.lower()]
         except KeyError:
@@ -1022,21 +1391,40 @@ def get_x_y_from_maps_per_type_and_date(maps_per_type_and_date):
 
         av_for_players_y_axis = {}
 
-        for name_p, stats in players_averages.items():
+        for player_id, stats in players_averages.items():
             averages_y_for_player = []
             for date in dates_x_axis:
                 try:
                     averages_y_for_player.append(stats[date]["av_acc"])
                 except KeyError:
                     averages_y_for_player.append(None)
-            av_for_players_y_axis[name_p] = averages_y_for_player
+            av_for_players_y_axis[PLAYER_SYMBOLS.name(player_id)] = averages_y_for_player
         xy_per_type[type_maps] = (dates_x_axis, av_for_players_y_axis)
 
     return xy_per_type
 
 
+def maximize_window():
+    from matplotlib.pyplot import get_current_fig_manager  # pylint: disable=import-outside-toplevel
+
+    mng = get_current_fig_manager()
+    try:
+        mng.resize(*mng.window.maxsize())
+    except AttributeError:
+        # Not a Tk window (other backend or no display at all)
+        pass
+
+
 def plot_graph(xy_per_type):
 
+    if RENDERER:
+        for type_maps, (x_axis, all_y) in xy_per_type.items():
+            RENDERER.submit("graph", f"trend-{type_maps}", (type_maps, x_axis, all_y), {"type": type_maps})
+        return
+
+    # pylint: disable=import-outside-toplevel
+    from matplotlib.pyplot import get_cmap, style, plot, legend, title, xlabel, ylabel, grid, show
+
     # styles available : ['Solarize_Light2', '_classic_test_patch', 'bmh', 'classic', 'dark_background', 'fast', 'fivethirtyeight', 'ggplot', 'grayscale', 'seaborn', 'seaborn-bright', 'seaborn-colorblind', 'seaborn-dark', 'seaborn-dark-palette', 'seaborn-darkgrid', 'seaborn-deep', 'seaborn-muted', 'seaborn-notebook', 'seaborn-paper', 'seaborn-pastel', 'seaborn-poster', 'seaborn-talk', 'seaborn-ticks', 'seaborn-white', 'seaborn-whitegrid', 'tableau-colorblind10']
     style.use("dark_background")
     palette = get_cmap("Set1")
@@ -1063,8 +1451,7 @@ def plot_graph(xy_per_type):
         xlabel("Date")
         ylabel("Score")
         grid()
-        mng = get_current_fig_manager()
-        mng.resize(*mng.window.maxsize())
+        maximize_window()
         # mng.window.state('zoomed')
         # mng.frame.Maximize(True)
         show()
@@ -1096,6 +1483,8 @@ def graphs_averages_per_type_and_date_as_csv(maps_per_type_and_date, plot_and_sh
     if plot_and_show:
         plot_graph(xy_per_type)
 
+    return xy_per_type
+
 
 def classify_files_of_directory_by_date(directory):
     list_files = get_files_in_dir(directory)
@@ -1104,7 +1493,8 @@ def classify_files_of_directory_by_date(directory):
     files_by_date = {}
     for logfile in list_files:
         print(logfile)
-        date = logfile.split("_")[1][:-4]
+        # Logs not named like x_YYYYMMDD.ext (_latest.log...) are dated by their last write
+        date = date_of_logfile(logfile) or strftime("%Y%m%d", localtime(path.getmtime(logfile)))
         date = f"{date[:4]}-{date[4:6]}-{date[6:]}"
         print(date)
         try:
@@ -1114,13 +1504,445 @@ def classify_files_of_directory_by_date(directory):
     return files_by_date
 
 
+def aggregates_with_names(aggregates):
+    return rekey_aggregates(aggregates, MAP_SYMBOLS.name, PLAYER_SYMBOLS.name)
+
+
+def aggregates_with_ids(aggregates):
+    return rekey_aggregates(aggregates, MAP_SYMBOLS.intern, PLAYER_SYMBOLS.intern)
+
+
+def fold_new_files(new_files, aggregates, seen_runs, restrict_to_maps):
+    """ Parses only new_files & folds their runs into aggregates, returns the new aggregates & the
+        maps played in new_files
+    """
+
+    nb_quarantined = QUARANTINE.nb_records
+    touched_maps = set()
+    for logfile in new_files:
+        cleaned_logfile = clean_logfile(logfile)
+        infos = parse_logfile(cleaned_logfile)
+        MAPS_PLAYED.clear()
+        map_dict, averages_dict, _ = retrieve_relevant_infos(infos, restrict_to_maps, seen_runs=seen_runs)
+        touched_maps.update(map_dict)
+        aggregates = merge_aggregates(aggregates, partial_aggregates(map_dict, averages_dict, dict(MAPS_PLAYED)))
+
+    if QUARANTINE.nb_records > nb_quarantined:
+        where = f" (quarantined in {QUARANTINE.quarantine_file})" if QUARANTINE.quarantine_file else ""
+        print(f"{QUARANTINE.nb_records - nb_quarantined} malformed records skipped{where}")
+
+    # show_averages relies on MAPS_PLAYED to know how many maps were played
+    MAPS_PLAYED.clear()
+    MAPS_PLAYED.update(aggregates["maps_played"])
+    return aggregates, touched_maps
+
+
+def run_daemon(args):
+    """ Watches args.directory & updates standings each time new log files land """
+
+    global DATETIME  # pylint: disable=global-statement
+
+    makedirs(args.statedir, exist_ok=True)
+    aggregates_file = path.join(args.statedir, "aggregates.json")
+    watcher = DirectoryWatcher(
+        args.directory, path.join(args.statedir, "manifest.json"), args.pollinterval, [QUARANTINE.quarantine_file]
+    )
+    seen_runs = SeenRuns(args.seenruns or path.join(args.statedir, "seen_runs.bin"))
+    aggregates = aggregates_with_ids(load_aggregates(aggregates_file))
+
+    # Files that landed while the daemon was not running
+    new_files = watcher.new_files()
+    while True:
+        if new_files:
+            DATETIME = "overall" if args.overall > 0 else strftime("%Y%m%d")
+            print(f"{strftime('%H:%M:%S')} - processing {len(new_files)} new file(s)")
+            aggregates, touched_maps = fold_new_files(new_files, aggregates, seen_runs, args.restrictmap)
+            seen_runs.save()
+            save_aggregates(aggregates_file, aggregates_with_names(aggregates))
+            watcher.mark_processed(new_files)
+            if aggregates["maps"]:
+                show_relevant_infos(aggregates["maps"], args.nocolor)
+                relevant_infos_as_csv(aggregates["maps"])
+                lines = show_averages(aggregates["averages"], aggregates["maps"], args.overall, args.nocolor)
+                if args.publish:
+                    # Standings & csv cover the whole season but only the leaderboards of maps played in this
+                    # batch are published again (the manifest keeps the others)
+                    touched = {map_id: runs for map_id, runs in aggregates["maps"].items() if map_id in touched_maps}
+                    publish_pieces(args, {**leaderboard_pieces(touched), "averages": averages_piece(lines)})
+        new_files = watcher.wait_new_files()
+
+
+def run_compact(args):
+    """ Rolls the BSDlogs/<playerID>/<timestamp> files of restful.py into monthly segments """
+
+    with PROFILER.stage("compact") as stage:
+        stats = compact_tree(args.directory, args.minage, args.deepdays, args.keepdays)
+        stage.update(stats)
+    print(
+        f"{stats['compacted_runs']} runs compacted into {stats['segments']} segments, "
+        f"{stats['stripped_runs']} deepTrackers & {stats['dropped_runs']} runs dropped by retention"
+    )
+    if stats["malformed_runs"]:
+        print(f"{stats['malformed_runs']} malformed run files left in place")
+    if stats["failed_segments"]:
+        print(f"{stats['failed_segments']} segments couldn't be verified, their run files are left in place")
+        sexit(1)
+
+
+def run_combine(args):
+    """ Reports on already computed partial aggregates, without touching the raw logs """
+
+    if path.isdir(args.combine):
+        partial_files = [partial_file for partial_file in get_files_in_dir(args.combine) if partial_file.endswith(".json")]
+    else:
+        partial_files = glob(args.combine)
+    if not partial_files:
+        print(f"No partial aggregates found in {args.combine}")
+        sexit(1)
+
+    with PROFILER.stage("combine") as stage:
+        aggregates = aggregates_with_ids(combine_partial_files(partial_files, args.workers))
+        stage["records"] = len(partial_files)
+
+    MAPS_PLAYED.clear()
+    MAPS_PLAYED.update(aggregates["maps_played"])
+    show_relevant_infos(aggregates["maps"], args.nocolor)
+    relevant_infos_as_csv(aggregates["maps"])
+    show_averages(aggregates["averages"], aggregates["maps"], args.overall, args.nocolor)
+
+
+def run_report_plan(plan_file, infos, args):
+    """ Runs every report of plan_file (a json list) over the same decoded records :
+        [
+            {"name": "season", "output": "reports/season"},
+            {"name": "best runs", "top": true},
+            {"name": "pool 1", "restrictmap": "map1::map2", "output": "reports/pool1"},
+            {"name": "clean passes", "query": "passed=1, paused=0, acc>=90"},
+            {"name": "milestones", "milestones": [{"name_campaign": ..., "milestones": {...}}]}
+        ]
+        Reports take the options of a single invocation (restrictmap, top, milestones,
+        overall, query) & write their csv in "output" (default : their name).
+    """
+
+    with open(plan_file) as planf:
+        plan = json.load(planf)
+
+    records = []
+    for info_map in infos:
+        # No report of a plan uses the notes, they are dropped as soon as decoded
+        info_map.pop("deepTrackers", None)
+        records.append(info_map)
+    run_index = None  # only built if a report has a query
+
+    for report in plan:
+        output_dir = report.get("output", slugify(report["name"]))
+        milestones = report.get("milestones")
+        if milestones and not isinstance(milestones, str):
+            milestones = json.dumps(milestones)
+        top = report.get("top", False)
+
+        with PROFILER.stage(f"report {report['name']}") as stage:
+            print(f"### {report['name']} ###\n")
+            report_records = records
+            if report.get("query"):
+                if run_index is None:
+                    run_index, indexed_records = RunIndex(), []
+                    index_runs(records, default_date(), run_index, indexed_records)
+                report_records = [indexed_records[run] for run in run_index.query(report["query"])]
+            MAPS_PLAYED.clear()
+            map_dict, averages_dict, _ = retrieve_relevant_infos(report_records, report.get("restrictmap"), milestones, top)
+            stage["records"] = sum(len(runs) for runs in map_dict.values())
+            if not milestones:
+                write_report(map_dict, averages_dict, top, report.get("overall", args.overall), args.nocolor, output_dir)
+
+
+def write_report(map_dict, averages_dict, top, overall, no_color, output_dir):
+    if not map_dict:
+        print("No maps found\n")
+        return
+    makedirs(output_dir, exist_ok=True)
+    show_relevant_infos(map_dict, no_color)
+    relevant_infos_as_csv(map_dict, output_dir)
+    if not top:
+        show_averages(averages_dict, map_dict, overall, no_color, output_dir)
+
+
+def default_date():
+    return DATETIME if DATETIME.isdigit() else strftime("%Y%m%d")
+
+
+def date_of_logfile(logfile):
+    """ YYYYMMDD of a log named like x_YYYYMMDD.ext, None if its name doesn't have one """
+
+    name = path.splitext(strip_compression_ext(path.basename(logfile)))[0]
+    date = name.rsplit("_", 1)[-1]
+    if len(date) == 8 and date.isdigit():
+        return date
+    return None
+
+
+def index_runs(infos, date, run_index, records):
+    """ Adds the runs of infos (played on date) to run_index & records (the run number
+        of a record in run_index is its position in records)
+    """
+
+    for info_map in infos:
+        if not isinstance(info_map, dict) or info_map.get("saberAColor") or "trackers" not in info_map:
+            continue
+        info_map.pop("deepTrackers", None)
+        records.append(info_map)
+        run_index.add(
+            {
+                "player": get_name_by_id(info_map["playerID"]),
+                "map": get_map_name(info_map),
+                "difficulty": info_map["songDifficulty"],
+                "passed": info_map["trackers"]["winTracker"]["won"],
+                "paused": info_map["trackers"]["winTracker"]["nbOfPause"] > 0,
+                "date": int(date),
+                "acc": float(info_map["trackers"]["scoreTracker"]["modifiedRatio"]) * 100,
+                "score": info_map["trackers"]["scoreTracker"]["score"],
+                "misses": info_map["trackers"]["hitTracker"]["miss"],
+            }
+        )
+
+
+def read_queries():
+    while True:
+        try:
+            query = input("query> ")
+        except EOFError:
+            print()
+            return
+        if query.strip():
+            yield query
+
+
+def query_date_range(queries):
+    """ (since, until) prefixes of run timestamps (2020-12-24) covering the dates every query can
+        select, None for a bound that isn't restricted (queries read from stdin aren't known yet)
+    """
+
+    if "-" in queries:
+        return None, None
+    bounds = []
+    for query in queries:
+        try:
+            bounds.append(date_bounds(parse_query(query)))
+        except ValueError:
+            # Selects nothing, the error is shown when the query is answered
+            continue
+    if not bounds:
+        return None, None
+
+    def as_prefix(date):
+        return f"{date[:4]}-{date[4:6]}-{date[6:]}" if date and len(date) == 8 and date.isdigit() else None
+
+    firsts = [as_prefix(first) for first, _ in bounds]
+    lasts = [as_prefix(last) for _, last in bounds]
+    return (
+        None if None in firsts else min(firsts),
+        None if None in lasts else max(lasts),
+    )
+
+
+def run_queries(args):
+    """ Indexes every run once then answers each --query with the runs it selects
+        (a query of '-' reads queries from stdin until EOF)
+    """
+
+    run_index = RunIndex()
+    records = []
+    with PROFILER.stage("index") as stage:
+        logfiles = get_files_in_dir(args.directory) if args.directory else [args.logfile]
+        if any(logfile.endswith(SEGMENT_EXT) for logfile in logfiles):
+            # Compacted player directory : runs are dated by their timestamp & only the blocks of the
+            # dates the queries can select are read, through the index of the segments
+            since, until = query_date_range(args.query)
+            for record in player_runs(args.directory, since, until):
+                index_runs([record], record["_timestamp"][:10].replace("-", ""), run_index, records)
+            logfiles = [logfile for logfile in logfiles if not logfile.endswith(SEGMENT_EXT)]
+        for logfile in logfiles:
+            # Runs are dated by their file, logs with no date in their name by --date
+            date = date_of_logfile(logfile) or default_date()
+            cleaned_logfile = logfile if args.cleaned else clean_logfile(logfile)
+            index_runs(parse_logfile(cleaned_logfile), date, run_index, records)
+        stage["records"] = run_index.nb_runs
+    print(f"{run_index.nb_runs} runs indexed\n")
+
+    queries = [query for query in args.query if query != "-"]
+    if "-" in args.query:
+        queries = chain(queries, read_queries())
+    for position, query in enumerate(queries, 1):
+        with PROFILER.stage(f"query {query}") as stage:
+            start = perf_counter()
+            try:
+                selected = run_index.query(query)
+            except ValueError as err:
+                print(f"{err}\n")
+                continue
+            print(
+                f"### {query} : {len(selected)}/{run_index.nb_runs} runs (selected in {(perf_counter() - start) * 1000:.1f} ms) ###\n"
+            )
+            MAPS_PLAYED.clear()
+            map_dict, averages_dict, _ = retrieve_relevant_infos(
+                [records[run] for run in selected], args.restrictmap, None, args.top
+            )
+            stage["records"] = len(selected)
+            # Several queries don't overwrite each other's csv (acc>=92 & acc<92 have the same slug)
+            output_dir = f"{position:02d}_{slugify(query)}" if len(args.query) > 1 or "-" in args.query else "."
+            write_report(map_dict, averages_dict, args.top, args.overall, args.nocolor, output_dir)
+
+
 def main():
 
     args = handle_args()
 
-    global DATETIME  # pylint: disable=global-statement
+    global LINE_FILTER  # pylint: disable=global-statement
+    if args.linefilters:
+        LINE_FILTER = LineFilter(load_rules(args.linefilters))
+
+    global QUARANTINE  # pylint: disable=global-statement
+    QUARANTINE = Quarantine(args.quarantine)
+
+    global PROFILER  # pylint: disable=global-statement
+
+    if args.compact:
+        if not args.directory:
+            print("Compaction needs the directory of the runs received by restful.py (--directory BSDlogs)")
+            sexit(1)
+        run_compact(args)
+        return
+
+    if args.daemon:
+        if not args.directory:
+            print("Daemon mode needs a directory to watch (--directory)")
+            sexit(1)
+        try:
+            run_daemon(args)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.profile:
+        PROFILER = StageProfiler(args.profile, args.profiledump)
+        PROFILER.start()
+
+    global RENDERER  # pylint: disable=global-statement
+    if args.renderdir:
+        RENDERER = BatchRenderer(args.renderdir, args.renderformat, args.workers)
+
+    DOWNSAMPLING["max_points"] = args.maxpoints
+    DOWNSAMPLING["method"] = args.downsampling
+
+    run(args)
+
+    if RENDERER:
+        with PROFILER.stage("render") as stage:
+            RENDERER.close()
+            stage["records"] = len(RENDERER.index)
+
+    if PROFILER.enabled:
+        PROFILER.stop()
+        PROFILER.write_report({"name_lookups": NAME_LOOKUPS, "line_filters": LINE_FILTER.hits})
+
+
+def decode_logs(args):
+    """ Merges, cleans & decodes the logs one stage after the other """
 
     logfile = args.logfile
+    if args.directory:
+        with PROFILER.stage("merge") as stage:
+            list_files = get_files_in_dir(args.directory)
+            logfile = merge_files(list_files, cleaned=args.cleaned)
+            stage["records"] = len(list_files)
+
+    else:
+        if not access(args.logfile, R_OK):
+            print("Please provide a correct file path")
+            sexit(1)
+
+    if args.cleaned:
+        cleaned_logfile = logfile
+    else:
+        with PROFILER.stage("clean") as stage:
+            cleaned_logfile = clean_logfile(logfile)
+            stage["dropped_lines"] = sum(LINE_FILTER.hits.values())
+        if args.linefilters:
+            show_line_filter_hits()
+    with PROFILER.stage("decode") as stage:
+        if args.memorybudget:
+            # Records are decoded while being aggregated, never all at once
+            infos = iter_logfile(cleaned_logfile)
+        else:
+            infos = parse_logfile(cleaned_logfile)
+            stage["records"] = len(infos)
+    return infos
+
+
+def pipeline_logs(args):
+    """ Records of the logs, read by a reader thread & cleaned/decoded by a decoder thread
+        while they are aggregated (by the thread iterating them)
+    """
+
+    if args.directory:
+        logfiles = get_files_in_dir(args.directory)
+    elif access(args.logfile, R_OK):
+        logfiles = [args.logfile]
+    else:
+        print("Please provide a correct file path")
+        sexit(1)
+    return Pipeline(
+        read_logfiles(logfiles), [("decode", lambda chunks: decode_chunks(chunks, args.cleaned))], args.queuedepth
+    )
+
+
+def session_logs(args):
+    """ Records of one session (--session) of the log, read straight from its offset """
+
+    if args.directory or not access(args.logfile, R_OK):
+        print("Sessions are read from one log, please provide a correct file path (--logfile)")
+        sexit(1)
+    with PROFILER.stage("sessions") as stage:
+        sessions = session_index(args.logfile, open_logfile, args.sessiongap)["sessions"]
+        try:
+            session = select_session(sessions, args.session)
+        except ValueError as err:
+            print(err)
+            sexit(1)
+        stage["records"] = len(sessions)
+    print(f"Session {sessions.index(session) + 1}/{len(sessions)} : {describe_session(session)}\n")
+
+    with PROFILER.stage("decode") as stage:
+        # decode_chunks expects the empty chunk ending each logfile
+        chunks = ((args.logfile, chunk) for chunk in chain(read_session(args.logfile, session, open_logfile), [b""]))
+        infos = list(decode_chunks(chunks, args.cleaned))
+        stage["records"] = len(infos)
+    return infos
+
+
+def describe_session(session):
+    when = f"{session['first']} - {session['last']} (day {session['day']})" if "first" in session else "no time"
+    players = ", ".join(get_name_by_id(player) for player in session["players"])
+    return f"{when}, {session['runs']} runs, players : {players}"
+
+
+def list_sessions(args):
+    if not access(args.logfile, R_OK):
+        print("Please provide a correct file path")
+        sexit(1)
+    sessions = session_index(args.logfile, open_logfile, args.sessiongap)["sessions"]
+    for number, session in enumerate(sessions, 1):
+        print(f"Session {number} : {describe_session(session)}")
+    print(f"\n{len(sessions)} sessions in {args.logfile} (index : {args.logfile}{SESSION_INDEX_EXT})")
+
+
+def show_line_filter_hits():
+    print("Lines dropped by filters : " + ", ".join(f"{rule} {hits}" for rule, hits in LINE_FILTER.hits.items()) + "\n")
+
+
+def run(args):
+
+    global DATETIME  # pylint: disable=global-statement
 
     if args.overall > 0:
         DATETIME = "overall"
@@ -1134,58 +1956,168 @@ def main():
 
     # print(DATETIME)
 
-    if args.directory:
-        list_files = get_files_in_dir(args.directory)
-        logfile = merge_files(list_files, cleaned=args.cleaned)
+    if args.combine:
+        run_combine(args)
+        return
 
-    else:
-        if not access(args.logfile, R_OK):
-            print("Please provide a correct file path")
+    if args.query:
+        run_queries(args)
+        return
+
+    if args.listsessions:
+        list_sessions(args)
+        return
+
+    if args.sections:
+        # A bad window spec is reported before anything is parsed or written
+        from analysis.sections import parse_window_specs  # pylint: disable=import-outside-toplevel
+
+        try:
+            window_specs = parse_window_specs(args.sections)
+        except ValueError as err:
+            print(err)
             sexit(1)
 
-    if args.cleaned:
-        cleaned_logfile = logfile
+    if args.session:
+        # Only the bytes of the session are read (the index of sessions is built once)
+        infos = session_logs(args)
+    elif args.pipeline:
+        # I/O of the next files overlaps the decoding & aggregation of the previous ones
+        infos = pipeline_logs(args)
     else:
-        cleaned_logfile = clean_logfile(logfile)
-    infos = parse_logfile(cleaned_logfile)
+        infos = decode_logs(args)
+
+    if args.reportplan:
+        # Every report of the plan aggregates the records decoded once
+        run_report_plan(args.reportplan, infos, args)
+        return
 
-    map_dict, averages_dict, notes_dict = retrieve_relevant_infos(infos, args.restrictmap, args.milestones, args.top)
+    with PROFILER.stage("aggregate") as stage:
+        seen_runs = SeenRuns(args.seenruns)
+        sketches = MapSketches(args.sketches) if args.sketches else None
+        note_store = NoteStore(args.memorybudget, args.scratchdir)
+        map_dict, averages_dict, notes_dict = retrieve_relevant_infos(
+            infos, args.restrictmap, args.milestones, args.top, seen_runs, sketches, note_store
+        )
+        seen_runs.save()
+        if sketches:
+            sketches.save()
+        stage["records"] = sum(len(runs) for runs in map_dict.values())
+        stage["duplicates"] = seen_runs.nb_duplicates
+        stage["spilled_runs"] = note_store.nb_spilled
+        stage["quarantined"] = QUARANTINE.nb_records
+        if args.pipeline:
+            stage["pipeline"] = infos.stats
+    if args.pipeline and args.linefilters:
+        show_line_filter_hits()
+    if QUARANTINE.nb_records:
+        print(f"{QUARANTINE.summary()}\n")
+    if args.savepartial and not args.milestones:
+        makedirs(args.savepartial, exist_ok=True)
+        save_aggregates(
+            path.join(args.savepartial, f"partial-{DATETIME}.json"),
+            aggregates_with_names(partial_aggregates(map_dict, averages_dict, MAPS_PLAYED)),
+        )
     if not map_dict and not args.milestones:
         print("No maps found")
+        note_store.close()
         return
-    show_relevant_infos(map_dict, args.nocolor)
-    relevant_infos_as_csv(map_dict)
+    pieces = {}  # published with --publish
+    if args.publish:
+        pieces.update(leaderboard_pieces(map_dict))
+    with PROFILER.stage("show") as stage:
+        show_relevant_infos(map_dict, args.nocolor)
+        if sketches:
+            show_percentiles(map_dict, sketches)
+        stage["records"] = len(map_dict)
+    with PROFILER.stage("csv") as stage:
+        relevant_infos_as_csv(map_dict)
+        stage["records"] = len(map_dict)
 
     # print(json.dumps(map_dict, indent=2))
     # print(json.dumps(averages_dict, indent=2))
     # show_relevant_infos(averages_dict)
     if not args.milestones and not args.top:
-        show_averages(averages_dict, map_dict, args.overall, args.nocolor)
+        with PROFILER.stage("averages") as stage:
+            lines = show_averages(averages_dict, map_dict, args.overall, args.nocolor)
+            if args.publish:
+                pieces["averages"] = averages_piece(lines)
+            stage["records"] = len(averages_dict)
 
     if args.deeptrackers:
-        handle_notes_values(notes_dict, args.deeptrackerstoshow, args.mapanalysis, args.averagedMA)
+        with PROFILER.stage("plots") as stage:
+            handle_notes_values(notes_dict, args.deeptrackerstoshow, args.mapanalysis, args.averagedMA)
+            stage["records"] = len(notes_dict)
+
+    if args.heatmaps:
+        with PROFILER.stage("heatmaps") as stage:
+            from analysis.heatmaps import write_heatmaps  # pylint: disable=import-outside-toplevel
+
+            csv_file, json_file = write_heatmaps(notes_dict, f"heatmaps-{DATETIME}", PLAYER_SYMBOLS.name)
+            print(f"Heatmaps written to {csv_file} & {json_file}")
+            stage["records"] = len(notes_dict)
+
+    if args.swing:
+        with PROFILER.stage("swing") as stage:
+            from analysis.swing import write_swing_stats  # pylint: disable=import-outside-toplevel
+
+            csv_file = write_swing_stats(notes_dict, f"swing-{DATETIME}.csv", MAP_SYMBOLS.name, PLAYER_SYMBOLS.name)
+            print(f"Swing statistics written to {csv_file}")
+            stage["records"] = len(notes_dict)
+
+    if args.sections:
+        with PROFILER.stage("sections") as stage:
+            from analysis.sections import write_sections  # pylint: disable=import-outside-toplevel
+
+            map_ids = notes_dict.map_names()
+            if args.mapanalysis:
+                maps_to_analyze_list = args.mapanalysis.split(",")
+                map_ids = [
+                    map_id
+                    for map_id in map_ids
+                    if any(
+                        map_to_analyze.lower() in MAP_SYMBOLS.name(map_id).lower()
+                        for map_to_analyze in maps_to_analyze_list
+                    )
+                ]
+            if len(window_specs) > 1:
+                csv_files = [f"sections-{size:g}{unit}-{DATETIME}.csv" for unit, size in window_specs]
+            else:
+                csv_files = [f"sections-{DATETIME}.csv"]
+            # Runs of each map are read from the store once for all the specs
+            write_sections(notes_dict, window_specs, map_ids, csv_files, MAP_SYMBOLS.name, PLAYER_SYMBOLS.name)
+            print(f"Sections written to {', '.join(csv_files)}\n")
+            stage["records"] = len(map_ids)
+    note_store.close()
 
     if args.graph and args.directory:
-        # Prepare maps infos with difficulty and stuff
-        load_diff_maps()
-        global_type_maps = classify_reference_maps_per_type(MAPS_MISC_INFOS)
-        types = global_type_maps.keys()
-        maps_per_type_and_date = {}
-        for type_maps in types:
-            maps_per_type_and_date[type_maps] = {}
-
-        # Try to cut the problem into pieces (by days)
-        files_by_date = classify_files_of_directory_by_date(args.directory)
-        for date, files in files_by_date.items():
-            logfile = merge_files(files)
-            cleaned_logfile = clean_logfile(logfile)
-            infos = parse_logfile(cleaned_logfile)
-            map_dict, averages_dict, notes_dict = retrieve_relevant_infos(infos, args.restrictmap)
+        with PROFILER.stage("graph") as stage:
+            # Prepare maps infos with difficulty and stuff
+            load_diff_maps()
+            global_type_maps = classify_reference_maps_per_type(MAPS_MISC_INFOS)
+            types = global_type_maps.keys()
+            maps_per_type_and_date = {}
+            for type_maps in types:
+                maps_per_type_and_date[type_maps] = {}
+
+            # Try to cut the problem into pieces (by days)
+            files_by_date = classify_files_of_directory_by_date(args.directory)
+            for date, files in files_by_date.items():
+                logfile = merge_files(files)
+                cleaned_logfile = clean_logfile(logfile)
+                infos = parse_logfile(cleaned_logfile)
+                map_dict, averages_dict, notes_dict = retrieve_relevant_infos(infos, args.restrictmap)
+
+                maps_per_type_and_date = classify_played_maps_per_type_and_date(
+                    map_dict, date, maps_per_type_and_date
+                )
+            xy_per_type = graphs_averages_per_type_and_date_as_csv(maps_per_type_and_date, args.show)
+            if args.publish:
+                pieces.update(trend_pieces(xy_per_type))
+            stage["records"] = len(files_by_date)
 
-            maps_per_type_and_date = classify_played_maps_per_type_and_date(
-                map_dict, date, maps_per_type_and_date
-            )
-        graphs_averages_per_type_and_date_as_csv(maps_per_type_and_date, args.show)
+    if args.publish and not args.milestones:
+        publish_pieces(args, pieces)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+#! /usr/bin/env python3
+
+""" Asynchronous drop-in for restful.py : same `POST /` json contract, same BSDlogs/<playerID>/<timestamp> files.
+
+    Runs are accepted concurrently by an asyncio HTTP/1.1 server (keep-alive,
+    chunked bodies) & acknowledged once appended to the journal of a durable
+    write queue (see backend/writequeue.py) : file writes happen in a dedicated
+    writer thread, never in the request handlers.
+
+    Usage : python restful_async.py [--port 8080] [--directory BSDlogs] [--nosync]
+    Load test : python -m bench.ingest_load --spawn
+"""
+
+from argparse import ArgumentParser
+from signal import SIGTERM, default_int_handler, signal
+from time import strftime
+import asyncio
+import json
+
+from backend.writequeue import WriteQueue, player_dir_name
+
+MAX_BODY = 64 * 1024 * 1024
+REASONS = {200: "OK", 400: "BAD REQUEST", 404: "NOT FOUND", 405: "METHOD NOT ALLOWED", 413: "REQUEST ENTITY TOO LARGE", 503: "SERVICE UNAVAILABLE"}
+
+
+class BadRequest(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def is_json(content_type):
+    """ Same rule as flask's request.json : a body is only decoded with a json mimetype """
+
+    mimetype = content_type.split(";")[0].strip().lower()
+    return mimetype == "application/json" or (mimetype.startswith("application/") and mimetype.endswith("+json"))
+
+
+async def read_headers(reader):
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            return headers
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+
+async def read_body(reader, headers):
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        body = []
+        size = 0
+        while True:
+            chunk_size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+            if not chunk_size:
+                await read_headers(reader)  # trailers
+                return b"".join(body)
+            size += chunk_size
+            if size > MAX_BODY:
+                raise BadRequest(413, "The data value transmitted exceeds the capacity limit.")
+            body.append(await reader.readexactly(chunk_size))
+            await reader.readline()
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY:
+        raise BadRequest(413, "The data value transmitted exceeds the capacity limit.")
+    return await reader.readexactly(length) if length else b""
+
+
+async def post_run(headers, body, write_queue):
+    if not is_json(headers.get("content-type", "")):
+        return 200, {"message": "NOk, not a valid json req"}
+    try:
+        record = json.loads(body)
+    except ValueError:
+        return 400, {"message": "The browser (or proxy) sent a request that this server could not understand."}
+    # restful.py checks `if request.json` : an empty object or list isn't a run either
+    if not record:
+        return 200, {"message": "NOk, not a valid json req"}
+    # Named when received (like restful.py), not when the writer gets to it
+    timestamp = strftime("%Y-%m-%d-%H-%M-%S")
+    try:
+        # The run is written as it was received (same json as restful.py wrote, maybe not the same spacing)
+        # unless it isn't utf-8, which parse_logs expects
+        if json.detect_encoding(body) != "utf-8":
+            body = json.dumps(record).encode()
+        await write_queue.submit(timestamp, player_dir_name(record), body)
+    except OSError:
+        return 503, {"message": "NOk, the run couldn't be saved"}
+    return 200, {"message": "Ok"}
+
+
+async def respond(method, target, headers, body, write_queue):
+    if target.split("?")[0] != "/":
+        return 404, {"message": "The requested URL was not found on the server."}
+    if method == "GET":
+        return 200, "Hi"
+    if method == "POST":
+        return await post_run(headers, body, write_queue)
+    return 405, {"message": "The method is not allowed for the requested URL."}
+
+
+async def handle_connection(reader, writer, write_queue):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            try:
+                method, target, version = request_line.decode("latin-1").split()
+                headers = await read_headers(reader)
+                body = await read_body(reader, headers)
+                status, payload = await respond(method, target, headers, body, write_queue)
+            except (ValueError, BadRequest) as err:
+                # Can't tell where the next request starts : the connection is closed after the answer
+                status = err.status if isinstance(err, BadRequest) else 400
+                payload = {"message": str(err) if isinstance(err, BadRequest) else "Bad request"}
+                version = "HTTP/1.0"
+                headers = {}
+            connection = headers.get("connection", "").lower()
+            keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+            # Same output as flask-restful (json & a newline)
+            content = (json.dumps(payload) + "\n").encode()
+            writer.write(
+                (
+                    f"{version} {status} {REASONS[status]}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(content)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                ).encode()
+                + content
+            )
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port, write_queue):
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(reader, writer, write_queue), host, port, backlog=1024
+    )
+    print(f"Listening on {host}:{port}, runs written to {write_queue.directory}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = ArgumentParser(prog="restful_async", description="Receives BeatSaviorData runs (POST /) & writes them to BSDlogs")
+    parser.add_argument("--host", type=str, help="address to listen on", default="0.0.0.0")
+    parser.add_argument("-p", "--port", type=int, help="port to listen on", default=8080)
+    parser.add_argument("-d", "--directory", type=str, help="where runs are written (one directory per player)", default="BSDlogs")
+    parser.add_argument("-j", "--journal", type=str, help="journal of the runs acknowledged but not written yet (default : <directory>/.journal)")
+    parser.add_argument(
+        "--nosync",
+        action="store_true",
+        help="acknowledges runs once in the journal without waiting for the disk (fsync) : faster, but a power loss can lose the last ones",
+    )
+    args = parser.parse_args()
+
+    write_queue = WriteQueue(args.directory, args.journal, not args.nosync)
+    replayed = write_queue.start()
+    if replayed:
+        print(f"{replayed} runs of the journal written (acknowledged before the last stop but not written)")
+    # Stopped like with ctrl-c (the runs in the queue are written first)
+    signal(SIGTERM, default_int_handler)
+    try:
+        asyncio.run(serve(args.host, args.port, write_queue))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Every acknowledged run is written before exiting
+        write_queue.close()
+        print(f"Stopped : {write_queue.stats}")
+
+
+if __name__ == "__main__":
+    main()